@@ -0,0 +1,4 @@
+"""In-process benchmarks. Run from backend/ as `python -m benchmarks.<name>`."""
+import os
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
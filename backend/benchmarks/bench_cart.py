@@ -0,0 +1,77 @@
+"""GET /cart latency against a live MongoDB as the cart grows.
+
+Seeds a scratch database (dropped afterwards) with one store's menu and a
+cart of N lines, then times get_cart with a cold and a warm product cache.
+Batched pricing keeps both columns flat in N; the old per-item lookups cost
+three round trips per line.
+
+    MONGO_URL=mongodb://localhost:27017 python -m benchmarks.bench_cart --items 1 5 15 50
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import server
+
+USER = {"id": "bench-user", "name": "Bench", "roles": ["customer"], "active_role": "customer"}
+
+async def seed(max_items: int):
+    products, variants, sizes = [], [], []
+    for p in range(max_items):
+        products.append({"id": f"p{p}", "store_id": "s1", "name": f"Product {p}", "created_at": f"{p:08d}"})
+        for v in range(3):
+            variants.append({"id": f"p{p}-v{v}", "product_id": f"p{p}", "name": f"Variant {v}", "price": 100 + v})
+            for s in range(3):
+                sizes.append({"id": f"p{p}-v{v}-s{s}", "variant_id": f"p{p}-v{v}",
+                              "name": f"Size {s}", "price_modifier": s * 10})
+    await server.db.products.insert_many(products)
+    await server.db.variants.insert_many(variants)
+    await server.db.sizes.insert_many(sizes)
+
+async def set_cart(item_count: int):
+    items = [{"item_id": f"i{n}", "product_id": f"p{n}", "variant_id": f"p{n}-v1",
+              "size_id": f"p{n}-v1-s2", "quantity": 1} for n in range(item_count)]
+    await server.db.carts.update_one({"user_id": USER["id"]},
+                                     {"$set": {"items": items, "store_id": "s1"}}, upsert=True)
+
+async def time_get_cart(repeats: int, warm: bool) -> float:
+    samples = []
+    for _ in range(repeats):
+        if not warm:
+            server.product_cache.clear()
+        start = time.perf_counter()
+        await server.get_cart(user=USER)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+async def run(item_counts, repeats):
+    client = AsyncIOMotorClient(server.mongo_url)
+    server.db = client["bench_cart"]
+    await client.drop_database("bench_cart")
+    await server.ensure_indexes()
+    try:
+        await seed(max(item_counts))
+        print(f"{'items':>6}  {'cold ms':>8}  {'warm ms':>8}")
+        for count in sorted(item_counts):
+            await set_cart(count)
+            cold = await time_get_cart(repeats, warm=False)
+            # Warm the product cache the way browsing the store page does
+            await server.hydrate_products(await server.db.products.find({}, {"_id": 0}).to_list(None))
+            warm = await time_get_cart(repeats, warm=True)
+            print(f"{count:>6}  {cold:>8.2f}  {warm:>8.2f}")
+    finally:
+        await client.drop_database("bench_cart")
+        client.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, nargs="+", default=[1, 5, 15, 50])
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(run(args.items, args.repeats))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Checkout (POST /orders) latency against a live MongoDB.
+
+Seeds a scratch database (dropped afterwards) with one store's menu, then
+repeatedly fills a cart and times create_order. Transactions need a replica
+set; a single local node is enough:
+
+    docker run -d -p 27017:27017 mongo:7 --replSet rs0
+    docker exec <container> mongosh --eval 'rs.initiate()'
+    MONGO_URL=mongodb://localhost:27017/?directConnection=true python -m benchmarks.bench_checkout --items 1 5 15
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from fastapi import BackgroundTasks
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import server
+from benchmarks.bench_cart import USER, seed, set_cart
+
+CHECKOUT = server.CheckoutRequest(delivery_address="1 Bench St", lat=12.9716, lng=77.5946)
+
+async def run(item_counts, repeats):
+    client = AsyncIOMotorClient(server.mongo_url)
+    server.db = client["bench_checkout"]
+    await client.drop_database("bench_checkout")
+    await server.ensure_indexes()
+    try:
+        await seed(max(item_counts))
+        await server.db.stores.insert_one({"id": "s1", "name": "Store", "merchant_id": "m1",
+                                           "lat": 12.97, "lng": 77.59, "total_orders": 0})
+        mode = "transaction" if await server.transactions_supported() else "standalone"
+        print(f"checkout writes: {mode}")
+        print(f"{'items':>6}  {'p50 ms':>8}  {'p95 ms':>8}")
+        for count in sorted(item_counts):
+            samples = []
+            for _ in range(repeats):
+                await set_cart(count)
+                tasks = BackgroundTasks()
+                start = time.perf_counter()
+                await server.create_order(CHECKOUT, tasks, user=USER)
+                samples.append((time.perf_counter() - start) * 1000)
+                await tasks()
+            samples.sort()
+            p95 = samples[int(len(samples) * 0.95) - 1]
+            print(f"{count:>6}  {statistics.median(samples):>8.2f}  {p95:>8.2f}")
+    finally:
+        await client.drop_database("bench_checkout")
+        client.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, nargs="+", default=[1, 5, 15])
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(run(args.items, args.repeats))
+
+if __name__ == "__main__":
+    main()
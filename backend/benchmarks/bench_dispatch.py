@@ -0,0 +1,70 @@
+"""Batch auto-dispatch matching at city scale.
+
+Times match_orders_to_agents over random orders and agents spread across
+a city, and compares the total pickup distance with greedy nearest-agent
+assignment over the same candidate pairs.
+
+    python -m benchmarks.bench_dispatch --orders 100 500 --agents 1000 10000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from server import AUTO_DISPATCH_RADIUS_KM, SpatialGrid, haversine_km, match_orders_to_agents
+
+CITY = (12.85, 77.45, 0.3)  # south-west corner lat, lng and span in degrees (~33km)
+
+def point(rng: random.Random) -> dict:
+    lat, lng, span = CITY
+    return {"type": "Point", "coordinates": [lng + rng.random() * span, lat + rng.random() * span]}
+
+def pickup_km(order: dict, agent: dict) -> float:
+    (olng, olat), (alng, alat) = order["pickup_location"]["coordinates"], agent["location"]["coordinates"]
+    return haversine_km(olat, olng, alat, alng)
+
+def greedy(orders, agents) -> list:
+    grid = SpatialGrid(AUTO_DISPATCH_RADIUS_KM)
+    by_id = {a["id"]: a for a in agents}
+    for agent in agents:
+        lng, lat = agent["location"]["coordinates"]
+        grid.add(agent["id"], lat, lng)
+    matched = []
+    for order in orders:
+        lng, lat = order["pickup_location"]["coordinates"]
+        near = grid.near(lat, lng, AUTO_DISPATCH_RADIUS_KM)
+        if near:
+            grid.remove(near[0][1])
+            matched.append((order, by_id[near[0][1]]))
+    return matched
+
+def median_ms(fn, repeats: int) -> float:
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, nargs="+", default=[100, 500])
+    parser.add_argument("--agents", type=int, nargs="+", default=[1_000, 10_000])
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    print(f"{'orders':>7}  {'agents':>7}  {'match ms':>9}  {'matched':>7}  {'avg km':>7}  {'greedy km':>9}")
+    for order_count in args.orders:
+        for agent_count in args.agents:
+            orders = [{"id": f"o{n}", "pickup_location": point(rng)} for n in range(order_count)]
+            agents = [{"id": f"a{n}", "name": "", "location": point(rng)} for n in range(agent_count)]
+            matched = match_orders_to_agents(orders, agents, {})
+            baseline = greedy(orders, agents)
+            ms = median_ms(lambda: match_orders_to_agents(orders, agents, {}), args.repeats)
+            avg = sum(pickup_km(o, a) for o, a in matched) / max(len(matched), 1)
+            greedy_avg = sum(pickup_km(o, a) for o, a in baseline) / max(len(baseline), 1)
+            print(f"{order_count:>7}  {agent_count:>7}  {ms:>9.1f}  {len(matched):>7}  {avg:>7.3f}  {greedy_avg:>9.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Promotion, cart pricing and order assembly hot-path benchmarks with JSON baselines.
+
+Runs in-process with a warm product cache, so no MongoDB is needed. Each
+case is timed in calibrated rounds with the GC off, like timeit, and
+reported as the best round's time per call.
+By default results are compared with the saved baseline and the run fails
+when any case is slower by more than --tolerance; --save records a new
+baseline. Baselines are machine specific: re-save them on the machine
+that runs the comparison.
+
+    python -m benchmarks.bench_hotpath            # compare with baseline
+    python -m benchmarks.bench_hotpath --save     # record baseline
+"""
+import argparse
+import asyncio
+import gc
+import json
+import platform
+import random
+import sys
+import time
+from pathlib import Path
+
+import server
+
+BASELINE = Path(__file__).parent / "baselines" / "hotpath.json"
+CART_SIZES = [1, 10, 50, 200]
+USER = {"id": "bench-user", "name": "Bench"}
+CHECKOUT = server.CheckoutRequest(delivery_address="1 Bench St", lat=12.9716, lng=77.5946)
+STORE = {"id": "s1", "name": "Store", "merchant_id": "m1", "lat": 12.97, "lng": 77.59}
+
+def measure(fn, rounds: int, min_round_s: float) -> float:
+    """Best µs per call over rounds, each looping long enough to time reliably"""
+    gc.collect()
+    gc.disable()
+    try:
+        return min(timed_rounds(fn, rounds, min_round_s))
+    finally:
+        gc.enable()
+
+def timed_rounds(fn, rounds: int, min_round_s: float) -> list:
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        if time.perf_counter() - start >= min_round_s:
+            break
+        loops *= 2
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        samples.append((time.perf_counter() - start) / loops * 1e6)
+    return samples
+
+def warm_catalog(size: int, rng: random.Random) -> list:
+    """Hydrated products in product_cache, and cart items referencing them"""
+    items = []
+    for p in range(size):
+        sizes = [{"id": f"p{p}-s{n}", "variant_id": f"p{p}-v0", "name": f"Size {n}", "price_modifier": n * 10}
+                 for n in range(3)]
+        variants = [{"id": f"p{p}-v0", "product_id": f"p{p}", "name": "Regular", "price": rng.randint(50, 500),
+                     "sizes": sizes}]
+        server.product_cache.set(f"p{p}", {"id": f"p{p}", "store_id": "s1", "name": f"Product {p}",
+                                           "image": "", "variants": variants})
+        items.append({"item_id": f"i{p}", "product_id": f"p{p}", "variant_id": f"p{p}-v0",
+                      "size_id": f"p{p}-s{p % 3}", "quantity": rng.randint(1, 4)})
+    return items
+
+def run_cases(rounds: int, min_round_s: float) -> dict:
+    rng = random.Random(5)
+    loop = asyncio.new_event_loop()
+    results = {}
+    quotes = [(rng.uniform(0, 2500), rng.uniform(0, 12)) for _ in range(1000)]
+    subtotals, distances = [q[0] for q in quotes], [q[1] for q in quotes]
+    results["promotions.scalar[1000]"] = measure(
+        lambda: [server.calculate_promotions(s, d) for s, d in quotes], rounds, min_round_s)
+    results["promotions.bulk[1000]"] = measure(
+        lambda: server.calculate_promotions_bulk(subtotals, distances), rounds, min_round_s)
+    items = warm_catalog(max(CART_SIZES), rng)
+    for size in CART_SIZES:
+        cart = items[:size]
+        results[f"price_cart[{size}]"] = measure(
+            lambda: loop.run_until_complete(server.price_cart(cart)), rounds, min_round_s)
+        lines, subtotal = loop.run_until_complete(server.price_cart(cart))
+        results[f"assemble_order[{size}]"] = measure(
+            lambda: server.assemble_order(USER, CHECKOUT, STORE, lines, subtotal, 2.4, 1), rounds, min_round_s)
+    loop.close()
+    return {name: round(us, 2) for name, us in results.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--save", action="store_true", help="record these results as the baseline")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown before failing")
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--min-round-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    results = run_cases(args.rounds, args.min_round_ms / 1000)
+    if args.save:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps({
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "unit": "us_per_call",
+            "results": results,
+        }, indent=2) + "\n")
+        for name, us in results.items():
+            print(f"{name:<28} {us:>12.2f} µs")
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    baseline = json.loads(args.baseline.read_text())["results"] if args.baseline.exists() else {}
+    regressions = []
+    print(f"{'case':<28} {'µs/call':>12} {'baseline':>12} {'change':>8}")
+    for name, us in results.items():
+        base = baseline.get(name)
+        change = (us - base) / base if base else None
+        print(f"{name:<28} {us:>12.2f} {base if base is not None else '-':>12} "
+              f"{f'{change:+.0%}' if change is not None else '-':>8}")
+        if change is not None and change > args.tolerance:
+            regressions.append(name)
+    if regressions:
+        print(f"Slower than baseline by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""Nearby-store query latency against a live MongoDB as the store count grows.
+
+Seeds a scratch database (dropped afterwards) with stores scattered around
+a city centre and times GET /stores/nearby's $geoNear pipeline.
+
+    MONGO_URL=mongodb://localhost:27017 python -m benchmarks.bench_nearby --sizes 1000 10000 50000
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import server
+
+CENTRE = (12.9716, 77.5946)
+
+def synthetic_store(i: int, rng: random.Random) -> dict:
+    # ~30 km square around the centre
+    lat = CENTRE[0] + rng.uniform(-0.15, 0.15)
+    lng = CENTRE[1] + rng.uniform(-0.15, 0.15)
+    return {"id": f"bench-{i}", "name": f"Store {i}", "lat": lat, "lng": lng,
+            "location": server.geo_point(lat, lng), "is_open": True, "total_orders": 0,
+            "created_at": f"2024-01-01T00:00:00.{i:06d}"}
+
+async def run(sizes, repeats, radius_km):
+    client = AsyncIOMotorClient(server.mongo_url)
+    server.db = client["bench_nearby"]
+    await server.db.stores.drop()
+    await server.ensure_indexes()
+    rng = random.Random(7)
+    seeded = 0
+    try:
+        print(f"{'stores':>8}  {'median ms':>10}  {'p95 ms':>8}  {'results':>8}")
+        for size in sorted(sizes):
+            await server.db.stores.insert_many([synthetic_store(i, rng) for i in range(seeded, size)])
+            seeded = size
+            samples, results = [], 0
+            for _ in range(repeats):
+                lat = CENTRE[0] + rng.uniform(-0.1, 0.1)
+                lng = CENTRE[1] + rng.uniform(-0.1, 0.1)
+                start = time.perf_counter()
+                stores = await server.get_nearby_stores(lat=lat, lng=lng, radius_km=radius_km)
+                samples.append((time.perf_counter() - start) * 1000)
+                results = len(stores)
+            samples.sort()
+            p95 = samples[int(len(samples) * 0.95) - 1]
+            print(f"{size:>8}  {statistics.median(samples):>10.2f}  {p95:>8.2f}  {results:>8}")
+    finally:
+        await client.drop_database("bench_nearby")
+        client.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 50_000])
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--radius-km", type=float, default=3)
+    args = parser.parse_args()
+    asyncio.run(run(args.sizes, args.repeats, args.radius_km))
+
+if __name__ == "__main__":
+    main()
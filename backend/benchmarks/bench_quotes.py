@@ -0,0 +1,50 @@
+"""Scalar vs vectorized promotion quotes.
+
+Times calculate_promotions in a Python loop against one
+calculate_promotions_bulk call over the same carts, and checks both agree.
+
+    python -m benchmarks.bench_quotes --sizes 100 1000 10000
+"""
+import argparse
+import random
+import statistics
+import time
+
+import numpy as np
+
+from server import calculate_promotions, calculate_promotions_bulk
+
+def synthetic_quotes(size: int, rng: random.Random) -> tuple:
+    subtotals = [round(rng.uniform(0, 2500), 2) for _ in range(size)]
+    distances = [round(rng.uniform(0, 12), 2) for _ in range(size)]
+    return subtotals, distances
+
+def median_ms(fn, repeats: int) -> float:
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1_000, 10_000])
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    print(f"{'quotes':>8}  {'scalar ms':>10}  {'vector ms':>10}  {'speedup':>8}")
+    for size in args.sizes:
+        subtotals, distances = synthetic_quotes(size, rng)
+        scalar = [calculate_promotions(s, d) for s, d in zip(subtotals, distances)]
+        bulk = calculate_promotions_bulk(subtotals, distances)
+        assert np.array_equal(bulk["delivery_fee"], [q["delivery_fee"] for q in scalar])
+        assert np.array_equal(bulk["free_delivery_applied"], [q["free_delivery_applied"] for q in scalar])
+        assert np.array_equal(bulk["gift_eligible"], [q["gift_eligible"] for q in scalar])
+        scalar_ms = median_ms(lambda: [calculate_promotions(s, d) for s, d in zip(subtotals, distances)], args.repeats)
+        vector_ms = median_ms(lambda: calculate_promotions_bulk(subtotals, distances), args.repeats)
+        print(f"{size:>8}  {scalar_ms:>10.2f}  {vector_ms:>10.2f}  {scalar_ms / vector_ms:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Search engine query latency as the catalog grows.
+
+    python -m benchmarks.bench_search --sizes 10000 100000 1000000
+
+Fails when a query's latency grows faster than (size ratio) ** --max-growth
+between the smallest and largest catalog.
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+
+from server import SearchIndex
+
+ADJECTIVES = ["classic", "spicy", "fresh", "organic", "crispy", "grilled", "smoked", "creamy", "masala", "tandoori",
+              "herb", "garlic", "honey", "paneer", "chilli", "butter", "roasted", "baked", "steamed", "tangy"]
+DISHES = ["burger", "pizza", "salad", "ramen", "sushi", "biryani", "dosa", "wrap", "noodles", "curry",
+          "sandwich", "pasta", "tacos", "momos", "kebab", "thali", "soup", "rolls", "fries", "cake"]
+QUERIES = ["paneer tikka", "spicy ramen", "sush", "garlic butter naan", "smoked brisket", "k"]
+# 'brisket' is in a fixed share of products, so its postings grow with the catalog; ranking
+# "smoked brisket" exactly means reading them, and it is reported without a growth bound
+UNBOUNDED = {"smoked brisket"}
+
+def synthetic_product(i: int, rng: random.Random) -> dict:
+    # A long tail of brand/sku words keeps the vocabulary growing with the catalog
+    brand = f"brand{rng.randint(0, max(10, i // 50))}"
+    name = f"{rng.choice(ADJECTIVES)} {rng.choice(DISHES)} {brand}"
+    if i % 97 == 0:
+        name += " tikka"
+    if i % 1009 == 0:
+        name += " brisket"
+    description = f"{rng.choice(ADJECTIVES)} {rng.choice(DISHES)} with {rng.choice(ADJECTIVES)} sides"
+    return {"id": f"p{i}", "name": name, "description": description}
+
+def time_queries(index: SearchIndex, repeats: int) -> dict:
+    results = {}
+    for q in QUERIES:
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            index.search(q, limit=20)
+            samples.append(time.perf_counter() - start)
+        results[q] = statistics.median(samples) * 1e6
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--max-growth", type=float, default=0.6,
+                        help="allowed latency growth exponent; 0.6 allows 15.8x over a 100x catalog")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    index = SearchIndex({"name": 3, "description": 1})
+    built = 0
+    timings = {}
+    print(f"{'products':>10}  " + "  ".join(f"{q!r:>22}" for q in QUERIES) + "   (median µs/query)")
+    for size in sorted(args.sizes):
+        start = time.perf_counter()
+        for i in range(built, size):
+            index.add(synthetic_product(i, rng))
+        built = size
+        build_s = time.perf_counter() - start
+        timings[size] = time_queries(index, args.repeats)
+        print(f"{size:>10}  " + "  ".join(f"{timings[size][q]:>22.1f}" for q in QUERIES) + f"   (+{build_s:.1f}s build)")
+
+    smallest, largest = min(timings), max(timings)
+    allowed = (largest / smallest) ** args.max_growth
+    growth = {q: timings[largest][q] / timings[smallest][q] for q in QUERIES}
+    print(f"{'growth':>10}  " + "  ".join(f"{growth[q]:>21.1f}x" for q in QUERIES) + f"   (allowed {allowed:.1f}x)")
+    too_slow = [q for q in QUERIES if q not in UNBOUNDED and growth[q] > allowed]
+    if too_slow:
+        print(f"Latency grew more than {allowed:.1f}x from {smallest} to {largest} products: {', '.join(too_slow)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,19 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import (FastAPI, APIRouter, BackgroundTasks, Depends, HTTPException, UploadFile, File, Request, Response,
+                     WebSocket, WebSocketDisconnect)
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-import os, logging, uuid, random, math
+import os, logging, uuid, random, math, time, hashlib, json, base64, asyncio, re, bisect, heapq, itertools
+from collections import OrderedDict, deque
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timezone, timedelta
 import jwt
+import numpy as np
 import bcrypt
 
 ROOT_DIR = Path(__file__).parent
@@ -27,6 +32,41 @@ JWT_ALGORITHM = "HS256"
 JWT_EXPIRY_HOURS = 72
 BASE_DELIVERY_FEE = 30.0
 PLATFORM_FEE_PERCENT = 5.0
+MAX_PAGE_SIZE = 100
+MAX_NEARBY_RADIUS_KM = 50
+MAX_BULK_QUOTES = 1000
+CATALOG_CACHE_SIZE = int(os.environ.get('CATALOG_CACHE_SIZE', '2000'))
+CATALOG_CACHE_TTL_SECONDS = float(os.environ.get('CATALOG_CACHE_TTL_SECONDS', '300'))
+CONTENT_VERSION_TTL_SECONDS = float(os.environ.get('CONTENT_VERSION_TTL_SECONDS', '2'))
+SEARCH_REFRESH_SECONDS = float(os.environ.get('SEARCH_REFRESH_SECONDS', '30'))
+SUGGEST_TOPK_DEPTH = 4
+SUGGEST_MAX_RESULTS = 20
+SUGGEST_SCAN_LIMIT = 1000
+EARTH_RADIUS_KM = 6371.0088
+DEFAULT_DISTANCE_KM = 2.0
+GEOHASH_PRECISION = 7  # ~150m cells; distances are quoted from the cell centre
+CART_STORE = os.environ.get('CART_STORE', 'mongo')  # "mongo" or "memory"
+CART_MEMORY_SIZE = int(os.environ.get('CART_MEMORY_SIZE', '10000'))
+CART_FLUSH_SECONDS = float(os.environ.get('CART_FLUSH_SECONDS', '2'))
+CART_FLUSH_MAX_DIRTY = int(os.environ.get('CART_FLUSH_MAX_DIRTY', '500'))
+DISPATCH_LEASE_SECONDS = float(os.environ.get('DISPATCH_LEASE_SECONDS', '30'))
+DISPATCH_SWEEP_SECONDS = float(os.environ.get('DISPATCH_SWEEP_SECONDS', '5'))
+DISPATCH_CANDIDATES = 5
+AUTO_DISPATCH_SECONDS = float(os.environ.get('AUTO_DISPATCH_SECONDS', '5'))  # 0 turns auto-dispatch off
+AUTO_DISPATCH_BATCH = 500
+AUTO_DISPATCH_RADIUS_KM = 5.0
+AUTO_DISPATCH_CANDIDATES = 8  # nearest agents considered per order
+AUTO_DISPATCH_LOAD_KM = 1.5  # each active order costs an agent as much as this much extra pickup distance
+AGENT_MAX_ACTIVE_ORDERS = 3
+AGENT_LOCATION_FRESH_SECONDS = 60
+AGENT_LOCATION_FLUSH_SECONDS = float(os.environ.get('AGENT_LOCATION_FLUSH_SECONDS', '2'))
+AGENT_LOCATION_BUFFER = int(os.environ.get('AGENT_LOCATION_BUFFER', '50000'))  # pings held for history between flushes
+AGENT_LOCATION_HISTORY_DAYS = 7
+AGENT_AUTH_TTL_SECONDS = 60
+MAX_LOCATION_BATCH = 500
+EVENT_QUEUE_SIZE = 100
+ORDER_NUMBER_BLOCK = int(os.environ.get('ORDER_NUMBER_BLOCK', '100'))
+ORDER_EVENTS = os.environ.get('ORDER_EVENTS', 'local')  # "local" or "changestream"
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -106,7 +146,7 @@ class CheckoutRequest(BaseModel):
     delivery_address: str
     lat: float = 0
     lng: float = 0
-    distance_km: float = 2.0
+    distance_km: float = 2.0  # ignored; the server computes distance from lat/lng
 
 class OrderStatusUpdate(BaseModel):
     status: str
@@ -126,6 +166,29 @@ class PromotionCreate(BaseModel):
     config: Dict[str, Any] = {}
     is_active: bool = True
 
+class QuoteItem(BaseModel):
+    subtotal: float = 0
+    distance_km: Optional[float] = None
+    store_id: str = ""
+
+class BulkQuoteRequest(BaseModel):
+    items: List[QuoteItem]
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+
+class DispatchClaim(BaseModel):
+    order_by: str = "nearest"  # "nearest" or "oldest"
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+
+class LocationPing(BaseModel):
+    lat: float
+    lng: float
+    at: Optional[float] = None  # epoch seconds the fix was taken; defaults to receipt
+
+class LocationBatch(BaseModel):
+    points: List[LocationPing]
+
 class SettlementRequest(BaseModel):
     amount: float = 0
 
@@ -162,6 +225,14 @@ async def require_role(user: dict, roles: List[str]):
     if user.get("active_role") not in roles and not any(r in user.get("roles", []) for r in roles):
         raise HTTPException(status_code=403, detail="Insufficient permissions")
 
+async def websocket_user(websocket: WebSocket) -> Optional[dict]:
+    """Authenticate a WebSocket from its ?token= query, since clients cannot set headers on one"""
+    try:
+        payload = jwt.decode(websocket.query_params.get("token", ""), JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.PyJWTError:
+        return None
+    return await db.users.find_one({"id": payload["user_id"]}, {"_id": 0})
+
 # ======================== AUTH ROUTES ========================
 
 @api_router.post("/auth/register")
@@ -229,37 +300,774 @@ async def update_profile(data: ProfileUpdate, user=Depends(get_current_user)):
 async def toggle_online(user=Depends(get_current_user)):
     new_status = not user.get("is_online", False)
     await db.users.update_one({"id": user["id"]}, {"$set": {"is_online": new_status}})
+    agent_auth_cache.invalidate(user["id"])
+    if not new_status:
+        agent_locations.remove(user["id"])
     return {"is_online": new_status}
 
+# ======================== CATALOG CACHE ========================
+
+class LRUCache:
+    """Bounded LRU cache with per-entry TTL and hit/miss/eviction counters.
+
+    Values are shared between callers and must be treated as read-only.
+    Invalidation is process-local; the TTL bounds staleness across workers.
+    """
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: str):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+# product id -> hydrated product; store id -> store page (store + hydrated products)
+product_cache = LRUCache(CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL_SECONDS)
+store_cache = LRUCache(CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL_SECONDS)
+
+# ======================== CONTENT VERSIONS & ETAGS ========================
+
+class ContentVersions:
+    """Per-resource version counters that back the ETags of public list endpoints.
+
+    Writers bump the counter in Mongo so every worker agrees; each worker
+    re-reads all counters at most once per ttl, so revalidating a cached
+    response normally costs no query at all.
+    """
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._versions: Dict[str, str] = {}
+        self._expires = 0.0
+
+    async def get(self, resource: str) -> str:
+        if time.monotonic() >= self._expires:
+            docs = await db.content_versions.find({}, {"_id": 0}).to_list(None)
+            self._versions = {d["resource"]: f"{d['epoch']}-{d['version']}" for d in docs}
+            self._expires = time.monotonic() + self.ttl
+        return self._versions.get(resource, "0")
+
+    async def bump(self, resource: str) -> str:
+        doc = await db.content_versions.find_one_and_update(
+            {"resource": resource},
+            {"$inc": {"version": 1}, "$setOnInsert": {"epoch": uuid.uuid4().hex[:8]}},
+            projection={"_id": 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._versions[resource] = f"{doc['epoch']}-{doc['version']}"
+        return self._versions[resource]
+
+content_versions = ContentVersions(CONTENT_VERSION_TTL_SECONDS)
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+async def conditional_get(request: Request, response: Response, *resources: str) -> Optional[Response]:
+    """Return a bodiless 304 if the client's ETag is current, else tag the response and return None"""
+    resource = ":".join(resources)
+    version = ":".join([await content_versions.get(r) for r in resources])
+    digest = hashlib.sha1(f"{resource}:{version}:{request.url.query}".encode()).hexdigest()[:20]
+    headers = {"ETag": f'"{digest}"', "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match", ""), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+# ======================== PAGINATION ========================
+
+def encode_cursor(doc: dict) -> str:
+    raw = json.dumps([doc.get("created_at", ""), doc["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, doc_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(created_at), str(doc_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def paginate(collection: str, query: dict, response: Response, limit: int, cursor: str = "",
+                   direction: int = DESCENDING, projection: Optional[dict] = None) -> List[dict]:
+    """Keyset page over (created_at, id); the next page's cursor goes in X-Next-Cursor"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if cursor:
+        created_at, doc_id = decode_cursor(cursor)
+        op = "$lt" if direction == DESCENDING else "$gt"
+        after = {"$or": [
+            {"created_at": {op: created_at}},
+            {"created_at": created_at, "id": {op: doc_id}}
+        ]}
+        query = {"$and": [query, after]} if query else after
+    docs = await db[collection].find(query, projection or {"_id": 0}).sort(
+        [("created_at", direction), ("id", direction)]
+    ).limit(limit + 1).to_list(limit + 1)
+    if len(docs) > limit:
+        docs = docs[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(docs[-1])
+    return docs
+
+# List endpoints return summaries; clients name extra fields with ?fields=a,b.c
+PAGE_KEY_FIELDS = ("id", "created_at")
+ORDER_SUMMARY_FIELDS = ("order_number", "store_name", "status", "total")
+PRODUCT_SUMMARY_FIELDS = ("name", "base_type", "store_id", "image")
+STORE_SUMMARY_FIELDS = ("name", "merchant_id", "address", "image", "is_open", "rating")
+# What ?fields= may add to each list; anything else, otp and dispatch leases included, is rejected
+ORDER_EXTRA_FIELDS = ("user_id", "user_name", "store_id", "merchant_id", "agent_id", "agent_name", "items",
+                      "subtotal", "delivery_fee", "platform_fee", "delivery_address", "lat", "lng", "distance_km",
+                      "promotions_applied", "updated_at")
+POOL_ORDER_EXTRA_FIELDS = ("store_id", "agent_id", "items", "subtotal", "delivery_fee", "delivery_address",
+                           "lat", "lng", "distance_km", "updated_at")
+PRODUCT_EXTRA_FIELDS = ("description", "merchant_id", "variants")
+STORE_EXTRA_FIELDS = ("working_hours", "total_orders", "lat", "lng", "location")
+FIELD_NAME = re.compile(r"[A-Za-z][A-Za-z0-9_]*(\.[A-Za-z][A-Za-z0-9_]*)*")
+MAX_FIELDS = 30
+
+def sparse_fields(fields: str, summary: tuple, extras: tuple) -> List[str]:
+    """Field names a list call asked for, or the summary; page keys are always included.
+
+    Only the summary and the endpoint's extras (or paths inside them) may be asked for.
+    """
+    names = [f.strip() for f in fields.split(",") if f.strip()] if fields else list(summary)
+    if len(names) > MAX_FIELDS or not all(FIELD_NAME.fullmatch(n) for n in names):
+        raise HTTPException(status_code=400, detail="Invalid fields")
+    allowed = {*PAGE_KEY_FIELDS, *summary, *extras}
+    unknown = sorted({n for n in names if n.split(".")[0] not in allowed})
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    # Mongo rejects overlapping paths, so "items" wins over "items.quantity"
+    names = sorted(set(PAGE_KEY_FIELDS) | set(names))
+    return [n for i, n in enumerate(names) if not any(n.startswith(m + ".") for m in names[:i])]
+
+def fields_projection(names: List[str]) -> dict:
+    return {"_id": 0, **{n: 1 for n in names}}
+
+# ======================== CATALOG HYDRATION ========================
+
+VARIANTS_PER_PRODUCT = 50
+SIZES_PER_VARIANT = 20
+
+async def hydrate_products(products: List[dict]) -> List[dict]:
+    """Attach variants and sizes to products with one batched query per level.
+
+    Products already in product_cache are served from it; the rest are
+    hydrated together and cached.
+    """
+    missing = []
+    for i, p in enumerate(products):
+        cached = product_cache.get(p["id"])
+        if cached is not None:
+            products[i] = cached
+        else:
+            missing.append(p)
+    if not missing:
+        return products
+    product_ids = [p["id"] for p in missing]
+    variants = await db.variants.find({"product_id": {"$in": product_ids}}, {"_id": 0}).to_list(None)
+    variant_ids = [v["id"] for v in variants]
+    sizes = []
+    if variant_ids:
+        sizes = await db.sizes.find({"variant_id": {"$in": variant_ids}}, {"_id": 0}).to_list(None)
+    sizes_by_variant: Dict[str, List[dict]] = {}
+    for s in sizes:
+        sizes_by_variant.setdefault(s["variant_id"], []).append(s)
+    variants_by_product: Dict[str, List[dict]] = {}
+    for v in variants:
+        v["sizes"] = sizes_by_variant.get(v["id"], [])[:SIZES_PER_VARIANT]
+        variants_by_product.setdefault(v["product_id"], []).append(v)
+    for p in missing:
+        p["variants"] = variants_by_product.get(p["id"], [])[:VARIANTS_PER_PRODUCT]
+        product_cache.set(p["id"], p)
+    return products
+
+# ======================== STORE MENU SNAPSHOTS ========================
+
+def menu_response(snapshot: dict) -> dict:
+    return {**snapshot["menu"], "menu_version": snapshot["version"]}
+
+async def rebuild_store_menu(store_id: str) -> Optional[dict]:
+    """Materialize the full store page into store_menus and bump its version"""
+    store = await db.stores.find_one({"id": store_id}, {"_id": 0})
+    if not store:
+        return None
+    products = await db.products.find({"store_id": store_id}, {"_id": 0}).to_list(100)
+    store["products"] = await hydrate_products(products)
+    return await db.store_menus.find_one_and_update(
+        {"store_id": store_id},
+        {"$set": {"menu": store, "updated_at": datetime.now(timezone.utc).isoformat()}, "$inc": {"version": 1}},
+        projection={"_id": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+async def patch_store_menu(store_id: str, update: dict, array_filter: Optional[dict] = None):
+    """Apply an update to an existing snapshot and bump its version.
+
+    Returns False when no snapshot matched; it is then built lazily on the next read.
+    """
+    query = {"store_id": store_id, **(array_filter or {})}
+    update = {**update, "$inc": {**update.get("$inc", {}), "version": 1}}
+    update.setdefault("$set", {})["updated_at"] = datetime.now(timezone.utc).isoformat()
+    result = await db.store_menus.update_one(query, update)
+    return result.matched_count > 0
+
+async def product_changed(product_id: str):
+    """Invalidate caches and re-snapshot one product after a catalog write.
+
+    Bumps the product's revision, which tells carts holding it to reprice.
+    """
+    product_cache.invalidate(product_id)
+    product = await db.products.find_one_and_update(
+        {"id": product_id}, {"$inc": {"revision": 1}},
+        projection={"_id": 0}, return_document=ReturnDocument.AFTER
+    )
+    if not product:
+        return
+    store_id = product.get("store_id", "")
+    await hydrate_products([product])
+    replaced = await patch_store_menu(
+        store_id, {"$set": {"menu.products.$": product}}, {"menu.products.id": product_id}
+    )
+    if not replaced:
+        await patch_store_menu(store_id, {"$push": {"menu.products": {"$each": [product], "$slice": 100}}})
+    store_cache.invalidate(store_id)
+    await catalog_written(product)
+
+# ======================== SEARCH ENGINE ========================
+
+SEARCH_STOPWORDS = {"a", "an", "and", "the", "of", "with", "in", "on", "for", "to", "or"}
+SEARCH_MAX_MATCHES = 1000
+SEARCH_PREFIX_EXPANSIONS = 50
+# Drivers with more postings than this stop at the requested page instead of being scanned whole
+SEARCH_FULL_SCAN_POSTINGS = 500
+# Driver postings probed to estimate the total when a query stops early
+SEARCH_TOTAL_SAMPLE = 256
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in re.findall(r"[a-z0-9]+", (text or "").lower()) if t not in SEARCH_STOPWORDS]
+
+class SearchIndex:
+    """In-memory inverted index with field-weighted BM25-style ranking.
+
+    Every query term must match; the last term also matches as a prefix so
+    results follow the user as they type. Postings are bucketed by weight, so
+    one bucket per query group fixes the score of every document in all of
+    them. Queries whose rarest group has few postings scan it whole. Larger
+    ones visit bucket combinations best-first, walk each combination's
+    shortest bucket probing the others, and stop once the requested page is
+    filled, so a common query costs about the same in a large catalog as in
+    a small one. A query that stops early reports an estimated total,
+    sampled from the rarest group's postings.
+    """
+    K1 = 1.2
+
+    def __init__(self, fields: Dict[str, int]):
+        self.fields = fields
+        self.postings: Dict[str, Dict[int, Dict[str, None]]] = {}
+        self.doc_freq: Dict[str, int] = {}
+        self.doc_terms: Dict[str, Dict[str, int]] = {}
+        self.vocabulary: List[str] = []
+        self.version = ""
+
+    def __len__(self):
+        return len(self.doc_terms)
+
+    def add(self, doc: dict):
+        doc_id = doc["id"]
+        self.remove(doc_id)
+        weights: Dict[str, int] = {}
+        for field, weight in self.fields.items():
+            for term in tokenize(doc.get(field, "")):
+                weights[term] = weights.get(term, 0) + weight
+        for term, weight in weights.items():
+            buckets = self.postings.get(term)
+            if buckets is None:
+                buckets = self.postings[term] = {}
+                self.doc_freq[term] = 0
+                bisect.insort(self.vocabulary, term)
+            buckets.setdefault(weight, {})[doc_id] = None
+            self.doc_freq[term] += 1
+        self.doc_terms[doc_id] = weights
+
+    def remove(self, doc_id: str):
+        for term, weight in self.doc_terms.pop(doc_id, {}).items():
+            buckets = self.postings[term]
+            del buckets[weight][doc_id]
+            if not buckets[weight]:
+                del buckets[weight]
+            self.doc_freq[term] -= 1
+            if not buckets:
+                del self.postings[term]
+                del self.doc_freq[term]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, term)]
+
+    def _expand(self, prefix: str) -> List[str]:
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        terms = []
+        for term in self.vocabulary[start:start + SEARCH_PREFIX_EXPANSIONS]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+
+    def _term_score(self, idf: float, weight: int) -> float:
+        return idf * weight * (self.K1 + 1) / (weight + self.K1)
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> tuple:
+        """Return (ranked doc ids for the requested page, total matches)"""
+        terms = tokenize(query)
+        if not terms:
+            return [], 0
+        groups = [[t] if t in self.postings else [] for t in terms[:-1]]
+        groups.append(self._expand(terms[-1]))
+        if not all(groups):
+            return [], 0
+        total_docs = len(self.doc_terms)
+        idf = {}
+        for group in groups:
+            for t in group:
+                df = self.doc_freq[t]
+                # Partial prefix matches rank below exact ones
+                idf[t] = math.log(1 + (total_docs - df + 0.5) / (df + 0.5)) * (1.0 if t in terms else 0.8)
+        groups.sort(key=lambda g: sum(self.doc_freq[t] for t in g))
+        # Each group's weight buckets, best first; a document scores its best bucket in every group
+        buckets = [
+            sorted(((self._term_score(idf[t], w), docs) for t in group for w, docs in self.postings[t].items()),
+                   key=lambda b: b[0], reverse=True)
+            for group in groups
+        ]
+        driver_docs = sum(self.doc_freq[t] for t in groups[0])
+        wanted = min(offset + limit, SEARCH_MAX_MATCHES)
+        if driver_docs > SEARCH_FULL_SCAN_POSTINGS and wanted:
+            # Probing is far cheaper than scoring, so a few passes' worth still beats the full scan
+            found = self._best_first(buckets, wanted, budget=4 * driver_docs)
+            if found is not None:
+                total = len(found) if len(found) < wanted else max(len(found), self._estimate_total(groups))
+                return found[offset:offset + limit], total
+        return self._scan(groups, idf, buckets[0], limit, offset)
+
+    def _best_first(self, buckets: List[list], wanted: int, budget: int) -> Optional[List[str]]:
+        """The first `wanted` matches in rank order, or None once this probes more than `budget` postings.
+
+        Combinations of one bucket per group are popped in descending score
+        order, so the first combination a document turns up in is its best
+        and every match found outranks those still queued.
+        """
+        start = (0,) * len(buckets)
+        queue = [(-sum(group[0][0] for group in buckets), start)]
+        queued = {start}
+        found, seen, probes = [], set(), 0
+        while queue:
+            _, combo = heapq.heappop(queue)
+            postings = sorted((buckets[g][b][1] for g, b in enumerate(combo)), key=len)
+            matches = iter(postings[0])
+            for docs in postings[1:]:
+                matches = filter(docs.__contains__, matches)
+            for doc_id in matches:
+                if doc_id not in seen:
+                    seen.add(doc_id)
+                    found.append(doc_id)
+                    if len(found) == wanted:
+                        return found
+            probes += len(postings[0])
+            if probes > budget:
+                return None
+            for g, b in enumerate(combo):
+                if b + 1 < len(buckets[g]):
+                    following = combo[:g] + (b + 1,) + combo[g + 1:]
+                    if following not in queued:
+                        queued.add(following)
+                        score = sum(buckets[k][c][0] for k, c in enumerate(following))
+                        heapq.heappush(queue, (-score, following))
+        return found
+
+    def _estimate_total(self, groups: List[List[str]]) -> int:
+        """Matches estimated from an even sample of every bucket of the rarest group"""
+        driver, others = groups[0], [set(group) for group in groups[1:]]
+        driver_docs = sum(self.doc_freq[t] for t in driver)
+        total = 0.0
+        for i, t in enumerate(driver):
+            earlier = set(driver[:i])
+            for docs in self.postings[t].values():
+                sample = max(1, SEARCH_TOTAL_SAMPLE * len(docs) // driver_docs)
+                hits = checked = 0
+                for doc_id in itertools.islice(docs, sample):
+                    checked += 1
+                    weights = self.doc_terms[doc_id]
+                    # Count documents matching several expansions under their first one only
+                    if earlier.isdisjoint(weights) and not any(group.isdisjoint(weights) for group in others):
+                        hits += 1
+                total += hits * len(docs) / checked
+        return round(total)
+
+    def _scan(self, groups: List[List[str]], idf: Dict[str, float], buckets: list, limit: int, offset: int) -> tuple:
+        """Score every posting of the rarest group, up to SEARCH_MAX_MATCHES matches"""
+        driver, others = groups[0], groups[1:]
+        other_terms = [[(t, idf[t]) for t in group] for group in others]
+        term_score = self._term_score
+        scores: Dict[str, float] = {}
+        seen = set()
+        exhausted = True
+        for bucket_score, docs in buckets:
+            for doc_id in docs:
+                if doc_id in seen:
+                    continue
+                seen.add(doc_id)
+                doc_weights = self.doc_terms[doc_id]
+                score = bucket_score
+                for group in other_terms:
+                    best = 0.0
+                    for t, t_idf in group:
+                        weight = doc_weights.get(t)
+                        if weight:
+                            best = max(best, term_score(t_idf, weight))
+                    if not best:
+                        break
+                    score += best
+                else:
+                    scores[doc_id] = score
+                    if len(scores) >= SEARCH_MAX_MATCHES:
+                        exhausted = False
+                        break
+            if not exhausted:
+                break
+        total = len(scores)
+        if not exhausted:
+            driver_docs = sum(self.doc_freq[t] for t in driver)
+            total = max(total, int(total * driver_docs / len(seen)))
+        ranked = heapq.nlargest(offset + limit, scores.items(), key=lambda x: (x[1], x[0]))
+        return [doc_id for doc_id, _ in ranked[offset:offset + limit]], total
+
+class SuggestIndex:
+    """Typeahead over store and product names using a sorted key array and bisect.
+
+    Each word start of a name is a key, so "sus" finds "Salmon Sushi Platter".
+    Matches rank by store popularity (total_orders; products inherit their
+    store's). Prefixes up to SUGGEST_TOPK_DEPTH characters, whose key ranges
+    are the largest, keep an incrementally maintained top-k; longer prefixes
+    scan their (small) bisected range and are memoized until the next write.
+    """
+    def __init__(self):
+        self.keys: List[tuple] = []
+        self.entries: Dict[tuple, dict] = {}
+        self.popularity: Dict[str, int] = {}
+        self.store_products: Dict[str, set] = {}
+        self.top: Dict[str, Dict[tuple, bool]] = {}
+        self.floor: Dict[str, tuple] = {}
+        self.versions = {"stores": "", "catalog": "", "popularity": ""}
+        self._memo = LRUCache(1000, SEARCH_REFRESH_SECONDS)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(re.findall(r"[a-z0-9]+", (text or "").lower()))
+
+    def _rank(self, match: tuple) -> tuple:
+        (kind, doc_id), name_start = match
+        return (self.popularity.get(self.entries[(kind, doc_id)]["store_id"], 0), name_start, kind == "store", doc_id)
+
+    def _entry(self, kind: str, doc_id: str, text: str, store_id: str) -> List[tuple]:
+        words = self.normalize(text).split(" ")
+        keys = [" ".join(words[i:]) for i in range(len(words)) if words[i]]
+        self.entries[(kind, doc_id)] = {"text": text, "store_id": store_id, "keys": keys}
+        if kind == "product":
+            self.store_products.setdefault(store_id, set()).add(doc_id)
+        return [(key, kind, doc_id) for key in keys]
+
+    def _short_prefixes(self, entry_key: tuple):
+        """(prefix, name_start) for every top-k prefix this entry can answer"""
+        for i, key in enumerate(self.entries[entry_key]["keys"]):
+            for n in range(1, min(len(key), SUGGEST_TOPK_DEPTH) + 1):
+                yield key[:n], i == 0
+
+    def _offer(self, entry_key: tuple):
+        for prefix, name_start in self._short_prefixes(entry_key):
+            pool = self.top.setdefault(prefix, {})
+            match = (entry_key, pool.get(entry_key, False) or name_start)
+            # Ranks only grow, so a stale floor just lets a few extra offers through
+            if entry_key not in pool and prefix in self.floor and self._rank(match) <= self.floor[prefix]:
+                continue
+            pool[entry_key] = match[1]
+            if len(pool) > SUGGEST_MAX_RESULTS:
+                del pool[min(pool.items(), key=self._rank)[0]]
+                self.floor[prefix] = self._rank(min(pool.items(), key=self._rank))
+
+    def _scan(self, prefix: str, limit: Optional[int] = None) -> Dict[tuple, bool]:
+        start = bisect.bisect_left(self.keys, (prefix,))
+        end = start + limit if limit else len(self.keys)
+        matches: Dict[tuple, bool] = {}
+        for key, kind, doc_id in self.keys[start:end]:
+            if not key.startswith(prefix):
+                break
+            name_start = key == self.entries[(kind, doc_id)]["keys"][0]
+            matches[(kind, doc_id)] = matches.get((kind, doc_id), False) or name_start
+        return matches
+
+    def _put(self, kind: str, doc_id: str, text: str, store_id: str):
+        self._remove((kind, doc_id))
+        for key in self._entry(kind, doc_id, text, store_id):
+            bisect.insort(self.keys, key)
+        self._offer((kind, doc_id))
+        self._memo.clear()
+
+    def _remove(self, entry_key: tuple):
+        entry = self.entries.get(entry_key)
+        if not entry:
+            return
+        stale = {prefix for prefix, _ in self._short_prefixes(entry_key)}
+        del self.entries[entry_key]
+        self.store_products.get(entry["store_id"], set()).discard(entry_key[1])
+        for key in entry["keys"]:
+            i = bisect.bisect_left(self.keys, (key, *entry_key))
+            if i < len(self.keys) and self.keys[i] == (key, *entry_key):
+                del self.keys[i]
+        for prefix in stale:
+            pool = self.top.get(prefix, {})
+            if entry_key in pool:
+                # Refill from a bounded scan; the rest of the pool is still ranked correctly
+                del pool[entry_key]
+                candidates = {**self._scan(prefix, SUGGEST_SCAN_LIMIT), **pool}
+                self.top[prefix] = dict(heapq.nlargest(SUGGEST_MAX_RESULTS, candidates.items(), key=self._rank))
+                self.floor.pop(prefix, None)
+
+    def add_store(self, store: dict):
+        entry_key = ("store", store["id"])
+        self.popularity[store["id"]] = store.get("total_orders", 0)
+        entry = self.entries.get(entry_key)
+        if entry and entry["text"] == store.get("name", ""):
+            # Popularity only: re-offer the store and its products to the top-k pools
+            self._offer(entry_key)
+            for product_id in self.store_products.get(store["id"], ()):
+                self._offer(("product", product_id))
+            self._memo.clear()
+            return
+        self._put("store", store["id"], store.get("name", ""), store["id"])
+
+    def add_product(self, product: dict):
+        entry = self.entries.get(("product", product["id"]))
+        if entry and (entry["text"], entry["store_id"]) == (product.get("name", ""), product.get("store_id", "")):
+            return
+        self._put("product", product["id"], product.get("name", ""), product.get("store_id", ""))
+
+    def load(self, stores: List[dict], products: List[dict]):
+        """Bulk (re)build with a single sort instead of per-key insertion"""
+        self.entries.clear()
+        self.store_products.clear()
+        self.popularity = {s["id"]: s.get("total_orders", 0) for s in stores}
+        keys = []
+        for s in stores:
+            keys += self._entry("store", s["id"], s.get("name", ""), s["id"])
+        for p in products:
+            keys += self._entry("product", p["id"], p.get("name", ""), p.get("store_id", ""))
+        keys.sort()
+        self.keys = keys
+        candidates: Dict[str, Dict[tuple, bool]] = {}
+        for entry_key in self.entries:
+            for prefix, name_start in self._short_prefixes(entry_key):
+                pool = candidates.setdefault(prefix, {})
+                pool[entry_key] = pool.get(entry_key, False) or name_start
+        self.top = {
+            prefix: dict(heapq.nlargest(SUGGEST_MAX_RESULTS, pool.items(), key=self._rank))
+            for prefix, pool in candidates.items()
+        }
+        self.floor = {
+            prefix: self._rank(min(pool.items(), key=self._rank))
+            for prefix, pool in self.top.items() if len(pool) == SUGGEST_MAX_RESULTS
+        }
+        self._memo.clear()
+
+    def suggest(self, prefix: str, limit: int = 8) -> List[dict]:
+        normalized = self.normalize(prefix)
+        if not normalized:
+            return []
+        if len(normalized) <= SUGGEST_TOPK_DEPTH:
+            ranked = heapq.nlargest(limit, self.top.get(normalized, {}).items(), key=self._rank)
+        else:
+            ranked = self._memo.get(normalized)
+            if ranked is None:
+                matches = self._scan(normalized, SUGGEST_SCAN_LIMIT)
+                ranked = heapq.nlargest(SUGGEST_MAX_RESULTS, matches.items(), key=self._rank)
+                self._memo.set(normalized, ranked)
+        result = []
+        for (kind, doc_id), _ in ranked[:limit]:
+            entry = self.entries[(kind, doc_id)]
+            result.append({"text": entry["text"], "type": kind, "id": doc_id, "store_id": entry["store_id"]})
+        return result
+
+store_search = SearchIndex({"name": 3})
+product_search = SearchIndex({"name": 3, "description": 1})
+suggest_index = SuggestIndex()
+
+def advance_version(current: str, bumped: str) -> str:
+    """The version an index may claim after applying its own write and bumping to `bumped`.
+
+    Only a bump straight from `current` proves the index has every write up
+    to `bumped`; if another worker bumped in between, the index keeps its
+    old version so refresh_search_indexes rebuilds and picks that write up.
+    """
+    epoch, _, number = bumped.rpartition("-")
+    previous = f"{epoch}-{int(number) - 1}" if int(number) > 1 else "0"
+    return bumped if current == previous else current
+
+async def catalog_written(product: dict):
+    """Feed a written product to the search indexes and publish the new catalog version"""
+    product_search.add(product)
+    suggest_index.add_product(product)
+    version = await content_versions.bump("catalog")
+    product_search.version = advance_version(product_search.version, version)
+    suggest_index.versions["catalog"] = advance_version(suggest_index.versions["catalog"], version)
+
+async def store_written(store: dict):
+    """Feed a written store to the search indexes and publish the new stores version"""
+    store_search.add(store)
+    suggest_index.add_store(store)
+    version = await content_versions.bump("stores")
+    store_search.version = advance_version(store_search.version, version)
+    suggest_index.versions["stores"] = advance_version(suggest_index.versions["stores"], version)
+
+async def store_popularity_changed(store: dict):
+    """Re-rank a store's suggestions after an order.
+
+    Popularity has its own content version, so orders never make other
+    workers reload the search indexes; they only re-read store totals.
+    """
+    suggest_index.add_store(store)
+    version = await content_versions.bump("popularity")
+    suggest_index.versions["popularity"] = advance_version(suggest_index.versions["popularity"], version)
+
+async def sync_store_popularity(version: str):
+    """Apply order counts written by other workers to the suggest ranking"""
+    stores = await db.stores.find({}, {"_id": 0, "id": 1, "name": 1, "total_orders": 1}).to_list(None)
+    for store in stores:
+        if suggest_index.popularity.get(store["id"]) != store.get("total_orders", 0):
+            suggest_index.add_store(store)
+    suggest_index.versions["popularity"] = version
+
+async def rebuild_search_index(index: SearchIndex, collection: str, resource: str) -> SearchIndex:
+    """Load a fresh copy of an index from Mongo, tagged with the content version it reflects.
+
+    The live index keeps serving searches until the caller swaps the copy in.
+    """
+    version = await content_versions.get(resource)
+    projection = {"_id": 0, "id": 1, **{field: 1 for field in index.fields}}
+    fresh = SearchIndex(index.fields)
+    async for doc in db[collection].find({}, projection):
+        fresh.add(doc)
+    fresh.version = version
+    logger.info(f"Search index for {collection} rebuilt with {len(fresh)} documents")
+    return fresh
+
+async def rebuild_suggest_index():
+    versions = {resource: await content_versions.get(resource) for resource in suggest_index.versions}
+    stores = await db.stores.find({}, {"_id": 0, "id": 1, "name": 1, "total_orders": 1}).to_list(None)
+    products = await db.products.find({}, {"_id": 0, "id": 1, "name": 1, "store_id": 1}).to_list(None)
+    suggest_index.load(stores, products)
+    suggest_index.versions = versions
+    logger.info(f"Suggest index rebuilt with {len(suggest_index.keys)} keys")
+
+async def refresh_search_indexes():
+    """Rebuild any index whose content version was bumped by another worker"""
+    global store_search, product_search
+    if await content_versions.get("stores") != store_search.version:
+        store_search = await rebuild_search_index(store_search, "stores", "stores")
+    if await content_versions.get("catalog") != product_search.version:
+        product_search = await rebuild_search_index(product_search, "products", "catalog")
+    for resource in ("stores", "catalog"):
+        if await content_versions.get(resource) != suggest_index.versions[resource]:
+            await rebuild_suggest_index()
+            break
+    popularity = await content_versions.get("popularity")
+    if popularity != suggest_index.versions["popularity"]:
+        await sync_store_popularity(popularity)
+
+async def search_refresh_loop():
+    while True:
+        await asyncio.sleep(SEARCH_REFRESH_SECONDS)
+        try:
+            await refresh_search_indexes()
+        except Exception as e:
+            logger.warning(f"Search index refresh failed: {e}")
+
+def search_ids(index: SearchIndex, q: str) -> List[str]:
+    """Matching ids for list-endpoint filters, ranked and capped at SEARCH_MAX_MATCHES"""
+    ids, _ = index.search(q, limit=SEARCH_MAX_MATCHES)
+    return ids
+
+async def fetch_ranked(collection: str, ids: List[str]) -> List[dict]:
+    docs = await db[collection].find({"id": {"$in": ids}}, {"_id": 0}).to_list(None)
+    by_id = {d["id"]: d for d in docs}
+    return [by_id[i] for i in ids if i in by_id]
+
 # ======================== PRODUCT ROUTES ========================
 
 @api_router.get("/products")
-async def get_products(store_id: str = "", search: str = "", base_type: str = ""):
+async def get_products(request: Request, response: Response, store_id: str = "", search: str = "",
+                       base_type: str = "", limit: int = 100, cursor: str = "", fields: str = ""):
+    """Product summaries; variants are only hydrated when fields asks for them"""
+    names = sparse_fields(fields, PRODUCT_SUMMARY_FIELDS, PRODUCT_EXTRA_FIELDS)
+    not_modified = await conditional_get(request, response, "catalog")
+    if not_modified:
+        return not_modified
     query = {}
     if store_id:
         query["store_id"] = store_id
     if base_type:
         query["base_type"] = base_type
     if search:
-        query["$or"] = [
-            {"name": {"$regex": search, "$options": "i"}},
-            {"description": {"$regex": search, "$options": "i"}}
-        ]
-    products = await db.products.find(query, {"_id": 0}).to_list(100)
-    for p in products:
-        p["variants"] = await db.variants.find({"product_id": p["id"]}, {"_id": 0}).to_list(50)
-        for v in p["variants"]:
-            v["sizes"] = await db.sizes.find({"variant_id": v["id"]}, {"_id": 0}).to_list(20)
-    return products
+        query["id"] = {"$in": search_ids(product_search, search)}
+    if not any(n.split(".")[0] == "variants" for n in names):
+        return await paginate("products", query, response, limit, cursor, direction=ASCENDING,
+                              projection=fields_projection(names))
+    # Hydration caches whole products, so trim copies of them afterwards
+    products = await hydrate_products(await paginate("products", query, response, limit, cursor, direction=ASCENDING))
+    keys = {n.split(".")[0] for n in names}
+    return [{k: v for k, v in p.items() if k in keys} for p in products]
 
 @api_router.get("/products/{product_id}")
 async def get_product(product_id: str):
+    cached = product_cache.get(product_id)
+    if cached is not None:
+        return cached
     product = await db.products.find_one({"id": product_id}, {"_id": 0})
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    product["variants"] = await db.variants.find({"product_id": product_id}, {"_id": 0}).to_list(50)
-    for v in product["variants"]:
-        v["sizes"] = await db.sizes.find({"variant_id": v["id"]}, {"_id": 0}).to_list(20)
+    await hydrate_products([product])
     return product
 
 @api_router.post("/products")
@@ -276,6 +1084,7 @@ async def create_product(data: ProductCreate, user=Depends(get_current_user)):
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.products.insert_one(product)
+    await product_changed(product["id"])
     result = {k: v for k, v in product.items() if k != "_id"}
     return result
 
@@ -293,6 +1102,7 @@ async def create_variant(data: VariantCreate, user=Depends(get_current_user)):
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.variants.insert_one(variant)
+    await product_changed(data.product_id)
     result = {k: v for k, v in variant.items() if k != "_id"}
     return result
 
@@ -307,30 +1117,78 @@ async def create_size(data: SizeCreate, user=Depends(get_current_user)):
         "is_default": data.is_default,
     }
     await db.sizes.insert_one(size)
+    variant = await db.variants.find_one({"id": data.variant_id}, {"_id": 0, "product_id": 1})
+    if variant:
+        await product_changed(variant["product_id"])
     result = {k: v for k, v in size.items() if k != "_id"}
     return result
 
 # ======================== STORE ROUTES ========================
 
+def geo_point(lat: float, lng: float) -> dict:
+    """GeoJSON point for 2dsphere queries (GeoJSON is [lng, lat])"""
+    return {"type": "Point", "coordinates": [lng, lat]}
+
+async def ensure_store_locations():
+    """Backfill the GeoJSON location of stores created before it existed"""
+    result = await db.stores.update_many(
+        {"location": {"$exists": False}},
+        [{"$set": {"location": {"type": "Point", "coordinates": ["$lng", "$lat"]}}}]
+    )
+    if result.modified_count:
+        logger.info(f"Backfilled location on {result.modified_count} stores")
+
 @api_router.get("/stores")
-async def get_stores(search: str = ""):
+async def get_stores(request: Request, response: Response, search: str = "", limit: int = 100, cursor: str = "",
+                     fields: str = ""):
+    names = sparse_fields(fields, STORE_SUMMARY_FIELDS, STORE_EXTRA_FIELDS)
+    # Order counts move with every order, so only responses carrying them track that version
+    versioned = ("stores", "popularity") if "total_orders" in names else ("stores",)
+    not_modified = await conditional_get(request, response, *versioned)
+    if not_modified:
+        return not_modified
     query = {}
     if search:
-        query["name"] = {"$regex": search, "$options": "i"}
-    stores = await db.stores.find(query, {"_id": 0}).to_list(100)
+        query["id"] = {"$in": search_ids(store_search, search)}
+    stores = await paginate("stores", query, response, limit, cursor, direction=ASCENDING,
+                            projection=fields_projection(names))
+    return stores
+
+@api_router.get("/stores/nearby")
+async def get_nearby_stores(lat: float, lng: float, radius_km: float = 5, limit: int = 50):
+    """Stores within radius_km of a point, nearest first, with distance_km"""
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise HTTPException(status_code=400, detail="Invalid coordinates")
+    radius_km = max(0.0, min(radius_km, MAX_NEARBY_RADIUS_KM))
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    stores = await db.stores.aggregate([
+        {"$geoNear": {
+            "near": geo_point(lat, lng),
+            "key": "location",
+            "distanceField": "distance_km",
+            "distanceMultiplier": 0.001,
+            "maxDistance": radius_km * 1000,
+            "spherical": True
+        }},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "location": 0}}
+    ]).to_list(limit)
+    for store in stores:
+        store["distance_km"] = round(store["distance_km"], 2)
     return stores
 
 @api_router.get("/stores/{store_id}")
 async def get_store(store_id: str):
-    store = await db.stores.find_one({"id": store_id}, {"_id": 0})
-    if not store:
+    cached = store_cache.get(store_id)
+    if cached is not None:
+        return cached
+    snapshot = await db.store_menus.find_one({"store_id": store_id}, {"_id": 0})
+    if not snapshot:
+        snapshot = await rebuild_store_menu(store_id)
+    if not snapshot:
         raise HTTPException(status_code=404, detail="Store not found")
-    products = await db.products.find({"store_id": store_id}, {"_id": 0}).to_list(100)
-    for p in products:
-        p["variants"] = await db.variants.find({"product_id": p["id"]}, {"_id": 0}).to_list(50)
-        for v in p["variants"]:
-            v["sizes"] = await db.sizes.find({"variant_id": v["id"]}, {"_id": 0}).to_list(20)
-    store["products"] = products
+    store = menu_response(snapshot)
+    store_cache.set(store_id, store)
     return store
 
 @api_router.post("/stores")
@@ -343,6 +1201,7 @@ async def create_store(data: StoreCreate, user=Depends(get_current_user)):
         "address": data.address,
         "lat": data.lat,
         "lng": data.lng,
+        "location": geo_point(data.lat, data.lng),
         "image": data.image,
         "is_open": True,
         "working_hours": data.working_hours,
@@ -351,6 +1210,7 @@ async def create_store(data: StoreCreate, user=Depends(get_current_user)):
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.stores.insert_one(store)
+    await store_written(store)
     result = {k: v for k, v in store.items() if k != "_id"}
     return result
 
@@ -360,78 +1220,592 @@ async def update_store(store_id: str, data: StoreUpdate, user=Depends(get_curren
     updates = {k: v for k, v in data.dict().items() if v is not None}
     if updates:
         await db.stores.update_one({"id": store_id}, {"$set": updates})
+        await patch_store_menu(store_id, {"$set": {f"menu.{k}": v for k, v in updates.items()}})
+        store_cache.invalidate(store_id)
     store = await db.stores.find_one({"id": store_id}, {"_id": 0})
+    if updates and store:
+        await store_written(store)
     return store
 
+# ======================== DELIVERY DISTANCE ========================
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance between two points in km"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def haversine_km_many(lat: float, lng: float, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    """haversine_km from one point to arrays of points"""
+    phi1, phi2 = np.radians(lat), np.radians(lats)
+    dphi = phi2 - phi1
+    dlmb = np.radians(lngs - lng)
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+def geohash_cell(lat: float, lng: float, precision: int = GEOHASH_PRECISION) -> tuple:
+    """Geohash of a point, returned with the centre (lat, lng) of its cell"""
+    lat_lo, lat_hi, lng_lo, lng_hi = -90.0, 90.0, -180.0, 180.0
+    chars = []
+    bits, value, even = 0, 0, True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            value <<= 1
+            if lng >= mid:
+                value |= 1
+                lng_lo = mid
+            else:
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            value <<= 1
+            if lat >= mid:
+                value |= 1
+                lat_lo = mid
+            else:
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return "".join(chars), ((lat_lo + lat_hi) / 2, (lng_lo + lng_hi) / 2)
+
+KM_PER_DEGREE = 111.32
+
+class SpatialGrid:
+    """Points bucketed into square lat/lng cells, so radius queries only visit nearby cells"""
+    def __init__(self, cell_km: float):
+        self.cell_deg = cell_km / KM_PER_DEGREE
+        self._cells: Dict[tuple, set] = {}
+        self._points: Dict[str, tuple] = {}
+
+    def __len__(self):
+        return len(self._points)
+
+    def _cell(self, lat: float, lng: float) -> tuple:
+        return math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg)
+
+    def add(self, key: str, lat: float, lng: float):
+        """Place key at (lat, lng), moving it if it was already placed"""
+        self.remove(key)
+        self._points[key] = (lat, lng)
+        self._cells.setdefault(self._cell(lat, lng), set()).add(key)
+
+    def remove(self, key: str):
+        point = self._points.pop(key, None)
+        if point is not None:
+            cell = self._cell(*point)
+            self._cells[cell].discard(key)
+            if not self._cells[cell]:
+                del self._cells[cell]
+
+    def near(self, lat: float, lng: float, radius_km: float) -> List[tuple]:
+        """(km, key) for every point within radius_km, nearest first"""
+        row, col = self._cell(lat, lng)
+        rows = math.ceil(radius_km / (KM_PER_DEGREE * self.cell_deg))
+        cols = math.ceil(radius_km / (KM_PER_DEGREE * self.cell_deg * max(math.cos(math.radians(lat)), 0.01)))
+        keys = [key for r in range(row - rows, row + rows + 1) for c in range(col - cols, col + cols + 1)
+                for key in self._cells.get((r, c), ())]
+        if not keys:
+            return []
+        points = np.array([self._points[key] for key in keys])
+        km = haversine_km_many(lat, lng, points[:, 0], points[:, 1])
+        return sorted((d, key) for d, key in zip(km.tolist(), keys) if d <= radius_km)
+
+# "store_id:geohash" -> km; store coordinates rarely change, so the catalog TTL applies
+distance_cache = LRUCache(CATALOG_CACHE_SIZE * 10, CATALOG_CACHE_TTL_SECONDS)
+
+async def delivery_distance_km(store_id: str, lat: float, lng: float, store: Optional[dict] = None) -> float:
+    """Road-agnostic store-to-customer distance, cached per (store, geohash cell)"""
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise HTTPException(status_code=400, detail="Invalid coordinates")
+    # Clients that send no delivery point leave it at (0, 0) and get the default distance
+    if not (lat or lng):
+        return DEFAULT_DISTANCE_KM
+    cell, (cell_lat, cell_lng) = geohash_cell(lat, lng)
+    key = f"{store_id}:{cell}"
+    distance = distance_cache.get(key)
+    if distance is not None:
+        return distance
+    if store is None:
+        store = await db.stores.find_one({"id": store_id}, {"_id": 0, "lat": 1, "lng": 1})
+    # Stores created without coordinates sit at (0, 0), which is as unknown as a missing point
+    if not store or not (store.get("lat") or store.get("lng")):
+        return DEFAULT_DISTANCE_KM
+    distance = round(haversine_km(store["lat"], store["lng"], cell_lat, cell_lng), 2)
+    distance_cache.set(key, distance)
+    return distance
+
+# ======================== CART STORAGE ========================
+
+CART_MUTATION_ATTEMPTS = 3
+
+class MongoCartStore:
+    """Carts read and written straight through to db.carts.
+
+    Every mutation is a single atomic update. The quantity $inc and the
+    new-line $push are both guarded by the cart's store and by whether a
+    matching line exists, so concurrent adds never lose an update or
+    duplicate a line. A $push that loses a race (or finds a cart for another
+    store) trips the unique user_id index and retries.
+    """
+    async def get(self, user_id: str) -> Optional[dict]:
+        return await db.carts.find_one({"user_id": user_id}, {"_id": 0})
+
+    async def add_item(self, user_id: str, store_id: str, line: dict, quantity: int, revision: int) -> int:
+        priced_line = None
+        for _ in range(CART_MUTATION_ATTEMPTS):
+            cart = await db.carts.find_one_and_update(
+                {"user_id": user_id, "store_id": store_id, "items": {"$elemMatch": line}},
+                {"$inc": {"items.$.quantity": quantity}},
+                projection={"_id": 0, "items.item_id": 1},
+                return_document=ReturnDocument.AFTER
+            )
+            if cart:
+                return len(cart["items"])
+            if priced_line is None:
+                priced_line, version = await price_new_line(line, quantity, revision)
+            try:
+                before = await db.carts.find_one_and_update(
+                    {"user_id": user_id, "store_id": store_id, "items": {"$not": {"$elemMatch": line}}},
+                    {"$push": {"items": priced_line}, "$setOnInsert": {"priced_version": version}},
+                    projection={"_id": 0, "items.item_id": 1},
+                    upsert=True,
+                    return_document=ReturnDocument.BEFORE
+                )
+                return len((before or {}).get("items", [])) + 1
+            except DuplicateKeyError:
+                # Cart exists for another store: clear it for the new one, then retry
+                await db.carts.update_one(
+                    {"user_id": user_id, "store_id": {"$ne": store_id}},
+                    {"$set": {"items": [], "store_id": store_id}}
+                )
+        raise HTTPException(status_code=409, detail="Cart changed concurrently, please retry")
+
+    async def update_item(self, user_id: str, item_id: str, quantity: int) -> bool:
+        if quantity <= 0:
+            result = await db.carts.update_one({"user_id": user_id}, {"$pull": {"items": {"item_id": item_id}}})
+        else:
+            result = await db.carts.update_one(
+                {"user_id": user_id, "items.item_id": item_id},
+                {"$set": {"items.$.quantity": quantity}}
+            )
+        return bool(result.matched_count)
+
+    async def clear(self, user_id: str):
+        await db.carts.update_one({"user_id": user_id}, {"$set": {"items": []}})
+
+    async def checkout(self, user_id: str, items: List[dict], session) -> bool:
+        """Empty the cart inside the checkout transaction if it still holds exactly items"""
+        result = await db.carts.update_one({"user_id": user_id, "items": items}, {"$set": {"items": []}},
+                                           session=session)
+        return bool(result.matched_count)
+
+    def checked_out(self, user_id: str, items: List[dict]):
+        pass
+
+    async def save_prices(self, user_id: str, items: List[dict], priced: List[dict], version: str):
+        """Replace the cart's lines with repriced ones unless they changed meanwhile"""
+        await db.carts.update_one({"user_id": user_id, "items": items},
+                                  {"$set": {"items": priced, "priced_version": version}})
+
+    async def flush(self, user_id: Optional[str] = None):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": "mongo"}
+
+class MemoryCartStore:
+    """Process-local cart tier with write-behind persistence to db.carts.
+
+    Mutations edit the in-memory cart with no await between reading and
+    writing it, so they are atomic within the event loop. Dirty carts are
+    written back in one unordered bulk_write every flush_interval seconds
+    and as soon as max_dirty carts are pending; checkout persists its
+    emptied cart in the order transaction. A crash loses at most
+    flush_interval seconds of cart edits. Misses fall back to db.carts.
+    Only clean carts are evicted. Carts live in a single worker, so
+    running several workers with this tier needs session affinity.
+    """
+    def __init__(self, maxsize: int, flush_interval: float, max_dirty: int):
+        self.maxsize = maxsize
+        self.flush_interval = flush_interval
+        self.max_dirty = max_dirty
+        self._carts: "OrderedDict[str, dict]" = OrderedDict()
+        self._dirty: set = set()
+        self._flushing: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+
+    async def _load(self, user_id: str) -> Optional[dict]:
+        cart = self._carts.get(user_id)
+        if cart is not None:
+            self._carts.move_to_end(user_id)
+            self.hits += 1
+            return cart
+        self.misses += 1
+        stored = await db.carts.find_one({"user_id": user_id}, {"_id": 0})
+        # Another request may have loaded or created the cart while we waited
+        if user_id in self._carts:
+            return self._carts[user_id]
+        if stored is not None:
+            self._carts[user_id] = stored
+            self._evict()
+        return stored
+
+    def _evict(self):
+        while len(self._carts) > self.maxsize:
+            victim = next((uid for uid in self._carts if uid not in self._dirty), None)
+            if victim is None:
+                return
+            del self._carts[victim]
+
+    def _touch(self, user_id: str):
+        self._dirty.add(user_id)
+        if len(self._dirty) >= self.max_dirty and (self._flushing is None or self._flushing.done()):
+            self._flushing = asyncio.create_task(self.flush())
+
+    @staticmethod
+    def _line(cart: Optional[dict], store_id: str, line: dict) -> Optional[dict]:
+        if not cart or cart.get("store_id") != store_id:
+            return None
+        return next((i for i in cart["items"] if all(i.get(k, "") == v for k, v in line.items())), None)
+
+    async def get(self, user_id: str) -> Optional[dict]:
+        cart = await self._load(user_id)
+        if cart is None:
+            return None
+        return {**cart, "items": [dict(i) for i in cart["items"]]}
+
+    async def add_item(self, user_id: str, store_id: str, line: dict, quantity: int, revision: int) -> int:
+        cart = await self._load(user_id)
+        existing = self._line(cart, store_id, line)
+        if existing is None:
+            priced_line, version = await price_new_line(line, quantity, revision)
+            # Re-read after awaiting: the cart may have been created or changed meanwhile
+            cart = await self._load(user_id)
+            existing = self._line(cart, store_id, line)
+        if existing is not None:
+            existing["quantity"] += quantity
+        else:
+            if cart is None:
+                cart = self._carts[user_id] = {"user_id": user_id, "store_id": store_id,
+                                               "items": [], "priced_version": version}
+            elif cart.get("store_id") != store_id:
+                cart["items"] = []
+                cart["store_id"] = store_id
+            cart["items"].append(priced_line)
+        self._touch(user_id)
+        self._evict()
+        return len(cart["items"])
+
+    async def update_item(self, user_id: str, item_id: str, quantity: int) -> bool:
+        cart = await self._load(user_id)
+        if cart is None:
+            return False
+        if quantity <= 0:
+            cart["items"] = [i for i in cart["items"] if i["item_id"] != item_id]
+        else:
+            item = next((i for i in cart["items"] if i["item_id"] == item_id), None)
+            if item is None:
+                return False
+            item["quantity"] = quantity
+        self._touch(user_id)
+        return True
+
+    async def clear(self, user_id: str):
+        cart = await self._load(user_id)
+        if cart is not None:
+            cart["items"] = []
+            self._touch(user_id)
+
+    async def checkout(self, user_id: str, items: List[dict], session) -> bool:
+        """Persist the emptied cart inside the checkout transaction; memory follows on commit"""
+        cart = self._carts.get(user_id)
+        if cart is None or cart["items"] != items:
+            return False
+        await db.carts.update_one({"user_id": user_id},
+                                  {"$set": {"items": [], "store_id": cart.get("store_id", "")}},
+                                  upsert=True, session=session)
+        return True
+
+    def checked_out(self, user_id: str, items: List[dict]):
+        """Drop the ordered lines, keeping any added while checkout was committing"""
+        cart = self._carts.get(user_id)
+        if cart is None:
+            return
+        ordered = {i["item_id"] for i in items}
+        cart["items"] = [i for i in cart["items"] if i["item_id"] not in ordered]
+        if cart["items"]:
+            self._touch(user_id)
+        else:
+            self._dirty.discard(user_id)
+
+    async def save_prices(self, user_id: str, items: List[dict], priced: List[dict], version: str):
+        cart = self._carts.get(user_id)
+        if cart is not None and cart["items"] == items:
+            cart["items"] = priced
+            cart["priced_version"] = version
+            self._touch(user_id)
+
+    async def flush(self, user_id: Optional[str] = None):
+        """Write dirty carts (or just user_id's) back to db.carts in one batch"""
+        ids = [u for u in ([user_id] if user_id is not None else list(self._dirty)) if u in self._dirty]
+        if not ids:
+            return
+        self._dirty.difference_update(ids)
+        ops = [ReplaceOne({"user_id": u}, {**self._carts[u], "items": [dict(i) for i in self._carts[u]["items"]]},
+                          upsert=True) for u in ids]
+        try:
+            await db.carts.bulk_write(ops, ordered=False)
+        except Exception:
+            self._dirty.update(ids)
+            raise
+        self.flushes += 1
+        self._evict()
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "size": len(self._carts),
+            "maxsize": self.maxsize,
+            "dirty": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "flushes": self.flushes,
+            "flush_interval_seconds": self.flush_interval,
+        }
+
+async def cart_flush_loop():
+    while True:
+        await asyncio.sleep(cart_store.flush_interval)
+        try:
+            await cart_store.flush()
+        except Exception as e:
+            logger.warning(f"Cart flush failed: {e}")
+
+cart_store = (MemoryCartStore(CART_MEMORY_SIZE, CART_FLUSH_SECONDS, CART_FLUSH_MAX_DIRTY)
+              if CART_STORE == "memory" else MongoCartStore())
+
 # ======================== CART & PROMOTION ENGINE ========================
 
-def calculate_promotions(subtotal: float, distance_km: float):
-    """Core promotion engine logic"""
-    promotions = {
-        "gift_eligible": False,
-        "gift_message": "",
-        "upsell_message": "",
-        "free_delivery_applied": False,
-        "free_delivery_message": "",
-        "delivery_fee": BASE_DELIVERY_FEE
-    }
-    # Gift with Purchase: IF Cart_Value > 1000 THEN auto add gift
-    if subtotal > 1000:
-        promotions["gift_eligible"] = True
-        promotions["gift_message"] = "You've earned a FREE gift with your purchase!"
-    # Upsell Nudge: IF Cart_Value < 1000 THEN show message
-    elif subtotal > 0:
-        remaining = 1000 - subtotal
-        promotions["upsell_message"] = f"Add ₹{remaining:.0f} more to get a FREE gift!"
-    # Dynamic Free Delivery Logic
-    # Logic A: IF Cart > 499 AND Distance < 3km THEN Delivery_Fee = 0
-    if subtotal > 499 and distance_km < 3:
-        promotions["free_delivery_applied"] = True
-        promotions["delivery_fee"] = 0
-        promotions["free_delivery_message"] = "Free Delivery Applied!"
-    # Logic B: IF Cart > 999 AND Distance < 5km THEN Delivery_Fee = 0
-    elif subtotal > 999 and distance_km < 5:
-        promotions["free_delivery_applied"] = True
-        promotions["delivery_fee"] = 0
-        promotions["free_delivery_message"] = "Free Delivery Applied!"
-    else:
-        # Calculate delivery fee based on distance
-        promotions["delivery_fee"] = BASE_DELIVERY_FEE + max(0, (distance_km - 2) * 10)
-        if subtotal > 499:
-            remaining = 0
-            if distance_km < 3:
-                promotions["free_delivery_message"] = "Free Delivery Applied!"
-                promotions["free_delivery_applied"] = True
-                promotions["delivery_fee"] = 0
-            else:
-                needed = 1000 - subtotal if subtotal < 1000 else 0
+DEFAULT_PROMOTIONS = [
+    {"name": "Gift with Purchase", "promo_type": "gift",
+     "config": {"min_cart_value": 1000, "gift_message": "Free gift with orders over ₹1000!"}},
+    {"name": "Free Delivery - Near", "promo_type": "free_delivery",
+     "config": {"min_cart_value": 499, "max_distance_km": 3}},
+    {"name": "Free Delivery - Far", "promo_type": "free_delivery",
+     "config": {"min_cart_value": 999, "max_distance_km": 5}},
+]
+
+# Config fields each promotion type compiles from, and whether they are required
+PROMOTION_RULE_FIELDS = {
+    "gift": {"min_cart_value": True},
+    "free_delivery": {"min_cart_value": True, "max_distance_km": False},
+}
+
+def promotion_config_error(promo_type: str, config: Any) -> Optional[str]:
+    """Why a promotion cannot be compiled, or None if it can"""
+    fields = PROMOTION_RULE_FIELDS.get(promo_type)
+    if fields is None:
+        return f"Unknown promo_type '{promo_type}'"
+    if not isinstance(config, dict):
+        return "config must be an object"
+    for field, required in fields.items():
+        value = config.get(field)
+        if value is None:
+            if required:
+                return f"config.{field} is required"
+        elif isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value < math.inf:
+            return f"config.{field} must be a non-negative number"
+    return None
+
+class PromotionEngine:
+    """Active promotions compiled into threshold tables.
+
+    Free-delivery rules are sorted by minimum cart value alongside a running
+    maximum of their distance limits, so deciding whether any rule applies
+    is one bisect. Gift rules reduce to their lowest threshold. Customers
+    past the first free-delivery threshold are nudged towards the rule with
+    the widest reach.
+    """
+    def __init__(self, promotions: List[dict], version: Optional[str] = None):
+        self.version = version
+        valid = []
+        for p in promotions:
+            if p.get("promo_type") not in PROMOTION_RULE_FIELDS:
+                continue
+            error = promotion_config_error(p["promo_type"], p.get("config"))
+            if error:
+                logger.warning(f"Skipping promotion {p.get('id') or p.get('name')}: {error}")
+                continue
+            valid.append(p)
+        promotions = valid
+        gifts = [p["config"]["min_cart_value"] for p in promotions if p.get("promo_type") == "gift"]
+        self.gift_threshold = min(gifts) if gifts else None
+        rules = sorted(
+            (p["config"]["min_cart_value"], p["config"].get("max_distance_km", math.inf))
+            for p in promotions if p.get("promo_type") == "free_delivery"
+        )
+        self.min_values = [min_value for min_value, _ in rules]
+        self.reach = []
+        for _, max_distance in rules:
+            self.reach.append(max(max_distance, self.reach[-1]) if self.reach else max_distance)
+        self.nudge = max(rules, key=lambda r: (r[1], r[0])) if rules else None
+
+    def quote(self, subtotal: float, distance_km: float) -> dict:
+        promotions = {
+            "gift_eligible": False,
+            "gift_message": "",
+            "upsell_message": "",
+            "free_delivery_applied": False,
+            "free_delivery_message": "",
+            "delivery_fee": BASE_DELIVERY_FEE
+        }
+        if self.gift_threshold is not None:
+            if subtotal > self.gift_threshold:
+                promotions["gift_eligible"] = True
+                promotions["gift_message"] = "You've earned a FREE gift with your purchase!"
+            elif subtotal > 0:
+                remaining = self.gift_threshold - subtotal
+                promotions["upsell_message"] = f"Add ₹{remaining:.0f} more to get a FREE gift!"
+        # Number of free-delivery rules whose minimum the cart clears
+        cleared = bisect.bisect_left(self.min_values, subtotal)
+        if cleared and distance_km < self.reach[cleared - 1]:
+            promotions["free_delivery_applied"] = True
+            promotions["delivery_fee"] = 0
+            promotions["free_delivery_message"] = "Free Delivery Applied!"
+        else:
+            # Calculate delivery fee based on distance
+            promotions["delivery_fee"] = BASE_DELIVERY_FEE + max(0, (distance_km - 2) * 10)
+            if cleared:
+                min_value, max_distance = self.nudge
+                needed = min_value + 1 - subtotal if subtotal < min_value + 1 else 0
                 if needed > 0:
-                    promotions["free_delivery_message"] = f"Add ₹{needed:.0f} for free delivery (within 5km)"
-                elif distance_km >= 5:
+                    promotions["free_delivery_message"] = f"Add ₹{needed:.0f} for free delivery (within {max_distance:g}km)"
+                elif distance_km >= max_distance:
                     promotions["free_delivery_message"] = "Free delivery not available for this distance"
-        elif subtotal > 0:
-            needed_499 = 499 - subtotal + 1
-            promotions["free_delivery_message"] = f"Add ₹{needed_499:.0f} to get free delivery!"
+            elif subtotal > 0 and self.min_values:
+                needed = self.min_values[0] - subtotal + 1
+                promotions["free_delivery_message"] = f"Add ₹{needed:.0f} to get free delivery!"
+        return promotions
+
+    def quote_many(self, subtotals, distances) -> dict:
+        """Delivery fee and promotion flags of quote() for arrays of carts.
+
+        Messages are left to quote(); everything else is evaluated with the
+        same thresholds as whole-array NumPy operations.
+        """
+        subtotals = np.asarray(subtotals, dtype=float)
+        distances = np.asarray(distances, dtype=float)
+        cleared = np.searchsorted(np.asarray(self.min_values, dtype=float), subtotals, side="left")
+        # reach[0] covers carts that clear no rule
+        reach = np.concatenate(([-np.inf], np.asarray(self.reach, dtype=float)))
+        applied = distances < reach[cleared]
+        fees = np.where(applied, 0.0, BASE_DELIVERY_FEE + np.maximum(0, (distances - 2) * 10))
+        if self.gift_threshold is None:
+            gifts = np.zeros(subtotals.shape, dtype=bool)
+        else:
+            gifts = subtotals > self.gift_threshold
+        return {"delivery_fee": fees, "free_delivery_applied": applied, "gift_eligible": gifts}
+
+promotion_engine = PromotionEngine(DEFAULT_PROMOTIONS)
+
+async def refresh_promotion_engine():
+    """Recompile the engine from db.promotions when its content version moves"""
+    global promotion_engine
+    version = await content_versions.get("promotions")
+    if version != promotion_engine.version:
+        promos = await db.promotions.find({"is_active": True}, {"_id": 0}).to_list(None)
+        try:
+            promotion_engine = PromotionEngine(promos, version)
+        except Exception as e:
+            # Keep quoting with the last good rules rather than failing every cart
+            logger.error(f"Promotion rules at version {version} failed to compile: {e}")
+            promotion_engine.version = version
 
-    return promotions
+def calculate_promotions(subtotal: float, distance_km: float):
+    """Core promotion engine logic"""
+    return promotion_engine.quote(subtotal, distance_km)
+
+def calculate_promotions_bulk(subtotals, distances) -> dict:
+    """Vectorized calculate_promotions: fee and flag arrays for many carts"""
+    return promotion_engine.quote_many(subtotals, distances)
+
+async def delivery_distances_km(store_ids: List[str], lat: float, lng: float) -> np.ndarray:
+    """delivery_distance_km for many stores: cached cells first, then one $in and a vectorized haversine"""
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise HTTPException(status_code=400, detail="Invalid coordinates")
+    # Clients that send no delivery point leave it at (0, 0) and get the default distance
+    if not (lat or lng):
+        return DEFAULT_DISTANCE_KM
+    cell, (cell_lat, cell_lng) = geohash_cell(lat, lng)
+    distances = {}
+    for store_id in set(store_ids):
+        cached = distance_cache.get(f"{store_id}:{cell}")
+        if cached is not None:
+            distances[store_id] = cached
+    missing = [store_id for store_id in set(store_ids) if store_id not in distances]
+    if missing:
+        stores = await db.stores.find({"id": {"$in": missing}, "lat": {"$ne": None}, "lng": {"$ne": None}},
+                                      {"_id": 0, "id": 1, "lat": 1, "lng": 1}).to_list(None)
+        if stores:
+            computed = haversine_km_many(cell_lat, cell_lng, np.array([st["lat"] for st in stores], dtype=float),
+                                         np.array([st["lng"] for st in stores], dtype=float))
+            for store, distance in zip(stores, computed):
+                distances[store["id"]] = round(float(distance), 2)
+                distance_cache.set(f"{store['id']}:{cell}", distances[store["id"]])
+    return np.array([distances.get(store_id, DEFAULT_DISTANCE_KM) for store_id in store_ids], dtype=float)
+
+async def price_cart(items: List[dict]) -> tuple:
+    """Price cart items with at most one batched query per collection.
+
+    Products, variants and sizes are resolved from product_cache first; only
+    ids it cannot answer are fetched with $in. Returns (lines, subtotal).
+    """
+    products: Dict[str, dict] = {}
+    variants: Dict[str, dict] = {}
+    sizes: Dict[str, dict] = {}
+    for product_id in {item["product_id"] for item in items}:
+        cached = product_cache.get(product_id)
+        if cached is None:
+            continue
+        products[product_id] = cached
+        for v in cached.get("variants", []):
+            variants[v["id"]] = v
+            for sz in v.get("sizes", []):
+                sizes[sz["id"]] = sz
+
+    async def fetch_missing(collection: str, ids: set, found: Dict[str, dict]):
+        missing = [i for i in ids if i and i not in found]
+        if missing:
+            async for doc in db[collection].find({"id": {"$in": missing}}, {"_id": 0}):
+                found[doc["id"]] = doc
+
+    # The three lookups only need ids from the cart itself, so they share one round trip
+    await asyncio.gather(
+        fetch_missing("products", {item["product_id"] for item in items}, products),
+        fetch_missing("variants", {item["variant_id"] for item in items}, variants),
+        fetch_missing("sizes", {item.get("size_id", "") for item in items}, sizes),
+    )
 
-@api_router.get("/cart")
-async def get_cart(user=Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": user["id"]}, {"_id": 0})
-    if not cart:
-        cart = {"user_id": user["id"], "items": [], "distance_km": 2.0}
     subtotal = 0
-    enriched_items = []
-    for item in cart.get("items", []):
-        product = await db.products.find_one({"id": item["product_id"]}, {"_id": 0})
-        variant = await db.variants.find_one({"id": item["variant_id"]}, {"_id": 0})
-        size = None
-        if item.get("size_id"):
-            size = await db.sizes.find_one({"id": item["size_id"]}, {"_id": 0})
+    lines = []
+    for item in items:
+        product = products.get(item["product_id"])
+        variant = variants.get(item["variant_id"])
+        size = sizes.get(item.get("size_id", ""))
         price = (variant["price"] if variant else 0) + (size["price_modifier"] if size else 0)
         item_total = price * item["quantity"]
         subtotal += item_total
-        enriched_items.append({
+        lines.append({
             "item_id": item["item_id"],
             "product_id": item["product_id"],
             "variant_id": item["variant_id"],
@@ -444,7 +1818,63 @@ async def get_cart(user=Depends(get_current_user)):
             "price": price,
             "item_total": item_total
         })
-    distance_km = cart.get("distance_km", 2.0)
+    return lines, subtotal
+
+async def product_revisions(product_ids: set) -> Dict[str, int]:
+    """Current revision of each product that still exists, in one query"""
+    query = {"id": {"$in": list(product_ids)}}
+    docs = await db.products.find(query, {"_id": 0, "id": 1, "revision": 1}).to_list(None)
+    return {d["id"]: d.get("revision", 0) for d in docs}
+
+async def cart_snapshot(cart: dict) -> tuple:
+    """Lines and subtotal from the prices stored on the cart's items.
+
+    Items carry the price and names they were added with, stamped with the
+    revision of their product at the time; the cart records the catalog
+    version it was last checked against. While that version stands, reading
+    the cart costs no catalog queries. Once any product is written, one
+    query reads the revisions of the cart's products, only lines whose
+    product changed (or was deleted) are repriced, and the snapshot is
+    written back under the new version unless a mutation raced it.
+    """
+    items = cart.get("items", [])
+    version = await content_versions.get("catalog")
+    if items and (cart.get("priced_version") != version or any("price" not in i for i in items)):
+        # Revisions are read before prices, so a write racing this leaves a line stale, not wrong
+        revisions = await product_revisions({i["product_id"] for i in items})
+        stale = [i for i in items if "price" not in i or i.get("revision") != revisions.get(i["product_id"], -1)]
+        repriced = {}
+        if stale:
+            lines, _ = await price_cart(stale)
+            repriced = {line["item_id"]: {**{k: v for k, v in line.items() if k != "item_total"},
+                                          "revision": revisions.get(line["product_id"], -1)}
+                        for line in lines}
+        priced = [repriced.get(i["item_id"], i) for i in items]
+        await cart_store.save_prices(cart["user_id"], items, priced, version)
+        items = priced
+    lines = [{**i, "item_total": i["price"] * i["quantity"]} for i in items]
+    return lines, sum(line["item_total"] for line in lines)
+
+async def price_new_line(line: dict, quantity: int, revision: int) -> tuple:
+    """A new cart line with its price, and the catalog version it was priced at.
+
+    `revision` is the product's revision as read before pricing.
+    """
+    # Read the version first: a price change racing this add then leaves the cart stale, not wrong
+    version = await content_versions.get("catalog")
+    lines, _ = await price_cart([{"item_id": str(uuid.uuid4()), **line, "quantity": quantity}])
+    return {**{k: v for k, v in lines[0].items() if k != "item_total"}, "revision": revision}, version
+
+@api_router.get("/cart")
+async def get_cart(lat: Optional[float] = None, lng: Optional[float] = None, user=Depends(get_current_user)):
+    cart = await cart_store.get(user["id"])
+    if not cart:
+        cart = {"user_id": user["id"], "items": []}
+    enriched_items, subtotal = await cart_snapshot(cart)
+    await refresh_promotion_engine()
+    distance_km = DEFAULT_DISTANCE_KM
+    if lat is not None and lng is not None and cart.get("store_id"):
+        distance_km = await delivery_distance_km(cart["store_id"], lat, lng)
     promotions = calculate_promotions(subtotal, distance_km)
     return {
         "items": enriched_items,
@@ -458,133 +1888,320 @@ async def get_cart(user=Depends(get_current_user)):
 
 @api_router.post("/cart/add")
 async def add_to_cart(data: CartItemAdd, user=Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": user["id"]}, {"_id": 0})
-    product = await db.products.find_one({"id": data.product_id}, {"_id": 0})
+    product = product_cache.get(data.product_id) or await db.products.find_one(
+        {"id": data.product_id}, {"_id": 0, "id": 1, "store_id": 1, "revision": 1})
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    if not cart:
-        cart = {"user_id": user["id"], "items": [], "store_id": product.get("store_id", ""), "distance_km": 2.0}
-        await db.carts.insert_one(cart)
-    # Check if adding from different store
-    if cart.get("store_id") and cart["store_id"] != product.get("store_id", "") and len(cart.get("items", [])) > 0:
-        # Clear cart for new store
-        await db.carts.update_one(
-            {"user_id": user["id"]},
-            {"$set": {"items": [], "store_id": product.get("store_id", "")}}
-        )
-        cart["items"] = []
-    new_item = {
-        "item_id": str(uuid.uuid4()),
-        "product_id": data.product_id,
-        "variant_id": data.variant_id,
-        "size_id": data.size_id,
-        "quantity": data.quantity
-    }
-    # Check if same product/variant/size exists
-    existing_idx = None
-    for i, item in enumerate(cart.get("items", [])):
-        if (item["product_id"] == data.product_id and
-            item["variant_id"] == data.variant_id and
-            item.get("size_id", "") == data.size_id):
-            existing_idx = i
-            break
-    if existing_idx is not None:
-        cart["items"][existing_idx]["quantity"] += data.quantity
-    else:
-        cart["items"].append(new_item)
-    await db.carts.update_one(
-        {"user_id": user["id"]},
-        {"$set": {"items": cart["items"], "store_id": product.get("store_id", "")}},
-        upsert=True
-    )
-    return {"message": "Added to cart", "item_count": len(cart["items"])}
+    line = {"product_id": data.product_id, "variant_id": data.variant_id, "size_id": data.size_id}
+    item_count = await cart_store.add_item(user["id"], product.get("store_id", ""), line, data.quantity,
+                                           product.get("revision", 0))
+    return {"message": "Added to cart", "item_count": item_count}
 
 @api_router.put("/cart/update")
 async def update_cart_item(data: CartItemUpdate, user=Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": user["id"]}, {"_id": 0})
-    if not cart:
-        raise HTTPException(status_code=404, detail="Cart not found")
-    items = cart.get("items", [])
-    for i, item in enumerate(items):
-        if item["item_id"] == data.item_id:
-            if data.quantity <= 0:
-                items.pop(i)
-            else:
-                items[i]["quantity"] = data.quantity
-            break
-    await db.carts.update_one({"user_id": user["id"]}, {"$set": {"items": items}})
+    if not await cart_store.update_item(user["id"], data.item_id, data.quantity):
+        raise HTTPException(status_code=404, detail="Cart item not found")
     return {"message": "Cart updated"}
 
 @api_router.delete("/cart/clear")
 async def clear_cart(user=Depends(get_current_user)):
-    await db.carts.update_one({"user_id": user["id"]}, {"$set": {"items": []}})
+    await cart_store.clear(user["id"])
     return {"message": "Cart cleared"}
 
+# ======================== TRANSACTIONS ========================
+
+_transactions_supported: Optional[bool] = None
+
+async def transactions_supported() -> bool:
+    """Multi-document transactions need a replica set (a single-node one will do) or mongos"""
+    global _transactions_supported
+    if _transactions_supported is None:
+        hello = await db.client.admin.command("hello")
+        _transactions_supported = "setName" in hello or hello.get("msg") == "isdbgrid"
+        if not _transactions_supported:
+            logger.warning("MongoDB is a standalone server: checkout writes run without a transaction")
+    return _transactions_supported
+
+async def run_in_transaction(callback):
+    """Await callback(session) in one transaction, retried on transient errors.
+
+    On a standalone server callback runs with session=None and its writes
+    apply one by one, so callers order them guard-first.
+    """
+    if not await transactions_supported():
+        return await callback(None)
+    async with await db.client.start_session() as session:
+        return await session.with_transaction(callback)
+
+# ======================== EVENTS ========================
+
+class EventHub:
+    """In-process pub/sub where every subscriber drains its own bounded queue.
+
+    A subscriber that falls behind loses its oldest events instead of
+    stalling the publisher, so events tell clients what changed; the REST
+    routes stay the source of truth.
+    """
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, set] = {}
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, channel: str, queue: Optional[asyncio.Queue] = None) -> asyncio.Queue:
+        """Deliver channel's events to queue (a new one when None), so one queue can follow many channels"""
+        queue = queue or asyncio.Queue(self.queue_size)
+        self._subscribers.setdefault(channel, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, channel: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(channel)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[channel]
+
+    def publish(self, channel: str, event: dict) -> int:
+        """Queue event for every subscriber of channel; returns how many there were"""
+        self.published += 1
+        subscribers = self._subscribers.get(channel, ())
+        for queue in subscribers:
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(event)
+        return len(subscribers)
+
+    def stats(self) -> dict:
+        return {
+            "channels": len(self._subscribers),
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            "published": self.published,
+            "dropped": self.dropped,
+        }
+
+events = EventHub()
+
+async def stream_events(websocket: WebSocket, channels: List[str]):
+    """Forward the channels' events to an accepted socket until the client disconnects"""
+    queue = asyncio.Queue(events.queue_size)
+    for channel in channels:
+        events.subscribe(channel, queue)
+
+    async def forward():
+        while True:
+            await websocket.send_json(await queue.get())
+
+    sender = asyncio.create_task(forward())
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        for channel in channels:
+            events.unsubscribe(channel, queue)
+
+ORDER_LEAVES_POOL = ("assigned", "preparing", "cancelled")
+# Shown only on the customer's own order; merchants and agents watch the same channels
+ORDER_PRIVATE_FIELDS = ("otp",)
+
+def order_channels(order: dict) -> List[str]:
+    channels = ["orders", f"order:{order['id']}", f"user:{order.get('user_id', '')}",
+                f"merchant:{order.get('merchant_id', '')}"]
+    if order.get("agent_id"):
+        channels.append(f"agent:{order['agent_id']}")
+    return channels
+
+def order_changed(order: dict, changes: dict):
+    """Fan one order write out: status changes to the order's watchers, pool moves to dispatch.
+
+    order is the document after the write and changes the fields it set;
+    watchers get only the changes, which is all an open screen needs,
+    minus ORDER_PRIVATE_FIELDS.
+    """
+    if "status" in changes:
+        public = {k: v for k, v in changes.items() if k not in ORDER_PRIVATE_FIELDS}
+        event = {"type": "order", "order": {"id": order["id"], **public}}
+        for channel in order_channels(order):
+            events.publish(channel, event)
+    if "status" not in changes and "claimed_by" not in changes:
+        return
+    if order.get("status") == "accepted" and not order.get("agent_id") and not order.get("claimed_by"):
+        announce_order_available(order)
+    elif changes.get("claimed_by") or changes.get("status") in ORDER_LEAVES_POOL:
+        events.publish("dispatch", {"type": "order_taken", "order_id": order["id"]})
+
+def publish_order(order: dict, changes: dict):
+    """Publish a write made by this worker; with ORDER_EVENTS=changestream every worker hears it from Mongo instead"""
+    if ORDER_EVENTS == "local":
+        order_changed(order, changes)
+
+async def order_change_stream():
+    """Replay order writes from all workers into this worker's hub"""
+    pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}]
+    resume_after = None
+    while True:
+        try:
+            async with db.orders.watch(pipeline, full_document="updateLookup", resume_after=resume_after) as stream:
+                async for change in stream:
+                    resume_after = change["_id"]
+                    order = change.get("fullDocument")
+                    if not order:
+                        continue
+                    order.pop("_id", None)
+                    if change["operationType"] == "update":
+                        order_changed(order, change["updateDescription"]["updatedFields"])
+                    else:
+                        order_changed(order, order)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Order change stream failed, resuming: {e}")
+            await asyncio.sleep(1)
+
+async def order_subscription(user: dict, order_id: str = "") -> Optional[List[str]]:
+    """Channels a socket may follow: one order its parties can see, else every order of the active role"""
+    role = user.get("active_role", "customer")
+    if order_id:
+        order = await db.orders.find_one({"id": order_id}, {"_id": 0, "user_id": 1, "merchant_id": 1, "agent_id": 1})
+        if not order or (role != "admin" and user["id"] not in order.values()):
+            return None
+        return [f"order:{order_id}"]
+    if role == "admin":
+        return ["orders"]
+    if role in ("merchant", "agent"):
+        return [f"{role}:{user['id']}"]
+    return [f"user:{user['id']}"]
+
 # ======================== ORDER ROUTES ========================
 
-@api_router.post("/orders")
-async def create_order(data: CheckoutRequest, user=Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": user["id"]}, {"_id": 0})
-    if not cart or not cart.get("items"):
-        raise HTTPException(status_code=400, detail="Cart is empty")
-    # Calculate totals
-    subtotal = 0
-    order_items = []
-    for item in cart["items"]:
-        variant = await db.variants.find_one({"id": item["variant_id"]}, {"_id": 0})
-        size = await db.sizes.find_one({"id": item.get("size_id")}, {"_id": 0}) if item.get("size_id") else None
-        price = (variant["price"] if variant else 0) + (size["price_modifier"] if size else 0)
-        product = await db.products.find_one({"id": item["product_id"]}, {"_id": 0})
-        subtotal += price * item["quantity"]
-        order_items.append({
-            "product_id": item["product_id"],
-            "variant_id": item["variant_id"],
-            "size_id": item.get("size_id", ""),
-            "quantity": item["quantity"],
-            "price": price,
-            "product_name": product["name"] if product else "Unknown",
-            "variant_name": variant["name"] if variant else "Unknown",
-            "size_name": size["name"] if size else ""
-        })
-    promotions = calculate_promotions(subtotal, data.distance_km)
-    otp = str(random.randint(1000, 9999))
-    store = await db.stores.find_one({"id": cart.get("store_id", "")}, {"_id": 0})
+class SequenceAllocator:
+    """Monotonic, unique numbers leased from the counters collection in blocks.
+
+    One $inc reserves block_size numbers for this worker, which then hands
+    them out from memory, so only one caller per block pays a round trip.
+    Every worker gets disjoint blocks; numbers left in a block when a worker
+    stops are skipped, never reused.
+    """
+    def __init__(self, name: str, block_size: int):
+        self.name = name
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = asyncio.Lock()
+        self.leases = 0
+
+    async def next(self) -> int:
+        async with self._lock:
+            if self._next >= self._end:
+                await self._lease()
+            number = self._next
+            self._next += 1
+            return number
+
+    async def _lease(self):
+        async def increment():
+            return await db.counters.find_one_and_update(
+                {"name": self.name}, {"$inc": {"value": self.block_size}},
+                projection={"_id": 0, "value": 1}, upsert=True, return_document=ReturnDocument.AFTER)
+        try:
+            counter = await increment()
+        except DuplicateKeyError:
+            # Two workers' first-ever upserts raced; the counter exists now, so this one updates it
+            counter = await increment()
+        self._next, self._end = counter["value"] - self.block_size + 1, counter["value"] + 1
+        self.leases += 1
+
+order_numbers = SequenceAllocator("order_number", ORDER_NUMBER_BLOCK)
+
+ORDER_ITEM_FIELDS = ("product_id", "variant_id", "size_id", "quantity", "price",
+                     "product_name", "variant_name", "size_name")
+
+def assemble_order(user: dict, data: CheckoutRequest, store: Optional[dict], lines: List[dict],
+                   subtotal: float, distance_km: float, number: int) -> dict:
+    """Build the order document from a priced cart; no I/O"""
+    promotions = calculate_promotions(subtotal, distance_km)
+    now = datetime.now(timezone.utc).isoformat()
     order = {
         "id": str(uuid.uuid4()),
-        "order_number": f"ORD-{random.randint(10000, 99999)}",
+        "order_number": f"ORD-{number:06d}",
         "user_id": user["id"],
         "user_name": user["name"],
-        "store_id": cart.get("store_id", ""),
+        "store_id": store["id"] if store else "",
         "store_name": store["name"] if store else "",
         "merchant_id": store["merchant_id"] if store else "",
         "agent_id": "",
         "agent_name": "",
-        "items": order_items,
+        "items": [{k: line[k] for k in ORDER_ITEM_FIELDS} for line in lines],
         "subtotal": subtotal,
         "delivery_fee": promotions["delivery_fee"],
         "platform_fee": round(subtotal * PLATFORM_FEE_PERCENT / 100, 2),
         "total": subtotal + promotions["delivery_fee"],
         "status": "placed",
-        "otp": otp,
+        "otp": str(random.randint(1000, 9999)),
         "delivery_address": data.delivery_address,
         "lat": data.lat,
         "lng": data.lng,
-        "distance_km": data.distance_km,
+        "distance_km": distance_km,
         "promotions_applied": promotions,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "created_at": now,
+        "updated_at": now
     }
-    await db.orders.insert_one(order)
-    # Clear cart
-    await db.carts.update_one({"user_id": user["id"]}, {"$set": {"items": []}})
-    # Update store total orders
-    if store:
-        await db.stores.update_one({"id": store["id"]}, {"$inc": {"total_orders": 1}})
+    if store and store.get("location"):
+        order["pickup_location"] = store["location"]
+    return order
+
+@api_router.post("/orders")
+async def create_order(data: CheckoutRequest, background_tasks: BackgroundTasks, user=Depends(get_current_user)):
+    """Place the cart as an order.
+
+    The cart is read first, then its store, prices, promotion rules and
+    order number together. The order insert, cart clear and store counter commit in one
+    transaction, the clear guarded on the cart being unchanged since it was
+    priced. The store menu snapshot and search index catch up after the
+    response.
+    """
+    cart = await cart_store.get(user["id"])
+    if not cart or not cart.get("items"):
+        raise HTTPException(status_code=400, detail="Cart is empty")
+    store, (lines, subtotal), _, number = await asyncio.gather(
+        db.stores.find_one({"id": cart.get("store_id", "")}, {"_id": 0}),
+        price_cart(cart["items"]),
+        refresh_promotion_engine(),
+        order_numbers.next(),
+    )
+    distance_km = await delivery_distance_km(cart.get("store_id", ""), data.lat, data.lng, store or {})
+    order = assemble_order(user, data, store, lines, subtotal, distance_km, number)
+
+    async def commit(session):
+        if not await cart_store.checkout(user["id"], cart["items"], session):
+            raise HTTPException(status_code=409, detail="Cart changed during checkout, please review it")
+        await db.orders.insert_one(order, session=session)
+        if store:
+            await db.stores.update_one({"id": store["id"]}, {"$inc": {"total_orders": 1}}, session=session)
+
+    await run_in_transaction(commit)
+    cart_store.checked_out(user["id"], cart["items"])
     result = {k: v for k, v in order.items() if k != "_id"}
+    publish_order(result, result)
+    if store:
+        store_cache.invalidate(store["id"])
+        background_tasks.add_task(store_order_placed, {**store, "total_orders": store.get("total_orders", 0) + 1})
     return result
 
+async def store_order_placed(store: dict):
+    """Bring the store's menu snapshot and search popularity up to date after an order"""
+    await patch_store_menu(store["id"], {"$inc": {"menu.total_orders": 1}})
+    store_cache.invalidate(store["id"])
+    await store_popularity_changed(store)
+
 @api_router.get("/orders")
-async def get_orders(status: str = "", user=Depends(get_current_user)):
+async def get_orders(response: Response, status: str = "", limit: int = 100, cursor: str = "", fields: str = "",
+                     user=Depends(get_current_user)):
+    """Order summaries for list screens; full orders, with the customer's OTP, come from GET /orders/{id}"""
+    projection = fields_projection(sparse_fields(fields, ORDER_SUMMARY_FIELDS, ORDER_EXTRA_FIELDS))
     role = user.get("active_role", "customer")
     query = {}
     if role == "customer":
@@ -595,16 +2212,16 @@ async def get_orders(status: str = "", user=Depends(get_current_user)):
         query["agent_id"] = user["id"]
     if status:
         query["status"] = status
-    orders = await db.orders.find(query, {"_id": 0}).sort("created_at", -1).to_list(100)
+    orders = await paginate("orders", query, response, limit, cursor, projection=projection)
     return orders
 
 @api_router.get("/orders/available")
-async def get_available_orders(user=Depends(get_current_user)):
-    """Get orders available for agent pickup (accepted by merchant, no agent assigned)"""
-    orders = await db.orders.find(
-        {"status": "accepted", "agent_id": ""},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(50)
+async def get_available_orders(response: Response, limit: int = 50, cursor: str = "", fields: str = "",
+                               user=Depends(get_current_user)):
+    """Get orders available for agent pickup (accepted by merchant, no agent assigned, not leased)"""
+    projection = fields_projection(sparse_fields(fields, ORDER_SUMMARY_FIELDS, POOL_ORDER_EXTRA_FIELDS))
+    orders = await paginate("orders", claimable(datetime.now(timezone.utc).isoformat()), response, limit, cursor,
+                            projection=projection)
     return orders
 
 @api_router.get("/orders/{order_id}")
@@ -614,77 +2231,499 @@ async def get_order(order_id: str, user=Depends(get_current_user)):
         raise HTTPException(status_code=404, detail="Order not found")
     return order
 
+ORDER_TRANSITIONS = {
+    "placed": ["accepted", "cancelled"],
+    "accepted": ["preparing", "cancelled"],
+    "preparing": ["ready_for_pickup"],
+    "ready_for_pickup": ["picked_up"],
+    "picked_up": ["delivered"],
+    "assigned": ["preparing", "cancelled"],
+}
+
+async def transition_order(order_id: str, to_status: str, from_statuses: Optional[List[str]] = None,
+                           guard: Optional[dict] = None, updates: Optional[dict] = None,
+                           error: str = "") -> dict:
+    """Move an order to to_status in one conditional find_one_and_update.
+
+    The filter carries the allowed current statuses (any when None) and any
+    extra guard, so of several concurrent callers exactly one matches. Only
+    a failed transition pays a second read, to tell 404 from 400.
+    """
+    query = {"id": order_id, **(guard or {})}
+    if from_statuses is not None:
+        query["status"] = {"$in": from_statuses}
+    changes = {"status": to_status, "updated_at": datetime.now(timezone.utc).isoformat(), **(updates or {})}
+    before = await db.orders.find_one_and_update(query, {"$set": changes}, projection={"_id": 0},
+                                                 return_document=ReturnDocument.BEFORE)
+    if before:
+        order = {**before, **changes}
+        publish_order(order, changes)
+        return order
+    current = await db.orders.find_one({"id": order_id}, {"_id": 0, "status": 1})
+    if not current:
+        raise HTTPException(status_code=404, detail="Order not found")
+    raise HTTPException(status_code=400, detail=error or f"Cannot transition from {current['status']} to {to_status}")
+
 @api_router.put("/orders/{order_id}/status")
 async def update_order_status(order_id: str, data: OrderStatusUpdate, user=Depends(get_current_user)):
-    valid_transitions = {
-        "placed": ["accepted", "cancelled"],
-        "accepted": ["preparing", "cancelled"],
-        "preparing": ["ready_for_pickup"],
-        "ready_for_pickup": ["picked_up"],
-        "picked_up": ["delivered"],
-        "assigned": ["preparing", "cancelled"],
-    }
-    order = await db.orders.find_one({"id": order_id}, {"_id": 0})
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    current = order["status"]
-    if data.status not in valid_transitions.get(current, []):
-        raise HTTPException(status_code=400, detail=f"Cannot transition from {current} to {data.status}")
-    updates = {"status": data.status, "updated_at": datetime.now(timezone.utc).isoformat()}
-    await db.orders.update_one({"id": order_id}, {"$set": updates})
-    updated = await db.orders.find_one({"id": order_id}, {"_id": 0})
-    return updated
+    from_statuses = [status for status, targets in ORDER_TRANSITIONS.items() if data.status in targets]
+    return await transition_order(order_id, data.status, from_statuses)
 
 @api_router.put("/orders/{order_id}/accept")
 async def merchant_accept_order(order_id: str, user=Depends(get_current_user)):
     await require_role(user, ["merchant", "admin"])
-    order = await db.orders.find_one({"id": order_id}, {"_id": 0})
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    if order["status"] != "placed":
-        raise HTTPException(status_code=400, detail="Order cannot be accepted")
-    await db.orders.update_one(
-        {"id": order_id},
-        {"$set": {"status": "accepted", "updated_at": datetime.now(timezone.utc).isoformat()}}
-    )
-    return await db.orders.find_one({"id": order_id}, {"_id": 0})
+    return await transition_order(order_id, "accepted", ["placed"], error="Order cannot be accepted")
 
 @api_router.put("/orders/{order_id}/assign")
 async def agent_accept_order(order_id: str, user=Depends(get_current_user)):
+    """Take an accepted order; another agent's live claim lease blocks it"""
     await require_role(user, ["agent", "admin"])
-    order = await db.orders.find_one({"id": order_id}, {"_id": 0})
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    if order["status"] != "accepted":
-        raise HTTPException(status_code=400, detail="Order not available for assignment")
-    await db.orders.update_one(
-        {"id": order_id},
-        {"$set": {
-            "agent_id": user["id"],
-            "agent_name": user["name"],
-            "status": "assigned",
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
-    return await db.orders.find_one({"id": order_id}, {"_id": 0})
+    lease_free = {"$or": [{"claimed_by": user["id"]},
+                          {"claim_expires_at": {"$not": {"$gt": datetime.now(timezone.utc).isoformat()}}}]}
+    return await transition_order(order_id, "assigned", ["accepted"], guard=lease_free,
+                                  updates={"agent_id": user["id"], "agent_name": user["name"]},
+                                  error="Order not available for assignment")
 
 @api_router.put("/orders/{order_id}/verify-otp")
 async def verify_delivery_otp(order_id: str, data: OTPVerify, user=Depends(get_current_user)):
-    order = await db.orders.find_one({"id": order_id}, {"_id": 0})
+    await transition_order(order_id, "delivered", guard={"otp": data.otp}, error="Invalid OTP")
+    return {"message": "Delivery confirmed", "status": "delivered"}
+
+@api_router.websocket("/orders/ws")
+async def orders_socket(websocket: WebSocket, order_id: str = ""):
+    """Push status changes of one order (?order_id=) or of all the user's orders, so open screens need not poll"""
+    user = await websocket_user(websocket)
+    channels = await order_subscription(user, order_id) if user else None
+    if not channels:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    await stream_events(websocket, channels)
+
+# ======================== DISPATCH ========================
+
+DISPATCH_OLDEST_FIRST = [("created_at", ASCENDING), ("id", ASCENDING)]
+DISPATCH_EVENT_FIELDS = ("id", "order_number", "store_id", "store_name", "delivery_address",
+                         "distance_km", "total", "delivery_fee", "created_at")
+
+def claimable(now: str) -> dict:
+    """Accepted orders with no agent whose claim lease is absent, released or expired"""
+    return {"status": "accepted", "agent_id": "", "claim_expires_at": {"$not": {"$gt": now}}}
+
+def announce_order_available(order: dict):
+    events.publish("dispatch", {"type": "order_available",
+                                "order": {k: order.get(k) for k in DISPATCH_EVENT_FIELDS}})
+
+async def lease_order(query: dict, lease: dict, sort=None) -> Optional[dict]:
+    before = await db.orders.find_one_and_update(query, {"$set": lease}, sort=sort, projection={"_id": 0},
+                                                 return_document=ReturnDocument.BEFORE)
+    return {**before, **lease} if before else None
+
+@api_router.post("/dispatch/claim")
+async def claim_next_order(data: DispatchClaim, user=Depends(get_current_user)):
+    """Lease the next claimable order to the calling agent.
+
+    Every attempt is one conditional find_one_and_update over claimable
+    orders, so concurrent agents never lease the same order and a lost
+    race costs no extra read. Nearest-first tries the few orders picked up
+    closest to the agent, then falls back to oldest-first. The agent
+    confirms with /orders/{id}/assign before the lease runs out, or the
+    order returns to the pool.
+    """
+    await require_role(user, ["agent", "admin"])
+    if data.order_by not in ("nearest", "oldest"):
+        raise HTTPException(status_code=400, detail="order_by must be nearest or oldest")
+    now = datetime.now(timezone.utc)
+    query = claimable(now.isoformat())
+    lease = {"claimed_by": user["id"],
+             "claim_expires_at": (now + timedelta(seconds=DISPATCH_LEASE_SECONDS)).isoformat()}
+    order = None
+    if data.order_by == "nearest" and data.lat is not None and data.lng is not None:
+        near = {**query, "pickup_location": {"$nearSphere": {"$geometry": geo_point(data.lat, data.lng)}}}
+        candidates = await db.orders.find(near, {"_id": 0, "id": 1}).limit(DISPATCH_CANDIDATES).to_list(DISPATCH_CANDIDATES)
+        for candidate in candidates:
+            order = await lease_order({**query, "id": candidate["id"]}, lease)
+            if order:
+                break
     if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    if order["otp"] != data.otp:
-        raise HTTPException(status_code=400, detail="Invalid OTP")
-    await db.orders.update_one(
-        {"id": order_id},
-        {"$set": {"status": "delivered", "updated_at": datetime.now(timezone.utc).isoformat()}}
+        order = await lease_order(query, lease, sort=DISPATCH_OLDEST_FIRST)
+    if order:
+        publish_order(order, lease)
+    return {"order": order, "lease_seconds": DISPATCH_LEASE_SECONDS}
+
+@api_router.post("/dispatch/{order_id}/release")
+async def release_order(order_id: str, user=Depends(get_current_user)):
+    """Hand a leased order back to the pool before its lease runs out"""
+    released = {"claimed_by": "", "claim_expires_at": ""}
+    before = await db.orders.find_one_and_update(
+        {"id": order_id, "status": "accepted", "agent_id": "", "claimed_by": user["id"]},
+        {"$set": released}, projection={"_id": 0})
+    if not before:
+        raise HTTPException(status_code=404, detail="No claim held on this order")
+    publish_order({**before, **released}, released)
+    return {"message": "Order released"}
+
+async def announce_expired_leases(since: str, until: str) -> int:
+    """Announce orders whose lease lapsed in (since, until]; they need no write to rejoin the pool"""
+    lapsed = await db.orders.find(
+        {"status": "accepted", "agent_id": "", "claim_expires_at": {"$gt": since, "$lte": until}},
+        {"_id": 0, **{k: 1 for k in DISPATCH_EVENT_FIELDS}}).to_list(None)
+    for order in lapsed:
+        announce_order_available(order)
+    return len(lapsed)
+
+async def dispatch_lease_loop():
+    since = datetime.now(timezone.utc).isoformat()
+    while True:
+        await asyncio.sleep(DISPATCH_SWEEP_SECONDS)
+        until = datetime.now(timezone.utc).isoformat()
+        try:
+            await announce_expired_leases(since, until)
+            since = until
+        except Exception as e:
+            logger.warning(f"Dispatch lease sweep failed: {e}")
+
+@api_router.websocket("/dispatch/ws")
+async def dispatch_socket(websocket: WebSocket):
+    """Push order_available / order_taken events to agents instead of having them poll"""
+    user = await websocket_user(websocket)
+    if not user or not {"agent", "admin"} & set(user.get("roles", [])):
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    await stream_events(websocket, ["dispatch"])
+
+
+# ======================== AUTO DISPATCH ========================
+
+ACTIVE_ORDER_STATUSES = ["assigned", "preparing", "ready_for_pickup", "picked_up"]
+ASSIGNMENT_INFEASIBLE = 1e9
+
+def min_cost_assignment(cost: np.ndarray) -> List[tuple]:
+    """(row, col) pairs matching every row to a distinct column at least total cost.
+
+    Hungarian method with potentials, O(rows^2 * cols) with the column scan
+    vectorised; needs rows <= cols.
+    """
+    n, m = cost.shape
+    u, v = np.zeros(n + 1), np.zeros(m + 1)
+    match = np.zeros(m + 1, dtype=int)  # match[col] = 1-based row, 0 when free
+    way = np.zeros(m + 1, dtype=int)
+    for row in range(1, n + 1):
+        match[0], col0 = row, 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[col0] = True
+            row0, free = match[col0], ~used[1:]
+            reduced = cost[row0 - 1] - u[row0] - v[1:]
+            better = free & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = col0
+            candidates = np.where(free, minv[1:], np.inf)
+            col1 = int(np.argmin(candidates)) + 1
+            delta = candidates[col1 - 1]
+            u[match[used]] += delta
+            v[used] -= delta
+            minv[1:][free] -= delta
+            col0 = col1
+            if match[col0] == 0:
+                break
+        while col0:
+            col1 = way[col0]
+            match[col0] = match[col1]
+            col0 = col1
+    return [(int(match[col]) - 1, col - 1) for col in range(1, m + 1) if match[col]]
+
+def match_orders_to_agents(orders: List[dict], agents: List[dict], loads: Dict[str, int]) -> List[tuple]:
+    """Batch-assign orders to agents minimising pickup km plus AUTO_DISPATCH_LOAD_KM per active order.
+
+    A spatial grid limits each order to its AUTO_DISPATCH_CANDIDATES nearest
+    agents within AUTO_DISPATCH_RADIUS_KM. Orders and agents linked by those
+    pairs form independent clusters, each solved exactly as a small dense
+    assignment. Returns (order, agent) pairs.
+    """
+    grid = SpatialGrid(AUTO_DISPATCH_RADIUS_KM)
+    by_id = {}
+    for agent in agents:
+        if loads.get(agent["id"], 0) < AGENT_MAX_ACTIVE_ORDERS:
+            lng, lat = agent["location"]["coordinates"]
+            grid.add(agent["id"], lat, lng)
+            by_id[agent["id"]] = agent
+    pairs = {}
+    for n, order in enumerate(orders):
+        lng, lat = order["pickup_location"]["coordinates"]
+        for km, agent_id in grid.near(lat, lng, AUTO_DISPATCH_RADIUS_KM)[:AUTO_DISPATCH_CANDIDATES]:
+            pairs[n, agent_id] = km + AUTO_DISPATCH_LOAD_KM * loads.get(agent_id, 0)
+
+    # Union-find over the candidate pairs splits the batch into clusters
+    parent = {}
+
+    def root(node):
+        while parent.setdefault(node, node) != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for n, agent_id in pairs:
+        parent[root(("order", n))] = root(("agent", agent_id))
+    clusters: Dict[Any, tuple] = {}
+    for n, agent_id in pairs:
+        order_ids, agent_ids = clusters.setdefault(root(("order", n)), ({}, {}))
+        order_ids.setdefault(n, len(order_ids))
+        agent_ids.setdefault(agent_id, len(agent_ids))
+
+    matched = []
+    for order_ids, agent_ids in clusters.values():
+        cost = np.full((len(order_ids), len(agent_ids)), ASSIGNMENT_INFEASIBLE)
+        for n in order_ids:
+            for agent_id in agent_ids:
+                if (n, agent_id) in pairs:
+                    cost[order_ids[n], agent_ids[agent_id]] = pairs[n, agent_id]
+        flipped = cost.shape[0] > cost.shape[1]
+        result = min_cost_assignment(cost.T if flipped else cost)
+        orders_in, agents_in = list(order_ids), list(agent_ids)
+        for row, col in result:
+            o, a = (col, row) if flipped else (row, col)
+            if cost[o, a] < ASSIGNMENT_INFEASIBLE:
+                matched.append((orders[orders_in[o]], by_id[agents_in[a]]))
+    return matched
+
+async def run_auto_dispatch() -> List[dict]:
+    """Match claimable orders to online agents with fresh positions and assign them"""
+    now = datetime.now(timezone.utc)
+    fresh_since = (now - timedelta(seconds=AGENT_LOCATION_FRESH_SECONDS)).isoformat()
+    orders, agents = await asyncio.gather(
+        db.orders.find({**claimable(now.isoformat()), "pickup_location": {"$exists": True}},
+                       {"_id": 0, "id": 1, "pickup_location": 1}).sort(DISPATCH_OLDEST_FIRST).to_list(AUTO_DISPATCH_BATCH),
+        db.users.find({"roles": "agent", "is_online": True, "location_at": {"$gte": fresh_since}},
+                      {"_id": 0, "id": 1, "name": 1, "location": 1}).to_list(None),
     )
-    return {"message": "Delivery confirmed", "status": "delivered"}
+    if not orders or not agents:
+        return []
+    loads = {row["_id"]: row["count"] for row in await db.orders.aggregate([
+        {"$match": {"agent_id": {"$in": [a["id"] for a in agents]}, "status": {"$in": ACTIVE_ORDER_STATUSES}}},
+        {"$group": {"_id": "$agent_id", "count": {"$sum": 1}}},
+    ]).to_list(None)}
+    assigned = []
+    for order, agent in match_orders_to_agents(orders, agents, loads):
+        try:
+            # Same rule as /orders/{id}/assign: a live lease held by any agent wins over the batch
+            await transition_order(order["id"], "assigned", ["accepted"], guard=claimable(now.isoformat()),
+                                   updates={"agent_id": agent["id"], "agent_name": agent["name"]})
+        except HTTPException:
+            continue  # taken or changed since the batch was read
+        assigned.append({"order_id": order["id"], "agent_id": agent["id"]})
+    if assigned:
+        logger.info(f"Auto-dispatch assigned {len(assigned)} of {len(orders)} orders")
+    return assigned
+
+async def auto_dispatch_loop():
+    while True:
+        await asyncio.sleep(AUTO_DISPATCH_SECONDS)
+        try:
+            await run_auto_dispatch()
+        except Exception as e:
+            logger.warning(f"Auto-dispatch failed: {e}")
+
+@api_router.post("/dispatch/auto")
+async def trigger_auto_dispatch(user=Depends(get_current_user)):
+    """Run one auto-dispatch round now"""
+    await require_role(user, ["admin"])
+    return {"assigned": await run_auto_dispatch()}
+
+# ======================== AGENT LOCATIONS ========================
+
+class AgentLocations:
+    """Latest position per agent in a SpatialGrid, plus a bounded ring of pings awaiting history.
+
+    A ping only touches memory. flush() coalesces everything since the last
+    flush into one bulk_write of latest positions onto users and one
+    insert_many into the agent_locations time series, then pulls positions
+    other workers flushed, so near() covers every online agent.
+    """
+    def __init__(self, buffer_size: int, fresh_seconds: float, flush_interval: float):
+        self.fresh_seconds = fresh_seconds
+        self.flush_interval = flush_interval
+        self.grid = SpatialGrid(AUTO_DISPATCH_RADIUS_KM)
+        self._latest: Dict[str, tuple] = {}  # agent id -> (lat, lng, at)
+        self._dirty: set = set()
+        self._history: deque = deque(maxlen=buffer_size)
+        self._synced_at = ""
+        self.pings = 0
+        self.dropped = 0
+        self.flushes = 0
+
+    def record(self, agent_id: str, lat: float, lng: float, at: float):
+        self.pings += 1
+        if len(self._history) == self._history.maxlen:
+            self.dropped += 1
+        self._history.append((agent_id, lat, lng, at))
+        if self._place(agent_id, lat, lng, at):
+            self._dirty.add(agent_id)
+
+    def _place(self, agent_id: str, lat: float, lng: float, at: float) -> bool:
+        """Make (lat, lng) the agent's position unless a later fix is already held"""
+        current = self._latest.get(agent_id)
+        if current and current[2] >= at:
+            return False
+        self._latest[agent_id] = (lat, lng, at)
+        self.grid.add(agent_id, lat, lng)
+        return True
+
+    def remove(self, agent_id: str):
+        self._latest.pop(agent_id, None)
+        self._dirty.discard(agent_id)
+        self.grid.remove(agent_id)
+
+    def near(self, lat: float, lng: float, radius_km: float, limit: int) -> List[dict]:
+        """Agents with a fresh position within radius_km, nearest first"""
+        cutoff = time.time() - self.fresh_seconds
+        agents = []
+        for km, agent_id in self.grid.near(lat, lng, radius_km):
+            agent_lat, agent_lng, at = self._latest[agent_id]
+            if at >= cutoff:
+                agents.append({"agent_id": agent_id, "distance_km": round(km, 3),
+                               "lat": agent_lat, "lng": agent_lng, "at": at})
+                if len(agents) == limit:
+                    break
+        return agents
+
+    async def flush(self):
+        dirty, self._dirty = self._dirty, set()
+        history = list(self._history)
+        self._history.clear()
+        positions = [(agent_id, *self._latest[agent_id]) for agent_id in dirty if agent_id in self._latest]
+        try:
+            if positions:
+                await db.users.bulk_write([
+                    UpdateOne({"id": agent_id}, {"$set": {
+                        "location": geo_point(lat, lng),
+                        "location_at": datetime.fromtimestamp(at, timezone.utc).isoformat()}})
+                    for agent_id, lat, lng, at in positions
+                ], ordered=False)
+            if history:
+                await db.agent_locations.insert_many([
+                    {"agent_id": agent_id, "at": datetime.fromtimestamp(at, timezone.utc), "location": geo_point(lat, lng)}
+                    for agent_id, lat, lng, at in history
+                ], ordered=False)
+        except Exception:
+            self._dirty |= dirty
+            self.dropped += len(history)
+            raise
+        self.flushes += 1
+        await self.sync()
+
+    async def sync(self):
+        """Take in positions flushed by other workers and forget the ones gone stale"""
+        cutoff = time.time() - self.fresh_seconds
+        since = max(self._synced_at, datetime.fromtimestamp(cutoff, timezone.utc).isoformat())
+        positions = await db.users.find(
+            {"roles": "agent", "is_online": True, "location_at": {"$gt": since}},
+            {"_id": 0, "id": 1, "location": 1, "location_at": 1}).to_list(None)
+        for agent in positions:
+            lng, lat = agent["location"]["coordinates"]
+            self._place(agent["id"], lat, lng, datetime.fromisoformat(agent["location_at"]).timestamp())
+            self._synced_at = max(self._synced_at, agent["location_at"])
+        for agent_id in [a for a, (_, _, at) in self._latest.items() if at < cutoff and a not in self._dirty]:
+            self.remove(agent_id)
+
+    def stats(self) -> dict:
+        return {
+            "agents": len(self._latest),
+            "dirty": len(self._dirty),
+            "buffered": len(self._history),
+            "buffer_size": self._history.maxlen,
+            "pings": self.pings,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "flush_interval_seconds": self.flush_interval,
+        }
+
+agent_locations = AgentLocations(AGENT_LOCATION_BUFFER, AGENT_LOCATION_FRESH_SECONDS, AGENT_LOCATION_FLUSH_SECONDS)
+
+# user id -> {"is_agent", "is_online"}; pings skip the per-request user read of get_current_user
+agent_auth_cache = LRUCache(CATALOG_CACHE_SIZE * 10, AGENT_AUTH_TTL_SECONDS)
+
+async def current_agent(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    if not credentials:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    try:
+        user_id = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])["user_id"]
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token expired")
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    agent = agent_auth_cache.get(user_id)
+    if agent is None:
+        user = await db.users.find_one({"id": user_id}, {"_id": 0, "roles": 1, "is_online": 1})
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
+        agent = {"id": user_id, "is_agent": "agent" in user.get("roles", []),
+                 "is_online": user.get("is_online", False)}
+        agent_auth_cache.set(user_id, agent)
+    if not agent["is_agent"]:
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    return agent
+
+def ingest_pings(agent: dict, pings: List[LocationPing]) -> int:
+    """Record pings from an online agent; offline agents' pings are accepted and ignored"""
+    if any(not (-90 <= p.lat <= 90 and -180 <= p.lng <= 180) for p in pings):
+        raise HTTPException(status_code=400, detail="Invalid coordinates")
+    if not agent["is_online"]:
+        return 0
+    now = time.time()
+    for ping in pings:
+        agent_locations.record(agent["id"], ping.lat, ping.lng, min(ping.at or now, now))
+    return len(pings)
+
+@api_router.post("/agents/location")
+async def report_location(data: LocationPing, agent=Depends(current_agent)):
+    return {"accepted": ingest_pings(agent, [data])}
+
+@api_router.post("/agents/location/batch")
+async def report_locations(data: LocationBatch, agent=Depends(current_agent)):
+    """Several fixes at once, e.g. buffered while offline; the latest by `at` becomes the position"""
+    if len(data.points) > MAX_LOCATION_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_LOCATION_BATCH} points per batch")
+    return {"accepted": ingest_pings(agent, data.points)}
+
+@api_router.get("/agents/near")
+async def get_agents_near(lat: float, lng: float, radius_km: float = 3, limit: int = 20,
+                          user=Depends(get_current_user)):
+    """Online agents near a point, served from memory"""
+    await require_role(user, ["merchant", "admin"])
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise HTTPException(status_code=400, detail="Invalid coordinates")
+    radius_km = max(0.0, min(radius_km, MAX_NEARBY_RADIUS_KM))
+    return agent_locations.near(lat, lng, radius_km, max(1, min(limit, MAX_PAGE_SIZE)))
+
+async def agent_location_flush_loop():
+    while True:
+        await asyncio.sleep(agent_locations.flush_interval)
+        try:
+            await agent_locations.flush()
+        except Exception as e:
+            logger.warning(f"Agent location flush failed: {e}")
+
+async def ensure_agent_location_history():
+    """Create agent_locations as a time series (MongoDB 5.0+) expiring after AGENT_LOCATION_HISTORY_DAYS"""
+    if "agent_locations" in await db.list_collection_names():
+        return
+    try:
+        await db.create_collection(
+            "agent_locations", timeseries={"timeField": "at", "metaField": "agent_id", "granularity": "seconds"},
+            expireAfterSeconds=int(AGENT_LOCATION_HISTORY_DAYS * 86400))
+    except OperationFailure as e:
+        logger.warning(f"agent_locations not created as a time series, history goes to a plain collection: {e}")
 
 # ======================== BANNER ROUTES ========================
 
 @api_router.get("/banners")
-async def get_banners():
+async def get_banners(request: Request, response: Response):
+    not_modified = await conditional_get(request, response, "banners")
+    if not_modified:
+        return not_modified
     banners = await db.banners.find({"is_active": True}, {"_id": 0}).sort("position", 1).to_list(20)
     return banners
 
@@ -701,6 +2740,7 @@ async def create_banner(data: BannerCreate, user=Depends(get_current_user)):
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.banners.insert_one(banner)
+    await content_versions.bump("banners")
     result = {k: v for k, v in banner.items() if k != "_id"}
     return result
 
@@ -763,15 +2803,26 @@ async def get_dashboard_stats(user=Depends(get_current_user)):
         }
     return stats
 
+@api_router.get("/cache/stats")
+async def get_cache_stats(user=Depends(get_current_user)):
+    await require_role(user, ["admin"])
+    return {
+        "products": product_cache.stats(),
+        "stores": store_cache.stats(),
+        "distances": distance_cache.stats(),
+        "carts": cart_store.stats(),
+        "events": events.stats(),
+        "agent_locations": agent_locations.stats(),
+    }
+
 # ======================== SETTLEMENT ROUTES ========================
 
 @api_router.get("/settlements")
-async def get_settlements(user=Depends(get_current_user)):
+async def get_settlements(response: Response, limit: int = 100, cursor: str = "",
+                          user=Depends(get_current_user)):
     role = user.get("active_role", "customer")
-    if role == "admin":
-        settlements = await db.settlements.find({}, {"_id": 0}).sort("created_at", -1).to_list(100)
-    else:
-        settlements = await db.settlements.find({"user_id": user["id"]}, {"_id": 0}).sort("created_at", -1).to_list(100)
+    query = {} if role == "admin" else {"user_id": user["id"]}
+    settlements = await paginate("settlements", query, response, limit, cursor)
     return settlements
 
 @api_router.post("/settlements/request")
@@ -801,31 +2852,84 @@ async def settle_payment(settlement_id: str, user=Depends(get_current_user)):
 # ======================== PROMOTIONS ========================
 
 @api_router.get("/promotions")
-async def get_promotions():
+async def get_promotions(request: Request, response: Response):
+    not_modified = await conditional_get(request, response, "promotions")
+    if not_modified:
+        return not_modified
     promos = await db.promotions.find({"is_active": True}, {"_id": 0}).to_list(50)
     return promos
 
+@api_router.post("/promotions")
+async def create_promotion(data: PromotionCreate, user=Depends(get_current_user)):
+    await require_role(user, ["admin"])
+    error = promotion_config_error(data.promo_type, data.config)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+    promo = {
+        "id": str(uuid.uuid4()),
+        "name": data.name,
+        "promo_type": data.promo_type,
+        "config": data.config,
+        "is_active": data.is_active,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db.promotions.insert_one(promo)
+    await content_versions.bump("promotions")
+    result = {k: v for k, v in promo.items() if k != "_id"}
+    return result
+
+# ======================== QUOTES ========================
+
+@api_router.post("/quotes/bulk")
+async def quote_bulk(data: BulkQuoteRequest):
+    """Delivery fee and promotion flags for many (subtotal, distance) or (subtotal, store) pairs"""
+    if len(data.items) > MAX_BULK_QUOTES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_QUOTES} quotes per request")
+    await refresh_promotion_engine()
+    distances = np.array([DEFAULT_DISTANCE_KM if i.distance_km is None else i.distance_km for i in data.items],
+                         dtype=float)
+    by_store = [n for n, i in enumerate(data.items) if i.distance_km is None and i.store_id]
+    if by_store:
+        if data.lat is None or data.lng is None:
+            raise HTTPException(status_code=400, detail="Delivery location is required for store quotes")
+        distances[by_store] = await delivery_distances_km([data.items[n].store_id for n in by_store], data.lat, data.lng)
+    quotes = calculate_promotions_bulk([i.subtotal for i in data.items], distances)
+    return {"quotes": [
+        {"store_id": item.store_id, "subtotal": item.subtotal, "distance_km": distance, "delivery_fee": fee,
+         "free_delivery_applied": applied, "gift_eligible": gift}
+        for item, distance, fee, applied, gift in zip(
+            data.items, distances.tolist(), quotes["delivery_fee"].tolist(),
+            quotes["free_delivery_applied"].tolist(), quotes["gift_eligible"].tolist())
+    ]}
+
 # ======================== SEARCH ========================
 
 @api_router.get("/search")
-async def search_all(q: str = ""):
+async def search_all(q: str = "", limit: int = 20, offset: int = 0):
     if not q:
-        return {"stores": [], "products": []}
-    stores = await db.stores.find(
-        {"name": {"$regex": q, "$options": "i"}}, {"_id": 0}
-    ).to_list(20)
-    products = await db.products.find(
-        {"$or": [
-            {"name": {"$regex": q, "$options": "i"}},
-            {"description": {"$regex": q, "$options": "i"}}
-        ]}, {"_id": 0}
-    ).to_list(20)
-    return {"stores": stores, "products": products}
+        return {"stores": [], "products": [], "total_stores": 0, "total_products": 0}
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    offset = max(0, offset)
+    store_ids, total_stores = store_search.search(q, limit, offset)
+    product_ids, total_products = product_search.search(q, limit, offset)
+    return {
+        "stores": await fetch_ranked("stores", store_ids) if store_ids else [],
+        "products": await fetch_ranked("products", product_ids) if product_ids else [],
+        "total_stores": total_stores,
+        "total_products": total_products
+    }
+
+@api_router.get("/search/suggest")
+async def search_suggest(prefix: str = "", limit: int = 8):
+    return {"suggestions": suggest_index.suggest(prefix, max(1, min(limit, SUGGEST_MAX_RESULTS)))}
 
 # ======================== CMS ========================
 
 @api_router.get("/cms")
-async def get_cms():
+async def get_cms(request: Request, response: Response):
+    not_modified = await conditional_get(request, response, "cms")
+    if not_modified:
+        return not_modified
     cms = await db.cms.find({}, {"_id": 0}).to_list(50)
     return {item["key"]: item["value"] for item in cms}
 
@@ -833,8 +2937,169 @@ async def get_cms():
 async def update_cms(key: str, value: Dict[str, Any], user=Depends(get_current_user)):
     await require_role(user, ["admin"])
     await db.cms.update_one({"key": key}, {"$set": {"value": value}}, upsert=True)
+    await content_versions.bump("cms")
     return {"message": "Updated"}
 
+# ======================== INDEXES ========================
+
+# collection -> [(keys, options)]; each entry backs a route's filter + sort
+INDEX_MANIFEST = {
+    "users": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("email", ASCENDING)], {"unique": True}),
+        ([("roles", ASCENDING)], {}),
+        ([("roles", ASCENDING), ("is_online", ASCENDING), ("location_at", ASCENDING)], {}),
+    ],
+    "products": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("created_at", ASCENDING), ("id", ASCENDING)], {}),
+        ([("store_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], {}),
+        ([("base_type", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], {}),
+    ],
+    "variants": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("product_id", ASCENDING)], {}),
+    ],
+    "sizes": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("variant_id", ASCENDING)], {}),
+    ],
+    "stores": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("created_at", ASCENDING), ("id", ASCENDING)], {}),
+        ([("location", GEOSPHERE)], {}),
+    ],
+    "store_menus": [
+        ([("store_id", ASCENDING)], {"unique": True}),
+    ],
+    "carts": [
+        ([("user_id", ASCENDING)], {"unique": True}),
+    ],
+    "orders": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ([("user_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ([("merchant_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ([("merchant_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ([("agent_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ([("agent_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ([("status", ASCENDING), ("agent_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ([("status", ASCENDING), ("agent_id", ASCENDING), ("claim_expires_at", ASCENDING)], {}),
+        ([("status", ASCENDING), ("agent_id", ASCENDING), ("pickup_location", GEOSPHERE)], {}),
+    ],
+    "settlements": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+    ],
+    "banners": [
+        ([("is_active", ASCENDING), ("position", ASCENDING)], {}),
+    ],
+    "promotions": [
+        ([("is_active", ASCENDING)], {}),
+    ],
+    "cms": [
+        ([("key", ASCENDING)], {"unique": True}),
+    ],
+    "content_versions": [
+        ([("resource", ASCENDING)], {"unique": True}),
+    ],
+    "agent_locations": [
+        ([("agent_id", ASCENDING), ("at", DESCENDING)], {}),
+    ],
+    "counters": [
+        ([("name", ASCENDING)], {"unique": True}),
+    ],
+}
+
+PAGE_ASC = [("created_at", ASCENDING), ("id", ASCENDING)]
+PAGE_DESC = [("created_at", DESCENDING), ("id", DESCENDING)]
+
+# (collection, filter, sort) for every indexed route query; used by check_indexes
+INDEX_PROBES = [
+    ("users", {"id": ""}, None),
+    ("users", {"email": ""}, None),
+    ("users", {"roles": "merchant"}, None),
+    ("users", {"roles": "agent", "is_online": True, "location_at": {"$gte": ""}}, None),
+    ("products", {"id": ""}, None),
+    ("products", {}, PAGE_ASC),
+    ("products", {"store_id": ""}, PAGE_ASC),
+    ("products", {"base_type": ""}, PAGE_ASC),
+    ("variants", {"id": ""}, None),
+    ("variants", {"product_id": {"$in": [""]}}, None),
+    ("sizes", {"id": ""}, None),
+    ("sizes", {"variant_id": {"$in": [""]}}, None),
+    ("stores", {"id": ""}, None),
+    ("stores", {}, PAGE_ASC),
+    ("stores", {"location": {"$nearSphere": {"$geometry": {"type": "Point", "coordinates": [0, 0]}}}}, None),
+    ("store_menus", {"store_id": ""}, None),
+    ("carts", {"user_id": ""}, None),
+    ("orders", {"id": ""}, None),
+    ("orders", {}, PAGE_DESC),
+    ("orders", {"user_id": ""}, PAGE_DESC),
+    ("orders", {"user_id": "", "status": ""}, PAGE_DESC),
+    ("orders", {"merchant_id": ""}, PAGE_DESC),
+    ("orders", {"merchant_id": "", "status": ""}, PAGE_DESC),
+    ("orders", {"agent_id": ""}, PAGE_DESC),
+    ("orders", {"agent_id": "", "status": ""}, PAGE_DESC),
+    ("orders", claimable(""), PAGE_DESC),
+    ("orders", claimable(""), DISPATCH_OLDEST_FIRST),
+    ("orders", {**claimable(""), "pickup_location": {"$nearSphere": {"$geometry": {"type": "Point", "coordinates": [0, 0]}}}}, None),
+    ("orders", {"status": "accepted", "agent_id": "", "claim_expires_at": {"$gt": "", "$lte": ""}}, None),
+    ("orders", {"status": "delivered"}, None),
+    ("settlements", {"id": ""}, None),
+    ("settlements", {}, PAGE_DESC),
+    ("settlements", {"user_id": ""}, PAGE_DESC),
+    ("banners", {"is_active": True}, [("position", ASCENDING)]),
+    ("promotions", {"is_active": True}, None),
+    ("cms", {"key": ""}, None),
+    ("content_versions", {"resource": ""}, None),
+    ("counters", {"name": ""}, None),
+]
+
+async def ensure_indexes():
+    """Create every index in INDEX_MANIFEST; safe to run repeatedly"""
+    for collection, indexes in INDEX_MANIFEST.items():
+        for keys, options in indexes:
+            try:
+                await db[collection].create_index(keys, **options)
+            except OperationFailure as e:
+                logger.warning(f"Index {collection}.{keys} not created: {e}")
+    logger.info("Indexes ensured")
+
+def _plan_stages(plan):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _plan_stages(value)
+
+async def check_indexes() -> List[str]:
+    """Explain each probe query and return the ones planned as a COLLSCAN"""
+    failures = []
+    for collection, query, sort in INDEX_PROBES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        if "COLLSCAN" in _plan_stages(explain["queryPlanner"]["winningPlan"]):
+            failures.append(f"{collection}: {query} sort={sort}")
+    return failures
+
+async def warn_on_collscans():
+    """Log every route query planned as a COLLSCAN; never fails startup"""
+    try:
+        failures = await check_indexes()
+    except OperationFailure as e:
+        logger.warning(f"Index check skipped: {e}")
+        return
+    for failure in failures:
+        logger.warning(f"COLLSCAN: {failure}")
+
 # ======================== SEED DATA ========================
 
 async def seed_data():
@@ -915,6 +3180,8 @@ async def seed_data():
          "is_open": True, "working_hours": "11:00 AM - 11:00 PM", "rating": 4.8, "total_orders": 234,
          "created_at": datetime.now(timezone.utc).isoformat()},
     ]
+    for store in stores:
+        store["location"] = geo_point(store["lat"], store["lng"])
     await db.stores.insert_many(stores)
 
     # Create Products with Variants and Sizes
@@ -1004,15 +3271,8 @@ async def seed_data():
 
     # Create default promotions
     promos = [
-        {"id": str(uuid.uuid4()), "name": "Gift with Purchase", "promo_type": "gift",
-         "config": {"min_cart_value": 1000, "gift_message": "Free gift with orders over ₹1000!"},
-         "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()},
-        {"id": str(uuid.uuid4()), "name": "Free Delivery - Near", "promo_type": "free_delivery",
-         "config": {"min_cart_value": 499, "max_distance_km": 3},
-         "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()},
-        {"id": str(uuid.uuid4()), "name": "Free Delivery - Far", "promo_type": "free_delivery",
-         "config": {"min_cart_value": 999, "max_distance_km": 5},
-         "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()},
+        {"id": str(uuid.uuid4()), **promo, "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()}
+        for promo in DEFAULT_PROMOTIONS
     ]
     await db.promotions.insert_many(promos)
 
@@ -1028,12 +3288,61 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
 @app.on_event("startup")
 async def startup():
+    await ensure_agent_location_history()
+    await ensure_indexes()
+    await warn_on_collscans()
     await seed_data()
+    await ensure_store_locations()
+    await refresh_search_indexes()
+    app.state.search_refresh = asyncio.create_task(search_refresh_loop())
+    if isinstance(cart_store, MemoryCartStore):
+        app.state.cart_flush = asyncio.create_task(cart_flush_loop())
+    app.state.dispatch_leases = asyncio.create_task(dispatch_lease_loop())
+    if AUTO_DISPATCH_SECONDS > 0:
+        app.state.auto_dispatch = asyncio.create_task(auto_dispatch_loop())
+    app.state.agent_location_flush = asyncio.create_task(agent_location_flush_loop())
+    if ORDER_EVENTS == "changestream":
+        app.state.order_changes = asyncio.create_task(order_change_stream())
 
 @app.on_event("shutdown")
 async def shutdown():
+    if hasattr(app.state, "search_refresh"):
+        app.state.search_refresh.cancel()
+    if hasattr(app.state, "cart_flush"):
+        app.state.cart_flush.cancel()
+    if hasattr(app.state, "dispatch_leases"):
+        app.state.dispatch_leases.cancel()
+    if hasattr(app.state, "order_changes"):
+        app.state.order_changes.cancel()
+    if hasattr(app.state, "auto_dispatch"):
+        app.state.auto_dispatch.cancel()
+    if hasattr(app.state, "agent_location_flush"):
+        app.state.agent_location_flush.cancel()
+    await cart_store.flush()
+    await agent_locations.flush()
     client.close()
+
+if __name__ == "__main__":
+    import argparse, sys
+
+    parser = argparse.ArgumentParser(description="Hyperlocal Delivery Platform maintenance")
+    parser.add_argument("command", choices=["ensure-indexes", "check-indexes"])
+    args = parser.parse_args()
+
+    async def main():
+        if args.command == "ensure-indexes":
+            await ensure_indexes()
+            return 0
+        failures = await check_indexes()
+        for failure in failures:
+            logger.error(f"COLLSCAN: {failure}")
+        if not failures:
+            logger.info(f"All {len(INDEX_PROBES)} route queries use an index")
+        return 1 if failures else 0
+
+    sys.exit(asyncio.run(main()))
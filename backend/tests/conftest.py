@@ -1,6 +1,13 @@
+import asyncio
 import pytest
 import requests
 import os
+import sys
+from pathlib import Path
+
+# Allow in-process tests to import server.py without a live backend
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
 
 @pytest.fixture
 def api_client():
@@ -13,3 +20,174 @@ def api_client():
 def base_url():
     """Base URL from environment"""
     return os.environ['EXPO_PUBLIC_BACKEND_URL'].rstrip('/')
+
+# ======================== IN-PROCESS FAKE DB ========================
+
+ROUND_TRIP_METHODS = {
+    "find", "find_one", "find_one_and_update", "insert_one", "insert_many",
+    "update_one", "update_many", "delete_one", "delete_many", "aggregate",
+    "count_documents", "bulk_write",
+}
+
+CURSOR_METHODS = {"find", "aggregate"}
+
+async def sorted_find_one_and_update(method, query, update, projection=None, **kwargs):
+    """mongomock re-runs the unsorted filter for the write unless the projection keeps _id"""
+    drop_id = (projection or {}).get("_id") == 0
+    keep_id = {k: v for k, v in (projection or {}).items() if k != "_id"} or None
+    doc = await method(query, update, projection=keep_id, **kwargs)
+    if doc is not None and drop_id:
+        doc.pop("_id")
+    return doc
+
+class CountingCollection:
+    """Proxy over a mongomock collection that counts every Mongo round trip"""
+    def __init__(self, db, collection):
+        self._db = db
+        self._collection = collection
+
+    def __getattr__(self, name):
+        if name in ROUND_TRIP_METHODS:
+            self._db.queries += 1
+        attr = getattr(self._collection, name)
+        if name in ROUND_TRIP_METHODS and name not in CURSOR_METHODS:
+            async def round_trip(*args, session=None, **kwargs):
+                # Yield like a network call would, so concurrent requests interleave
+                await asyncio.sleep(0)
+                # mongomock has no sessions; FakeSession provides the rollback instead
+                if name == "find_one_and_update" and kwargs.get("sort"):
+                    return await sorted_find_one_and_update(attr, *args, **kwargs)
+                return await attr(*args, **kwargs)
+            return round_trip
+        return attr
+
+class FakeSession:
+    """Transaction stand-in: rolls every collection back if the callback raises"""
+    def __init__(self, db):
+        self._db = db
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def with_transaction(self, callback):
+        names = await self._db.list_collection_names()
+        snapshot = {name: await self._db[name].find({}).to_list(None) for name in names}
+        try:
+            return await callback(self)
+        except BaseException:
+            for name in await self._db.list_collection_names():
+                await self._db[name].delete_many({})
+                if snapshot.get(name):
+                    await self._db[name].insert_many(snapshot[name])
+            raise
+
+class FakeReplicaSetClient:
+    """Client stand-in reporting a single-node replica set, so checkout uses transactions"""
+    def __init__(self, db):
+        self._db = db
+        self.admin = self
+
+    async def command(self, name):
+        assert name == "hello"
+        return {"isWritablePrimary": True, "setName": "rs0"}
+
+    async def start_session(self):
+        return FakeSession(self._db)
+
+class FakeDB:
+    def __init__(self):
+        from mongomock_motor import AsyncMongoMockClient
+        self._db = AsyncMongoMockClient()["test"]
+        self.client = FakeReplicaSetClient(self._db)
+        self.queries = 0
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return CountingCollection(self, self._db[name])
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def seed(self, name, docs):
+        """Insert fixtures without counting them as queries"""
+        asyncio.run(self._db[name].insert_many([dict(d) for d in docs]))
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """Swap server.db for an in-memory mongomock db that counts queries"""
+    import server
+    db = FakeDB()
+    monkeypatch.setattr(server, "db", db)
+    server.product_cache.clear()
+    server.store_cache.clear()
+    server.distance_cache.clear()
+    monkeypatch.setattr(server, "store_search", server.SearchIndex(server.store_search.fields))
+    monkeypatch.setattr(server, "product_search", server.SearchIndex(server.product_search.fields))
+    monkeypatch.setattr(server, "suggest_index", server.SuggestIndex())
+    monkeypatch.setattr(server, "content_versions", server.ContentVersions(server.CONTENT_VERSION_TTL_SECONDS))
+    # The seeded rules, current as of the empty db's promotions version
+    monkeypatch.setattr(server, "_transactions_supported", None)
+    monkeypatch.setattr(server, "promotion_engine", server.PromotionEngine(server.DEFAULT_PROMOTIONS, "0"))
+    monkeypatch.setattr(server, "order_numbers", server.SequenceAllocator("order_number", server.ORDER_NUMBER_BLOCK))
+    return db
+
+def make_request(path="/", query="", headers=None):
+    """Build a bare Starlette request for calling route functions directly"""
+    from starlette.requests import Request
+    return Request({
+        "type": "http", "method": "GET", "path": path, "query_string": query.encode(),
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+    })
+
+# ======================== SHARED SEEDS AND HELPERS ========================
+
+MERCHANT = {"id": "m1", "name": "Merchant", "roles": ["merchant"], "active_role": "merchant"}
+
+def agent(n):
+    return {"id": f"a{n}", "name": f"Agent {n}", "roles": ["agent"], "active_role": "agent"}
+
+def seed_menu(db, store_id, product_count, variants_per_product=3, sizes_per_variant=3):
+    products, variants, sizes = [], [], []
+    for p in range(product_count):
+        product_id = f"{store_id}-p{p}"
+        products.append({"id": product_id, "store_id": store_id, "name": f"Product {p}"})
+        for v in range(variants_per_product):
+            variant_id = f"{product_id}-v{v}"
+            variants.append({"id": variant_id, "product_id": product_id, "name": f"Variant {v}", "price": 100})
+            for s in range(sizes_per_variant):
+                sizes.append({"id": f"{variant_id}-s{s}", "variant_id": variant_id,
+                              "name": f"Size {s}", "price_modifier": s * 10})
+    for name, docs in (("products", products), ("variants", variants), ("sizes", sizes)):
+        if docs:
+            db.seed(name, docs)
+
+def seed_cart(db, item_count):
+    seed_menu(db, "s1", item_count, variants_per_product=2, sizes_per_variant=2)
+    items = [{"item_id": f"i{n}", "product_id": f"s1-p{n}", "variant_id": f"s1-p{n}-v1",
+              "size_id": f"s1-p{n}-v1-s1" if n % 2 else "", "quantity": 2} for n in range(item_count)]
+    db.seed("stores", [{"id": "s1", "name": "Store", "merchant_id": "m1", "lat": 12.9716, "lng": 77.5946}])
+    db.seed("carts", [{"user_id": "u1", "store_id": "s1", "items": items}])
+
+def seed_orders(db, count, status="accepted", **fields):
+    db.seed("orders", [{"id": f"o{n:03d}", "status": status, "agent_id": "", "agent_name": "",
+                        "store_id": "s1", "created_at": f"2024-01-01T00:{n // 60:02d}:{n % 60:02d}", **fields}
+                       for n in range(count)])
+
+@pytest.fixture
+def hub(monkeypatch):
+    """Swap server.events for a small hub so tests can watch what gets published"""
+    import server
+    hub = server.EventHub(queue_size=10)
+    monkeypatch.setattr(server, "events", hub)
+    return hub
+
+def drain(queue):
+    """Everything queued so far, without waiting"""
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+    return items
@@ -0,0 +1,149 @@
+"""Test agent location ingestion: in-memory pings, coalesced flushes and near queries"""
+import asyncio
+import time
+from collections import deque
+from datetime import datetime, timezone, timedelta
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+import server
+
+ORIGIN = (12.9716, 77.5946)
+
+def credentials(user_id):
+    return HTTPAuthorizationCredentials(scheme="Bearer", credentials=server.create_token(user_id))
+
+def agent_user(n, online=True, **fields):
+    return {"id": f"a{n}", "name": f"Agent {n}", "roles": ["agent"], "is_online": online, **fields}
+
+def ping(lat=ORIGIN[0], lng=ORIGIN[1], at=None):
+    return server.LocationPing(lat=lat, lng=lng, at=at)
+
+@pytest.fixture
+def tracker(monkeypatch):
+    tracker = server.AgentLocations(buffer_size=100, fresh_seconds=60, flush_interval=2)
+    monkeypatch.setattr(server, "agent_locations", tracker)
+    server.agent_auth_cache.clear()
+    return tracker
+
+def report(agent_id, *pings):
+    async def run():
+        agent = await server.current_agent(credentials(agent_id))
+        if len(pings) == 1:
+            return await server.report_location(pings[0], agent=agent)
+        return await server.report_locations(server.LocationBatch(points=list(pings)), agent=agent)
+    return asyncio.run(run())
+
+class TestIngestion:
+    """Test pings stay in memory"""
+
+    def test_pings_cost_one_auth_read_per_agent(self, fake_db, tracker):
+        fake_db.seed("users", [agent_user(1)])
+        for n in range(5):
+            assert report("a1", ping(ORIGIN[0] + n * 0.001))["accepted"] == 1
+        assert fake_db.queries == 1
+        assert tracker.stats()["pings"] == 5
+        assert tracker.near(*ORIGIN, 1, 10)[0]["lat"] == pytest.approx(ORIGIN[0] + 0.004)
+
+    def test_batch_keeps_the_latest_fix(self, fake_db, tracker):
+        fake_db.seed("users", [agent_user(1)])
+        now = time.time()
+        report("a1", ping(ORIGIN[0] + 0.01, at=now - 1), ping(ORIGIN[0], at=now - 5), ping(at=now + 3600))
+        lat, _, at = tracker._latest["a1"]
+        # A fix from the future is clamped to receipt, so it still wins
+        assert lat == ORIGIN[0] and at <= time.time()
+
+    def test_rejects_bad_input(self, fake_db, tracker):
+        fake_db.seed("users", [agent_user(1), {"id": "c1", "roles": ["customer"]}])
+        with pytest.raises(HTTPException) as exc:
+            report("a1", ping(lat=91))
+        assert exc.value.status_code == 400
+        with pytest.raises(HTTPException) as exc:
+            report("a1", *[ping()] * (server.MAX_LOCATION_BATCH + 1))
+        assert exc.value.status_code == 400
+        with pytest.raises(HTTPException) as exc:
+            report("c1", ping())
+        assert exc.value.status_code == 403
+
+    def test_offline_agents_are_ignored_and_dropped(self, fake_db, tracker):
+        fake_db.seed("users", [agent_user(1, online=False), agent_user(2)])
+        assert report("a1", ping())["accepted"] == 0
+        report("a2", ping())
+        user = asyncio.run(fake_db._db.users.find_one({"id": "a2"}, {"_id": 0}))
+        asyncio.run(server.toggle_online(user=user))
+        assert tracker.near(*ORIGIN, 1, 10) == []
+
+    def test_ring_buffer_is_bounded(self, tracker):
+        for n in range(250):
+            tracker.record(f"a{n % 10}", *ORIGIN, time.time())
+        assert tracker.stats()["buffered"] == 100
+        assert tracker.stats()["dropped"] == 150
+        assert len(tracker.grid) == 10
+
+    def test_thousands_of_pings_per_second(self, fake_db, tracker, monkeypatch):
+        monkeypatch.setattr(tracker, "_history", deque(maxlen=100_000))
+        fake_db.seed("users", [agent_user(n) for n in range(1000)])
+        agents = [asyncio.run(server.current_agent(credentials(f"a{n}"))) for n in range(1000)]
+        pings = [ping(ORIGIN[0] + (n % 100) * 0.001, ORIGIN[1] + (n // 100) * 0.001) for n in range(20_000)]
+
+        async def run():
+            start = time.perf_counter()
+            for n, p in enumerate(pings):
+                await server.report_location(p, agent=agents[n % 1000])
+            return time.perf_counter() - start
+
+        elapsed = asyncio.run(run())
+        assert len(pings) / elapsed > 5000
+        assert tracker.stats()["agents"] == 1000
+
+class TestFlush:
+    """Test coalesced persistence and cross-worker sync"""
+
+    def test_flush_coalesces_into_two_writes(self, fake_db, tracker):
+        fake_db.seed("users", [agent_user(1), agent_user(2)])
+        now = time.time()
+        for n in range(10):
+            tracker.record("a1", ORIGIN[0] + n * 0.001, ORIGIN[1], now - 10 + n)
+        tracker.record("a2", *ORIGIN, now)
+        asyncio.run(tracker.flush())
+        # bulk_write of latest positions + insert_many of history + one sync read
+        assert fake_db.queries == 3
+        a1 = asyncio.run(fake_db._db.users.find_one({"id": "a1"}))
+        assert a1["location"]["coordinates"] == [ORIGIN[1], pytest.approx(ORIGIN[0] + 0.009)]
+        assert asyncio.run(fake_db._db.agent_locations.count_documents({})) == 11
+        assert tracker.stats()["dirty"] == tracker.stats()["buffered"] == 0
+
+    def test_sync_picks_up_other_workers(self, fake_db, tracker):
+        fresh = datetime.now(timezone.utc).isoformat()
+        stale = (datetime.now(timezone.utc) - timedelta(minutes=5)).isoformat()
+        fake_db.seed("users", [
+            agent_user(1, location=server.geo_point(*ORIGIN), location_at=fresh),
+            agent_user(2, location=server.geo_point(*ORIGIN), location_at=stale),
+            agent_user(3, online=False, location=server.geo_point(*ORIGIN), location_at=fresh),
+        ])
+        asyncio.run(tracker.flush())
+        assert [a["agent_id"] for a in tracker.near(*ORIGIN, 1, 10)] == ["a1"]
+
+    def test_failed_flush_keeps_positions_dirty(self, fake_db, tracker, monkeypatch):
+        tracker.record("a1", *ORIGIN, time.time())
+
+        async def down(*args, **kwargs):
+            raise RuntimeError("mongo down")
+
+        monkeypatch.setattr(fake_db, "users", type("Users", (), {"bulk_write": down})(), raising=False)
+        with pytest.raises(RuntimeError):
+            asyncio.run(tracker.flush())
+        assert tracker.stats()["dirty"] == 1
+
+class TestNear:
+    """Test the near-point query"""
+
+    def test_nearest_first_with_limit_and_freshness(self, fake_db, tracker):
+        now = time.time()
+        for n in range(5):
+            tracker.record(f"a{n}", ORIGIN[0] + n * 0.005, ORIGIN[1], now)
+        tracker.record("old", *ORIGIN, now - 120)
+        merchant = {"id": "m1", "roles": ["merchant"], "active_role": "merchant"}
+        near = asyncio.run(server.get_agents_near(*ORIGIN, radius_km=1.5, limit=2, user=merchant))
+        assert [a["agent_id"] for a in near] == ["a0", "a1"]
+        assert near[1]["distance_km"] == pytest.approx(0.556, abs=0.01)
@@ -0,0 +1,114 @@
+"""Test batch auto-dispatch: grid pruning, optimal matching and applied assignments"""
+import asyncio
+import itertools
+import random
+from datetime import datetime, timezone, timedelta
+import numpy as np
+import pytest
+import server
+from conftest import drain
+
+def point(lat, lng):
+    return {"type": "Point", "coordinates": [lng, lat]}
+
+def order(n, lat, lng, **fields):
+    return {"id": f"o{n}", "status": "accepted", "agent_id": "", "agent_name": "",
+            "created_at": f"2024-01-01T00:00:{n:02d}", "pickup_location": point(lat, lng), **fields}
+
+def agent(n, lat, lng, seconds_ago=5, **fields):
+    at = (datetime.now(timezone.utc) - timedelta(seconds=seconds_ago)).isoformat()
+    return {"id": f"a{n}", "name": f"Agent {n}", "roles": ["agent"], "is_online": True,
+            "location": point(lat, lng), "location_at": at, **fields}
+
+# Points due north of a fixed origin, so distances are easy to read
+def km_north(km):
+    return 12.9 + km / server.KM_PER_DEGREE
+
+class TestMinCostAssignment:
+    """Test the Hungarian solver against brute force"""
+
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(3)
+        for _ in range(100):
+            rows = int(rng.integers(1, 5))
+            cost = rng.random((rows, int(rng.integers(rows, 6)))) * 10
+            pairs = server.min_cost_assignment(cost)
+            best = min(sum(cost[r, p[r]] for r in range(rows))
+                       for p in itertools.permutations(range(cost.shape[1]), rows))
+            assert len({c for _, c in pairs}) == len(pairs) == rows
+            assert sum(cost[r, c] for r, c in pairs) == pytest.approx(best)
+
+class TestSpatialGrid:
+    """Test grid radius queries against a full scan"""
+
+    def test_near_matches_full_scan(self):
+        rng = random.Random(5)
+        grid = server.SpatialGrid(2.0)
+        points = {f"p{n}": (12.9 + rng.uniform(-0.2, 0.2), 77.6 + rng.uniform(-0.2, 0.2)) for n in range(500)}
+        for key, (lat, lng) in points.items():
+            grid.add(key, lat, lng)
+        grid.add("p0", 13.5, 78.5)  # moves, so the old cell must forget it
+        points["p0"] = (13.5, 78.5)
+        got = [key for _, key in grid.near(12.9, 77.6, 5.0)]
+        expected = sorted((server.haversine_km(12.9, 77.6, lat, lng), key)
+                          for key, (lat, lng) in points.items()
+                          if server.haversine_km(12.9, 77.6, lat, lng) <= 5.0)
+        assert got == [key for _, key in expected]
+        grid.remove("p1")
+        assert len(grid) == 499
+
+class TestMatching:
+    """Test match_orders_to_agents"""
+
+    def test_batch_beats_greedy(self):
+        # Greedy would give a1 to o1 (0.5km) and leave o2 with nobody in range
+        orders = [order(1, km_north(0), 77.6), order(2, km_north(4), 77.6)]
+        agents = [agent(1, km_north(0.5), 77.6), agent(2, km_north(-2), 77.6)]
+        matched = {o["id"]: a["id"] for o, a in server.match_orders_to_agents(orders, agents, {})}
+        assert matched == {"o1": "a2", "o2": "a1"}
+
+    def test_load_weighs_against_busy_agents(self):
+        orders = [order(1, km_north(0), 77.6)]
+        agents = [agent(1, km_north(0.2), 77.6), agent(2, km_north(1), 77.6)]
+        assert server.match_orders_to_agents(orders, agents, {"a1": 1})[0][1]["id"] == "a2"
+        assert server.match_orders_to_agents(orders, agents, {})[0][1]["id"] == "a1"
+        full = {"a1": server.AGENT_MAX_ACTIVE_ORDERS, "a2": server.AGENT_MAX_ACTIVE_ORDERS}
+        assert server.match_orders_to_agents(orders, agents, full) == []
+
+    def test_agents_out_of_range_are_not_matched(self):
+        orders = [order(1, km_north(0), 77.6)]
+        agents = [agent(1, km_north(server.AUTO_DISPATCH_RADIUS_KM + 1), 77.6)]
+        assert server.match_orders_to_agents(orders, agents, {}) == []
+
+class TestRunAutoDispatch:
+    """Test a dispatch round against the db"""
+
+    def test_assigns_through_transitions(self, fake_db, hub):
+        fake_db.seed("orders", [
+            order(1, km_north(0), 77.6),
+            order(2, km_north(1), 77.6),
+            order(3, km_north(2), 77.6, claimed_by="a9",
+                  claim_expires_at=(datetime.now(timezone.utc) + timedelta(seconds=30)).isoformat()),
+            order(4, km_north(0), 77.6, status="placed"),
+        ])
+        fake_db.seed("users", [
+            agent(1, km_north(0.1), 77.6),
+            agent(2, km_north(1.1), 77.6),
+            agent(3, km_north(0), 77.6, seconds_ago=600),  # stale position
+            agent(4, km_north(0), 77.6, is_online=False),
+        ])
+        pool = hub.subscribe("dispatch")
+        assigned = asyncio.run(server.run_auto_dispatch())
+        assert sorted((a["order_id"], a["agent_id"]) for a in assigned) == [("o1", "a1"), ("o2", "a2")]
+        stored = {o["id"]: o for o in asyncio.run(fake_db._db.orders.find({}, {"_id": 0}).to_list(None))}
+        assert (stored["o1"]["status"], stored["o1"]["agent_name"]) == ("assigned", "Agent 1")
+        assert stored["o3"]["agent_id"] == "" and stored["o4"]["status"] == "placed"
+        assert {e["order_id"] for e in drain(pool)} == {"o1", "o2"}
+
+    def test_orders_taken_mid_round_are_skipped(self, fake_db, hub, monkeypatch):
+        fake_db.seed("orders", [order(1, km_north(0), 77.6), order(2, km_north(0), 77.6, status="cancelled")])
+        fake_db.seed("users", [agent(1, km_north(0.1), 77.6)])
+        # As if o2 was cancelled between the batch read and its assignment
+        monkeypatch.setattr(server, "match_orders_to_agents",
+                            lambda orders, agents, loads: [({"id": "o2"}, agents[0]), (orders[0], agents[0])])
+        assert asyncio.run(server.run_auto_dispatch()) == [{"order_id": "o1", "agent_id": "a1"}]
@@ -0,0 +1,48 @@
+"""Test vectorized bulk quotes agree with the scalar promotion engine"""
+import asyncio
+import random
+import pytest
+from fastapi import HTTPException
+import server
+
+class TestBulkQuotes:
+    """Test calculate_promotions_bulk and POST /quotes/bulk"""
+
+    def test_vectorized_matches_scalar(self):
+        rng = random.Random(3)
+        subtotals = [0, 499, 499.5, 999, 999.5, 1000, 1000.5] + [round(rng.uniform(0, 2500), 2) for _ in range(2000)]
+        distances = [0, 2.99, 3, 4.99, 5, 8, 2] + [round(rng.uniform(0, 12), 2) for _ in range(2000)]
+        bulk = server.calculate_promotions_bulk(subtotals, distances)
+        for n, (subtotal, distance) in enumerate(zip(subtotals, distances)):
+            scalar = server.calculate_promotions(subtotal, distance)
+            assert bulk["delivery_fee"][n] == scalar["delivery_fee"], (subtotal, distance)
+            assert bulk["free_delivery_applied"][n] == scalar["free_delivery_applied"], (subtotal, distance)
+            assert bulk["gift_eligible"][n] == scalar["gift_eligible"], (subtotal, distance)
+
+    def test_store_quotes_use_server_distances(self, fake_db):
+        fake_db.seed("stores", [
+            {"id": "near", "name": "Near", "lat": 12.9716, "lng": 77.5946},
+            {"id": "far", "name": "Far", "lat": 12.9352, "lng": 77.6245},
+        ])
+        data = server.BulkQuoteRequest(lat=12.9716, lng=77.5946, items=[
+            server.QuoteItem(store_id="near", subtotal=600),
+            server.QuoteItem(store_id="far", subtotal=600),
+            server.QuoteItem(store_id="missing", subtotal=600),
+            server.QuoteItem(subtotal=1200, distance_km=4),
+        ])
+        quotes = asyncio.run(server.quote_bulk(data))["quotes"]
+        assert [q["free_delivery_applied"] for q in quotes] == [True, False, True, True]
+        assert quotes[2]["distance_km"] == server.DEFAULT_DISTANCE_KM
+        for quote in quotes[:2]:
+            scalar = asyncio.run(server.delivery_distance_km(quote["store_id"], 12.9716, 77.5946))
+            assert quote["distance_km"] == scalar
+        # Both store distances are now cached for this cell
+        fake_db.queries = 0
+        asyncio.run(server.quote_bulk(data))
+        assert fake_db.queries == 1  # only the unknown store is looked up again
+
+    def test_store_quotes_need_a_location(self, fake_db):
+        data = server.BulkQuoteRequest(items=[server.QuoteItem(store_id="s1", subtotal=100)])
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(server.quote_bulk(data))
+        assert exc.value.status_code == 400
@@ -35,7 +35,7 @@ class TestCartAndPromotions:
         api_client.delete(f"{BASE_URL}/api/cart/clear", headers={"Authorization": f"Bearer {customer_token}"})
         
         # Get a product with variant
-        products = api_client.get(f"{BASE_URL}/api/products").json()
+        products = api_client.get(f"{BASE_URL}/api/products?fields=name,store_id,variants").json()
         product = products[0]
         variant = product["variants"][0]
         size = variant["sizes"][0] if variant["sizes"] else None
@@ -66,7 +66,7 @@ class TestCartAndPromotions:
     def test_update_cart_quantity(self, api_client, customer_token):
         """Test updating cart item quantity"""
         # Add item first
-        products = api_client.get(f"{BASE_URL}/api/products").json()
+        products = api_client.get(f"{BASE_URL}/api/products?fields=name,store_id,variants").json()
         product = products[0]
         variant = product["variants"][0]
         
@@ -97,7 +97,7 @@ class TestCartAndPromotions:
     def test_promotion_upsell_message(self, api_client, customer_token):
         """Test upsell promotion (cart < 1000)"""
         # Add low value item
-        products = api_client.get(f"{BASE_URL}/api/products").json()
+        products = api_client.get(f"{BASE_URL}/api/products?fields=name,store_id,variants").json()
         # Find cheapest product
         cheapest = min(products, key=lambda p: p["variants"][0]["price"] if p["variants"] else 9999)
         variant = cheapest["variants"][0]
@@ -120,7 +120,7 @@ class TestCartAndPromotions:
     def test_promotion_gift_eligible(self, api_client, customer_token):
         """Test gift with purchase (cart > 1000)"""
         # Add high value items
-        products = api_client.get(f"{BASE_URL}/api/products").json()
+        products = api_client.get(f"{BASE_URL}/api/products?fields=name,store_id,variants").json()
         
         api_client.delete(f"{BASE_URL}/api/cart/clear", headers={"Authorization": f"Bearer {customer_token}"})
         
@@ -144,7 +144,7 @@ class TestCartAndPromotions:
     def test_promotion_free_delivery(self, api_client, customer_token):
         """Test free delivery promotion"""
         # Add items worth > 499
-        products = api_client.get(f"{BASE_URL}/api/products").json()
+        products = api_client.get(f"{BASE_URL}/api/products?fields=name,store_id,variants").json()
         
         api_client.delete(f"{BASE_URL}/api/cart/clear", headers={"Authorization": f"Bearer {customer_token}"})
         
@@ -0,0 +1,187 @@
+"""Test atomic cart mutations under concurrent requests, for each cart storage tier"""
+import asyncio
+import pytest
+from fastapi import BackgroundTasks
+import server
+from conftest import seed_menu
+
+CUSTOMER = {"id": "u1", "name": "Customer", "roles": ["customer"], "active_role": "customer"}
+
+def setup_carts(db):
+    asyncio.run(db.carts.create_index("user_id", unique=True))
+    seed_menu(db, "s1", 20, variants_per_product=2, sizes_per_variant=2)
+    seed_menu(db, "s2", 1)
+    db.queries = 0
+
+def add(product, variant, size="", quantity=1):
+    data = server.CartItemAdd(product_id=product, variant_id=variant, size_id=size, quantity=quantity)
+    return server.add_to_cart(data, user=CUSTOMER)
+
+async def gather(*calls):
+    return await asyncio.gather(*calls)
+
+def stored_items(db):
+    asyncio.run(server.cart_store.flush())
+    return asyncio.run(db.carts.find_one({"user_id": "u1"}))["items"]
+
+@pytest.fixture(params=["mongo", "memory"])
+def cart_store(request, monkeypatch, fake_db):
+    if request.param == "mongo":
+        store = server.MongoCartStore()
+    else:
+        store = server.MemoryCartStore(maxsize=100, flush_interval=60, max_dirty=1000)
+    monkeypatch.setattr(server, "cart_store", store)
+    return store
+
+class TestCartMutations:
+    """Test add/update/remove are single atomic updates"""
+
+    def test_concurrent_adds_of_one_line_are_not_lost(self, fake_db, cart_store):
+        setup_carts(fake_db)
+        asyncio.run(gather(*[add("s1-p0", "s1-p0-v0", "s1-p0-v0-s1") for _ in range(100)]))
+        items = stored_items(fake_db)
+        assert len(items) == 1
+        assert items[0]["quantity"] == 100
+
+    def test_concurrent_adds_of_distinct_lines_are_all_kept(self, fake_db, cart_store):
+        setup_carts(fake_db)
+        calls = [add(f"s1-p{p}", f"s1-p{p}-v{v}", quantity=2) for _ in range(2) for p in range(20) for v in range(2)]
+        asyncio.run(gather(*calls))
+        items = stored_items(fake_db)
+        assert len(items) == 40
+        assert {i["quantity"] for i in items} == {4}
+
+    def test_existing_line_is_one_round_trip(self, fake_db):
+        setup_carts(fake_db)
+        asyncio.run(add("s1-p0", "s1-p0-v0"))
+        fake_db.queries = 0
+        result = asyncio.run(add("s1-p0", "s1-p0-v0"))
+        # product lookup, then the $inc
+        assert fake_db.queries == 2
+        assert result["item_count"] == 1
+
+    def test_adding_from_another_store_switches_the_cart(self, fake_db, cart_store):
+        setup_carts(fake_db)
+        asyncio.run(add("s1-p0", "s1-p0-v0"))
+        asyncio.run(add("s1-p1", "s1-p1-v0"))
+        result = asyncio.run(add("s2-p0", "s2-p0-v0"))
+        assert result["item_count"] == 1
+        assert [i["product_id"] for i in stored_items(fake_db)] == ["s2-p0"]
+        assert asyncio.run(server.cart_store.get("u1"))["store_id"] == "s2"
+
+    def test_update_and_remove(self, fake_db, cart_store):
+        setup_carts(fake_db)
+        asyncio.run(add("s1-p0", "s1-p0-v0"))
+        asyncio.run(add("s1-p1", "s1-p1-v0"))
+        first, second = [i["item_id"] for i in stored_items(fake_db)]
+        asyncio.run(gather(
+            server.update_cart_item(server.CartItemUpdate(item_id=first, quantity=5), user=CUSTOMER),
+            server.update_cart_item(server.CartItemUpdate(item_id=second, quantity=0), user=CUSTOMER),
+        ))
+        items = stored_items(fake_db)
+        assert [(i["item_id"], i["quantity"]) for i in items] == [(first, 5)]
+
+class TestCartSnapshot:
+    """Test the cart keeps its priced lines until the catalog changes"""
+
+    def test_added_lines_are_priced_once(self, fake_db):
+        setup_carts(fake_db)
+        asyncio.run(add("s1-p0", "s1-p0-v0", "s1-p0-v0-s1", quantity=3))
+        asyncio.run(add("s1-p0", "s1-p0-v0", "s1-p0-v0-s1"))
+        fake_db.queries = 0
+        cart = asyncio.run(server.get_cart(user=CUSTOMER))
+        assert fake_db.queries == 1
+        assert (cart["items"][0]["price"], cart["subtotal"]) == (110, 440)
+
+    def test_price_change_reprices_the_cart(self, fake_db, cart_store):
+        setup_carts(fake_db)
+        asyncio.run(add("s1-p0", "s1-p0-v0", "s1-p0-v0-s1"))
+        assert asyncio.run(server.get_cart(user=CUSTOMER))["subtotal"] == 110
+        asyncio.run(fake_db.sizes.update_one({"id": "s1-p0-v0-s1"}, {"$set": {"price_modifier": 50}}))
+        asyncio.run(server.product_changed("s1-p0"))
+        cart = asyncio.run(server.get_cart(user=CUSTOMER))
+        assert cart["subtotal"] == 150
+        assert stored_items(fake_db)[0]["price"] == 150
+
+    def test_unrelated_product_edit_skips_the_reprice(self, fake_db, cart_store, monkeypatch):
+        setup_carts(fake_db)
+        asyncio.run(add("s1-p0", "s1-p0-v0", "s1-p0-v0-s1"))
+        asyncio.run(add("s1-p1", "s1-p1-v0"))
+        asyncio.run(server.get_cart(user=CUSTOMER))
+        asyncio.run(fake_db.variants.update_one({"id": "s1-p5-v0"}, {"$set": {"price": 999}}))
+        asyncio.run(server.product_changed("s1-p5"))
+        monkeypatch.setattr(server, "price_cart", lambda items: pytest.fail("repriced the cart"))
+        assert asyncio.run(server.get_cart(user=CUSTOMER))["subtotal"] == 210
+        # The snapshot moved to the new catalog version, so the next read is free again
+        fake_db.queries = 0
+        asyncio.run(server.get_cart(user=CUSTOMER))
+        assert fake_db.queries == (1 if isinstance(cart_store, server.MongoCartStore) else 0)
+
+    def test_only_changed_lines_are_repriced(self, fake_db, cart_store, monkeypatch):
+        setup_carts(fake_db)
+        asyncio.run(add("s1-p0", "s1-p0-v0"))
+        asyncio.run(add("s1-p1", "s1-p1-v0"))
+        asyncio.run(fake_db.variants.update_one({"id": "s1-p1-v0"}, {"$set": {"price": 150}}))
+        asyncio.run(server.product_changed("s1-p1"))
+        price_cart, priced = server.price_cart, []
+
+        async def watched(items):
+            priced.extend(i["product_id"] for i in items)
+            return await price_cart(items)
+
+        monkeypatch.setattr(server, "price_cart", watched)
+        assert asyncio.run(server.get_cart(user=CUSTOMER))["subtotal"] == 250
+        assert priced == ["s1-p1"]
+
+class TestMemoryCartStore:
+    """Test the write-behind cart tier"""
+
+    @pytest.fixture
+    def memory_store(self, monkeypatch, fake_db):
+        store = server.MemoryCartStore(maxsize=2, flush_interval=60, max_dirty=1000)
+        monkeypatch.setattr(server, "cart_store", store)
+        setup_carts(fake_db)
+        return store
+
+    def test_mutations_are_written_behind_in_one_batch(self, fake_db, memory_store):
+        asyncio.run(add("s1-p0", "s1-p0-v0"))
+        for p in range(1, 5):
+            asyncio.run(add(f"s1-p{p}", f"s1-p{p}-v0"))
+        asyncio.run(add("s1-p0", "s1-p0-v0"))
+        # Pricing the new lines reads the catalog; nothing is written yet
+        assert asyncio.run(fake_db.carts.count_documents({})) == 0
+        fake_db.queries = 0
+        asyncio.run(memory_store.flush())
+        assert fake_db.queries == 1
+        cart = asyncio.run(fake_db.carts.find_one({"user_id": "u1"}))
+        assert [i["quantity"] for i in cart["items"]] == [2, 1, 1, 1, 1]
+        assert memory_store.stats()["dirty"] == 0
+
+    def test_miss_falls_back_to_mongo(self, fake_db, memory_store):
+        fake_db.seed("carts", [{"user_id": "u1", "store_id": "s1", "items": [
+            {"item_id": "i1", "product_id": "s1-p0", "variant_id": "s1-p0-v0", "size_id": "", "quantity": 2}]}])
+        cart = asyncio.run(server.get_cart(user=CUSTOMER))
+        assert cart["subtotal"] == 200
+        assert memory_store.stats()["misses"] == 1
+        fake_db.queries = 0
+        asyncio.run(add("s1-p0", "s1-p0-v0"))
+        assert asyncio.run(server.get_cart(user=CUSTOMER))["subtotal"] == 300
+        assert fake_db.queries == 1  # the product lookup; the cart never left memory
+
+    def test_checkout_persists_the_cleared_cart(self, fake_db, memory_store):
+        fake_db.seed("stores", [{"id": "s1", "name": "Store", "merchant_id": "m1", "lat": 12.9716, "lng": 77.5946}])
+        asyncio.run(add("s1-p0", "s1-p0-v0"))
+        data = server.CheckoutRequest(delivery_address="Home", lat=12.9716, lng=77.5946)
+        order = asyncio.run(server.create_order(data, BackgroundTasks(), user=CUSTOMER))
+        assert order["subtotal"] == 100
+        assert asyncio.run(fake_db.carts.find_one({"user_id": "u1"}))["items"] == []
+
+    def test_only_clean_carts_are_evicted(self, fake_db, memory_store):
+        for n in range(4):
+            user = {**CUSTOMER, "id": f"u{n}"}
+            data = server.CartItemAdd(product_id="s1-p0", variant_id="s1-p0-v0")
+            asyncio.run(server.add_to_cart(data, user=user))
+        assert memory_store.stats()["size"] == 4
+        asyncio.run(memory_store.flush())
+        assert memory_store.stats()["size"] == 2
+        assert asyncio.run(fake_db.carts.count_documents({})) == 4
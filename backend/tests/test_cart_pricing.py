@@ -0,0 +1,43 @@
+"""Test batched cart pricing keeps Mongo round trips constant"""
+import asyncio
+import pytest
+from fastapi import BackgroundTasks
+import server
+from conftest import seed_cart
+
+CUSTOMER = {"id": "u1", "name": "Customer", "roles": ["customer"], "active_role": "customer"}
+
+class TestCartPricing:
+    """Test get_cart and create_order share one batched pricing pass"""
+
+    @pytest.mark.parametrize("item_count", [2, 15, 50])
+    def test_get_cart_query_count_is_constant(self, fake_db, item_count):
+        seed_cart(fake_db, item_count)
+        cart = asyncio.run(server.get_cart(user=CUSTOMER))
+        # cart, catalog version, product revisions, one $in each for products, variants and sizes, snapshot write
+        assert fake_db.queries == 7
+        assert len(cart["items"]) == item_count
+        expected = sum((100 + (10 if n % 2 else 0)) * 2 for n in range(item_count))
+        assert cart["subtotal"] == expected
+        fake_db.queries = 0
+        again = asyncio.run(server.get_cart(user=CUSTOMER))
+        assert fake_db.queries == 1
+        assert again == cart
+
+    def test_cached_products_skip_lookups(self, fake_db):
+        seed_cart(fake_db, 15)
+        asyncio.run(server.get_store("s1"))  # hydrates every product into product_cache
+        fake_db.queries = 0
+        cart = asyncio.run(server.get_cart(user=CUSTOMER))
+        # cart, catalog version, product revisions and the snapshot write
+        assert fake_db.queries == 4
+        assert cart["items"][1]["size_name"] == "Size 1"
+
+    def test_order_lines_match_cart(self, fake_db):
+        seed_cart(fake_db, 3)
+        cart = asyncio.run(server.get_cart(user=CUSTOMER))
+        data = server.CheckoutRequest(delivery_address="Home", lat=12.9716, lng=77.5946)
+        order = asyncio.run(server.create_order(data, BackgroundTasks(), user=CUSTOMER))
+        assert order["subtotal"] == cart["subtotal"]
+        assert [i["price"] for i in order["items"]] == [i["price"] for i in cart["items"]]
+        assert set(order["items"][0]) == set(server.ORDER_ITEM_FIELDS)
@@ -0,0 +1,50 @@
+"""Test the catalog LRU/TTL cache and its write-through invalidation"""
+import asyncio
+import server
+from conftest import MERCHANT, seed_menu
+
+class TestLRUCache:
+    """Test cache bookkeeping"""
+
+    def test_lru_eviction_and_counters(self):
+        cache = server.LRUCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1  # a is now most recent
+        cache.set("c", 3)           # evicts b
+        assert cache.get("b") is None
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["evictions"], stats["size"]) == (1, 1, 1, 2)
+
+    def test_ttl_expiry(self):
+        cache = server.LRUCache(maxsize=10, ttl=-1)
+        cache.set("a", 1)
+        assert cache.get("a") is None
+        assert cache.stats()["evictions"] == 1
+
+class TestCatalogCache:
+    """Test catalog reads are served from cache until a write invalidates them"""
+
+    def test_store_page_served_from_cache(self, fake_db):
+        fake_db.seed("stores", [{"id": "s1", "name": "Store"}])
+        seed_menu(fake_db, "s1", 10)
+        asyncio.run(server.get_store("s1"))
+        fake_db.queries = 0
+        store = asyncio.run(server.get_store("s1"))
+        assert len(store["products"]) == 10
+        assert fake_db.queries == 0
+        product = asyncio.run(server.get_product("s1-p0"))
+        assert product["id"] == "s1-p0"
+        assert fake_db.queries == 0
+
+    def test_create_size_invalidates_product_and_store(self, fake_db):
+        fake_db.seed("stores", [{"id": "s1", "name": "Store"}])
+        seed_menu(fake_db, "s1", 2, variants_per_product=1, sizes_per_variant=1)
+        asyncio.run(server.get_store("s1"))
+        data = server.SizeCreate(variant_id="s1-p0-v0", name="Jumbo", price_modifier=50)
+        asyncio.run(server.create_size(data, user=MERCHANT))
+        store = asyncio.run(server.get_store("s1"))
+        sizes = store["products"][0]["variants"][0]["sizes"]
+        assert [s["name"] for s in sizes] == ["Size 0", "Jumbo"]
+        # The untouched product is still cached
+        assert server.product_cache.get("s1-p1") is not None
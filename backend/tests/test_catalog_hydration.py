@@ -0,0 +1,39 @@
+"""Test batched catalog hydration keeps Mongo round trips constant"""
+import asyncio
+import pytest
+import server
+from fastapi import Response
+from conftest import make_request, seed_menu
+
+class TestCatalogHydration:
+    """Test product -> variants -> sizes hydration"""
+
+    @pytest.mark.parametrize("product_count", [1, 10, 100])
+    def test_store_menu_query_count_is_constant(self, fake_db, product_count):
+        """Store page costs the same number of queries regardless of menu size"""
+        fake_db.seed("stores", [{"id": "s1", "name": "Store"}])
+        seed_menu(fake_db, "s1", product_count)
+        store = asyncio.run(server.get_store("s1"))
+        assert len(store["products"]) == product_count
+        # snapshot miss, then store, products, variants, sizes and the snapshot write
+        assert fake_db.queries == 6
+        print(f"✓ {product_count} products hydrated in {fake_db.queries} queries")
+
+    def test_hydrated_shape_matches_nested_lookup(self, fake_db):
+        """Every product carries its own variants, each with its own sizes"""
+        seed_menu(fake_db, "s1", 5, variants_per_product=2, sizes_per_variant=4)
+        products = asyncio.run(server.get_products(make_request(), Response(), store_id="s1", fields="name,variants"))
+        assert fake_db.queries == 4  # content versions, products, variants, sizes
+        for p in products:
+            assert [v["id"] for v in p["variants"]] == [f"{p['id']}-v0", f"{p['id']}-v1"]
+            for v in p["variants"]:
+                assert v["product_id"] == p["id"]
+                assert len(v["sizes"]) == 4
+                assert all(s["variant_id"] == v["id"] for s in v["sizes"])
+
+    def test_product_without_variants(self, fake_db):
+        """Products with no variants hydrate to an empty list without querying sizes"""
+        fake_db.seed("products", [{"id": "p1", "store_id": "s1", "name": "Bare"}])
+        product = asyncio.run(server.get_product("p1"))
+        assert product["variants"] == []
+        assert fake_db.queries == 2
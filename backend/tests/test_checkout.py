@@ -0,0 +1,60 @@
+"""Test checkout commits the order, cart clear and store counter together"""
+import asyncio
+import pytest
+from fastapi import BackgroundTasks, HTTPException
+import server
+from conftest import seed_cart
+
+CUSTOMER = {"id": "u1", "name": "Customer", "roles": ["customer"], "active_role": "customer"}
+CHECKOUT = server.CheckoutRequest(delivery_address="Home", lat=12.9716, lng=77.5946)
+
+def checkout(tasks=None):
+    return server.create_order(CHECKOUT, tasks or BackgroundTasks(), user=CUSTOMER)
+
+def count(db, name, query=None):
+    return asyncio.run(db._db[name].count_documents(query or {}))
+
+class TestCheckout:
+    """Test transactional checkout"""
+
+    def test_failed_commit_leaves_nothing_applied(self, fake_db):
+        seed_cart(fake_db, 3)
+        # A non-numeric counter makes the store $inc, the last write, fail
+        asyncio.run(fake_db._db.stores.update_one({"id": "s1"}, {"$set": {"total_orders": "many"}}))
+        with pytest.raises(Exception):
+            asyncio.run(checkout())
+        assert count(fake_db, "orders") == 0
+        assert len(asyncio.run(fake_db._db.carts.find_one({"user_id": "u1"}))["items"]) == 3
+
+    def test_concurrent_checkouts_place_one_order(self, fake_db):
+        seed_cart(fake_db, 3)
+
+        async def race():
+            return await asyncio.gather(checkout(), checkout(), return_exceptions=True)
+
+        results = asyncio.run(race())
+        placed = [r for r in results if isinstance(r, dict)]
+        rejected = [r for r in results if isinstance(r, HTTPException)]
+        assert len(placed) == 1 and len(rejected) == 1
+        assert rejected[0].status_code in (400, 409)
+        assert count(fake_db, "orders") == 1
+        assert asyncio.run(fake_db._db.stores.find_one({"id": "s1"}))["total_orders"] == 1
+
+    def test_menu_snapshot_catches_up_after_response(self, fake_db):
+        seed_cart(fake_db, 2)
+        asyncio.run(fake_db._db.stores.update_one({"id": "s1"}, {"$set": {"total_orders": 0}}))
+        asyncio.run(server.get_store("s1"))  # builds the menu snapshot
+        tasks = BackgroundTasks()
+        asyncio.run(checkout(tasks))
+        assert asyncio.run(fake_db._db.store_menus.find_one({"store_id": "s1"}))["menu"]["total_orders"] == 0
+        asyncio.run(tasks())
+        assert asyncio.run(fake_db._db.store_menus.find_one({"store_id": "s1"}))["menu"]["total_orders"] == 1
+        assert asyncio.run(server.get_store("s1"))["total_orders"] == 1
+
+    def test_standalone_server_still_checks_out(self, fake_db, monkeypatch):
+        monkeypatch.setattr(server, "_transactions_supported", False)
+        seed_cart(fake_db, 2)
+        order = asyncio.run(checkout())
+        assert order["status"] == "placed"
+        assert count(fake_db, "orders") == 1
+        assert asyncio.run(fake_db._db.carts.find_one({"user_id": "u1"}))["items"] == []
@@ -0,0 +1,44 @@
+"""Test ETag / If-None-Match revalidation on public list endpoints"""
+import asyncio
+import server
+from fastapi import Response
+from conftest import make_request
+
+ADMIN = {"id": "a1", "name": "Admin", "roles": ["admin"], "active_role": "admin"}
+
+class TestConditionalGet:
+    """Test content-version ETags"""
+
+    def test_unchanged_banners_return_304_without_queries(self, fake_db):
+        fake_db.seed("banners", [{"id": "b1", "title": "Deal", "is_active": True, "position": 0}])
+        response = Response()
+        banners = asyncio.run(server.get_banners(make_request("/api/banners"), response))
+        assert len(banners) == 1
+        etag = response.headers["etag"]
+        fake_db.queries = 0
+        cached = asyncio.run(server.get_banners(make_request("/api/banners", headers={"If-None-Match": etag}), Response()))
+        assert cached.status_code == 304
+        assert cached.body == b""
+        assert fake_db.queries == 0
+
+    def test_write_changes_etag(self, fake_db):
+        response = Response()
+        asyncio.run(server.get_cms(make_request("/api/cms"), response))
+        etag = response.headers["etag"]
+        asyncio.run(server.update_cms("platform_name", {"name": "QuickDrop"}, user=ADMIN))
+        fresh = Response()
+        result = asyncio.run(server.get_cms(make_request("/api/cms", headers={"If-None-Match": etag}), fresh))
+        assert isinstance(result, dict)
+        assert fresh.headers["etag"] != etag
+
+    def test_query_string_is_part_of_etag(self, fake_db):
+        first, second = Response(), Response()
+        asyncio.run(server.get_stores(make_request("/api/stores"), first))
+        asyncio.run(server.get_stores(make_request("/api/stores", query="search=sushi"), second, search="sushi"))
+        assert first.headers["etag"] != second.headers["etag"]
+
+    def test_if_none_match_parsing(self):
+        assert server.etag_matches('"a", "b"', '"b"')
+        assert server.etag_matches('W/"b"', '"b"')
+        assert server.etag_matches("*", '"b"')
+        assert not server.etag_matches("", '"b"')
@@ -0,0 +1,62 @@
+"""Test server-side delivery distance and its per-(store, geohash cell) cache"""
+import asyncio
+import pytest
+from fastapi import BackgroundTasks
+import server
+
+CUSTOMER = {"id": "u1", "name": "Customer", "roles": ["customer"], "active_role": "customer"}
+
+class TestGeometry:
+    """Test haversine and geohash helpers"""
+
+    def test_haversine_known_distance(self):
+        # MG Road to Koramangala, Bangalore: ~4.9km
+        assert server.haversine_km(12.9756, 77.6066, 12.9352, 77.6245) == pytest.approx(4.9, abs=0.3)
+        assert server.haversine_km(12.97, 77.59, 12.97, 77.59) == 0
+
+    def test_geohash_cell(self):
+        cell, (lat, lng) = server.geohash_cell(57.64911, 10.40744)
+        assert cell == "u4pruyd"
+        assert server.haversine_km(57.64911, 10.40744, lat, lng) < 0.15
+
+class TestDeliveryDistance:
+    """Test distances are computed from the store and cached per cell"""
+
+    def test_nearby_points_share_a_cached_distance(self, fake_db):
+        fake_db.seed("stores", [{"id": "s1", "name": "Store", "lat": 12.9716, "lng": 77.5946}])
+        first = asyncio.run(server.delivery_distance_km("s1", 12.9352, 77.6245))
+        assert first == pytest.approx(5.2, abs=0.3)
+        fake_db.queries = 0
+        again = asyncio.run(server.delivery_distance_km("s1", 12.93521, 77.62451))
+        assert again == first
+        assert fake_db.queries == 0
+
+    def test_unknown_store_falls_back_to_default(self, fake_db):
+        assert asyncio.run(server.delivery_distance_km("missing", 12.9, 77.6)) == server.DEFAULT_DISTANCE_KM
+
+    def test_store_without_coordinates_falls_back_to_default(self, fake_db):
+        merchant = {"id": "m1", "name": "Merchant", "roles": ["merchant"], "active_role": "merchant"}
+        store = asyncio.run(server.create_store(server.StoreCreate(name="No Map Yet"), user=merchant))
+        assert asyncio.run(server.delivery_distance_km(store["id"], 12.9, 77.6)) == server.DEFAULT_DISTANCE_KM
+        assert asyncio.run(server.delivery_distance_km(store["id"], 12.9, 77.6, store)) == server.DEFAULT_DISTANCE_KM
+
+    def test_checkout_ignores_client_distance(self, fake_db):
+        fake_db.seed("stores", [{"id": "s1", "name": "Store", "merchant_id": "m1", "lat": 12.9716, "lng": 77.5946}])
+        fake_db.seed("variants", [{"id": "v1", "product_id": "p1", "name": "Regular", "price": 100}])
+        fake_db.seed("products", [{"id": "p1", "store_id": "s1", "name": "Dosa"}])
+        fake_db.seed("carts", [{"user_id": "u1", "store_id": "s1",
+                                "items": [{"item_id": "i1", "product_id": "p1", "variant_id": "v1", "quantity": 1}]}])
+        data = server.CheckoutRequest(delivery_address="Far away", lat=12.9352, lng=77.6245, distance_km=0.1)
+        order = asyncio.run(server.create_order(data, BackgroundTasks(), user=CUSTOMER))
+        assert order["distance_km"] > 4
+        assert order["delivery_fee"] > server.BASE_DELIVERY_FEE
+
+    def test_checkout_without_location_uses_default_distance(self, fake_db):
+        fake_db.seed("stores", [{"id": "s1", "name": "Store", "merchant_id": "m1", "lat": 12.9716, "lng": 77.5946}])
+        fake_db.seed("variants", [{"id": "v1", "product_id": "p1", "name": "Regular", "price": 100}])
+        fake_db.seed("products", [{"id": "p1", "store_id": "s1", "name": "Dosa"}])
+        fake_db.seed("carts", [{"user_id": "u1", "store_id": "s1",
+                                "items": [{"item_id": "i1", "product_id": "p1", "variant_id": "v1", "quantity": 1}]}])
+        order = asyncio.run(server.create_order(server.CheckoutRequest(delivery_address="x"), BackgroundTasks(),
+                                                user=CUSTOMER))
+        assert order["distance_km"] == server.DEFAULT_DISTANCE_KM
@@ -0,0 +1,187 @@
+"""Test the agent dispatch queue: atomic claims, leases and pushed events"""
+import asyncio
+import time
+from datetime import datetime, timezone, timedelta
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+import server
+from conftest import MERCHANT, agent, seed_orders, drain
+
+OLDEST = server.DispatchClaim(order_by="oldest")
+
+def iso(seconds=0):
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds)).isoformat()
+
+class NearSphereOrders:
+    """Orders collection that answers $nearSphere finds, which mongomock lacks, nearest first"""
+    def __init__(self, orders):
+        self._orders = orders
+        self.near_queries = 0
+
+    def __getattr__(self, name):
+        return getattr(self._orders, name)
+
+    def find(self, query, projection=None):
+        near = query.get("pickup_location", {}).get("$nearSphere")
+        if near is None:
+            return self._orders.find(query, projection)
+        self.near_queries += 1
+        lng, lat = near["$geometry"]["coordinates"]
+        rest = {k: v for k, v in query.items() if k != "pickup_location"}
+        orders = self._orders
+
+        class Cursor:
+            def limit(self, n):
+                self.n = n
+                return self
+
+            async def to_list(self, length):
+                docs = await orders.find({**rest, "pickup_location": {"$exists": True}}).to_list(None)
+                docs.sort(key=lambda d: server.haversine_km(lat, lng, *reversed(d["pickup_location"]["coordinates"])))
+                return [{k: d[k] for k in projection if k != "_id"} for d in docs[:self.n]]
+
+        return Cursor()
+
+def km_north(km):
+    return 12.9 + km / server.KM_PER_DEGREE
+
+class TestClaims:
+    """Test claim_next_order and the lease rules around it"""
+
+    def test_claims_oldest_first_in_one_round_trip(self, fake_db, hub):
+        seed_orders(fake_db, 3)
+        result = asyncio.run(server.claim_next_order(OLDEST, user=agent(1)))
+        assert fake_db.queries == 1
+        assert result["order"]["id"] == "o000"
+        assert result["order"]["claimed_by"] == "a1"
+        stored = asyncio.run(fake_db.orders.find_one({"id": "o000"}))
+        assert (stored["status"], stored["agent_id"]) == ("accepted", "")
+
+    def test_empty_pool_returns_no_order(self, fake_db, hub):
+        seed_orders(fake_db, 1, status="placed")
+        assert asyncio.run(server.claim_next_order(OLDEST, user=agent(1)))["order"] is None
+
+    def test_leased_order_is_hidden_and_blocks_other_agents(self, fake_db, hub):
+        seed_orders(fake_db, 1)
+        asyncio.run(server.claim_next_order(OLDEST, user=agent(1)))
+        assert asyncio.run(server.claim_next_order(OLDEST, user=agent(2)))["order"] is None
+        assert asyncio.run(server.get_available_orders(server.Response(), user=agent(2))) == []
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(server.agent_accept_order("o000", user=agent(2)))
+        assert exc.value.status_code == 400
+        assert asyncio.run(server.agent_accept_order("o000", user=agent(1)))["agent_id"] == "a1"
+
+    def test_expired_lease_returns_to_pool(self, fake_db, hub):
+        seed_orders(fake_db, 1, claimed_by="a1", claim_expires_at=iso(-1))
+        result = asyncio.run(server.claim_next_order(OLDEST, user=agent(2)))
+        assert result["order"]["claimed_by"] == "a2"
+
+    def test_release_hands_order_back(self, fake_db, hub):
+        seed_orders(fake_db, 1, claimed_by="a1", claim_expires_at=iso(30))
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(server.release_order("o000", user=agent(2)))
+        assert exc.value.status_code == 404
+        asyncio.run(server.release_order("o000", user=agent(1)))
+        assert asyncio.run(server.claim_next_order(OLDEST, user=agent(2)))["order"]["id"] == "o000"
+
+    def test_claims_nearest_pickup_first(self, fake_db, hub, monkeypatch):
+        seed_orders(fake_db, 3)
+        for n, km in enumerate((4, 0.5, 2)):
+            asyncio.run(fake_db._db.orders.update_one(
+                {"id": f"o{n:03d}"}, {"$set": {"pickup_location": server.geo_point(km_north(km), 77.6)}}))
+        orders = NearSphereOrders(fake_db.orders)
+        monkeypatch.setattr(fake_db, "orders", orders, raising=False)
+        nearest = server.DispatchClaim(order_by="nearest", lat=12.9, lng=77.6)
+        claimed = [asyncio.run(server.claim_next_order(nearest, user=agent(n)))["order"]["id"] for n in range(3)]
+        assert claimed == ["o001", "o002", "o000"]
+        assert orders.near_queries == 3
+
+    def test_nearest_falls_back_to_oldest(self, fake_db, hub, monkeypatch):
+        seed_orders(fake_db, 2)  # no pickup_location, as for stores without coordinates
+        monkeypatch.setattr(fake_db, "orders", NearSphereOrders(fake_db.orders), raising=False)
+        nearest = server.DispatchClaim(order_by="nearest", lat=12.9, lng=77.6)
+        assert asyncio.run(server.claim_next_order(nearest, user=agent(1)))["order"]["id"] == "o000"
+
+    def test_rejects_unknown_order_by(self, fake_db, hub):
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(server.claim_next_order(server.DispatchClaim(order_by="random"), user=agent(1)))
+        assert exc.value.status_code == 400
+
+class TestDispatchLoad:
+    """200 agents draining the pool concurrently"""
+
+    AGENTS = 200
+    ORDERS = 120
+
+    def test_no_double_assignment_and_bounded_claims(self, fake_db, hub):
+        seed_orders(fake_db, self.ORDERS)
+        latencies = []
+
+        async def work(n):
+            user, taken = agent(n), []
+            while True:
+                started = time.perf_counter()
+                claimed = await server.claim_next_order(OLDEST, user=user)
+                latencies.append(time.perf_counter() - started)
+                if not claimed["order"]:
+                    return taken
+                taken.append((await server.agent_accept_order(claimed["order"]["id"], user=user))["id"])
+
+        async def run():
+            return await asyncio.gather(*[work(n) for n in range(self.AGENTS)])
+
+        taken = [order_id for orders in asyncio.run(run()) for order_id in orders]
+        assert len(taken) == len(set(taken)) == self.ORDERS
+        # However many agents contend, every claim and assign is one conditional update
+        assert len(latencies) == self.ORDERS + self.AGENTS
+        assert fake_db.queries == len(latencies) + self.ORDERS
+        assert max(latencies) < 1.0
+        stored = asyncio.run(fake_db.orders.find({}, {"_id": 0}).to_list(None))
+        assert {o["status"] for o in stored} == {"assigned"}
+        assert all(o["claimed_by"] == o["agent_id"] for o in stored)
+
+class TestDispatchEvents:
+    """Test the pushed events that replace polling"""
+
+    def test_hub_drops_oldest_for_slow_subscribers(self):
+        hub = server.EventHub(queue_size=2)
+        queue = hub.subscribe("dispatch")
+        for n in range(3):
+            assert hub.publish("dispatch", {"n": n}) == 1
+        assert drain(queue) == [{"n": 1}, {"n": 2}]
+        assert hub.stats()["dropped"] == 1
+        hub.unsubscribe("dispatch", queue)
+        assert hub.publish("dispatch", {"n": 3}) == 0
+
+    def test_accept_claim_and_assign_are_announced(self, fake_db, hub):
+        seed_orders(fake_db, 1, status="placed", distance_km=2.4)
+        queue = hub.subscribe("dispatch")
+        asyncio.run(server.merchant_accept_order("o000", user=MERCHANT))
+        asyncio.run(server.claim_next_order(OLDEST, user=agent(1)))
+        asyncio.run(server.agent_accept_order("o000", user=agent(1)))
+        available, claimed, assigned = drain(queue)
+        assert (available["type"], available["order"]["id"]) == ("order_available", "o000")
+        # Pushed rows render like fetched ones, distance included
+        assert available["order"]["distance_km"] == 2.4
+        assert claimed == assigned == {"type": "order_taken", "order_id": "o000"}
+
+    def test_lapsed_leases_are_announced_once(self, fake_db, hub):
+        seed_orders(fake_db, 2, claimed_by="a1", claim_expires_at=iso(-5))
+        queue = hub.subscribe("dispatch")
+        assert asyncio.run(server.announce_expired_leases(iso(-10), iso())) == 2
+        assert asyncio.run(server.announce_expired_leases(iso(), iso(1))) == 0
+        assert [e["order"]["id"] for e in drain(queue)] == ["o000", "o001"]
+
+    def test_socket_requires_an_agent_token(self, fake_db, hub):
+        fake_db.seed("users", [agent(1), {**MERCHANT, "roles": ["customer"]}])
+        client = TestClient(server.app)
+        with pytest.raises(Exception):
+            with client.websocket_connect(f"/api/dispatch/ws?token={server.create_token('m1')}"):
+                pass
+        with client.websocket_connect(f"/api/dispatch/ws?token={server.create_token('a1')}") as ws:
+            # The socket is subscribed once accepted; publish from the server's side
+            while not hub.stats()["subscribers"]:
+                time.sleep(0.01)
+            ws.portal.call(hub.publish, "dispatch", {"type": "order_taken", "order_id": "o1"})
+            assert ws.receive_json() == {"type": "order_taken", "order_id": "o1"}
@@ -0,0 +1,82 @@
+"""Test the index manifest and the COLLSCAN self-check"""
+import asyncio
+import logging
+import os
+import uuid
+import pytest
+from pymongo.errors import OperationFailure, ServerSelectionTimeoutError
+import server
+
+class ExplainCursor:
+    def __init__(self, plan):
+        self._plan = plan
+
+    def sort(self, keys):
+        return self
+
+    async def explain(self):
+        if isinstance(self._plan, Exception):
+            raise self._plan
+        return {"queryPlanner": {"winningPlan": self._plan}}
+
+class ExplainDB:
+    """Answers explain() with a canned winning plan per collection"""
+    def __init__(self, plans):
+        self._plans = plans
+
+    def __getitem__(self, name):
+        return self
+
+    def find(self, query):
+        return ExplainCursor(self._plans)
+
+IXSCAN = {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "id_1"}}
+COLLSCAN = {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}
+
+class TestCheckIndexes:
+    """Test check_indexes and the startup warning"""
+
+    def test_every_probe_has_manifest_indexes(self):
+        assert {collection for collection, _, _ in server.INDEX_PROBES} <= set(server.INDEX_MANIFEST)
+
+    def test_indexed_plans_pass(self, monkeypatch):
+        monkeypatch.setattr(server, "db", ExplainDB(IXSCAN))
+        assert asyncio.run(server.check_indexes()) == []
+
+    def test_nested_collscan_is_reported(self, monkeypatch):
+        monkeypatch.setattr(server, "db", ExplainDB(COLLSCAN))
+        assert len(asyncio.run(server.check_indexes())) == len(server.INDEX_PROBES)
+
+    def test_startup_warns_and_carries_on(self, monkeypatch, caplog):
+        monkeypatch.setattr(server, "db", ExplainDB(COLLSCAN))
+        with caplog.at_level(logging.WARNING, logger=server.logger.name):
+            asyncio.run(server.warn_on_collscans())
+        assert sum("COLLSCAN" in r.message for r in caplog.records) == len(server.INDEX_PROBES)
+        monkeypatch.setattr(server, "db", ExplainDB(OperationFailure("not authorized")))
+        asyncio.run(server.warn_on_collscans())
+
+class TestLiveIndexes:
+    """Run the manifest against the MongoDB at MONGO_URL; skipped when none is reachable"""
+
+    def test_ensured_indexes_cover_every_probe(self, monkeypatch):
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        async def run():
+            client = AsyncIOMotorClient(os.environ["MONGO_URL"], serverSelectionTimeoutMS=1000)
+            try:
+                await client.admin.command("ping")
+            except ServerSelectionTimeoutError:
+                return None
+            name = f"test_indexes_{uuid.uuid4().hex[:8]}"
+            monkeypatch.setattr(server, "db", client[name])
+            try:
+                await server.ensure_indexes()
+                return await server.check_indexes()
+            finally:
+                await client.drop_database(name)
+                client.close()
+
+        failures = asyncio.run(run())
+        if failures is None:
+            pytest.skip(f"no MongoDB at {os.environ['MONGO_URL']}")
+        assert failures == []
@@ -0,0 +1,74 @@
+"""Test /stores/nearby: the $geoNear pipeline and its post-processing"""
+import asyncio
+import pytest
+from fastapi import HTTPException
+import server
+
+CENTRE = (12.9716, 77.5946)
+
+class GeoNearStores:
+    """Stores collection whose aggregate evaluates $geoNear, $limit and $project like Mongo would"""
+    def __init__(self, db):
+        self._db = db
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        return self
+
+    async def to_list(self, length):
+        geo_near, limit, project = (stage for stage in self.pipelines[-1])
+        spec = geo_near["$geoNear"]
+        lng, lat = spec["near"]["coordinates"]
+        docs = []
+        for doc in await self._db.stores.find({}).to_list(None):
+            doc_lng, doc_lat = doc[spec["key"]]["coordinates"]
+            metres = server.haversine_km(lat, lng, doc_lat, doc_lng) * 1000
+            if metres <= spec["maxDistance"]:
+                docs.append({**doc, spec["distanceField"]: metres * spec["distanceMultiplier"]})
+        docs.sort(key=lambda d: d[spec["distanceField"]])
+        hidden = [k for k, v in project["$project"].items() if v == 0]
+        return [{k: v for k, v in d.items() if k not in hidden} for d in docs[:limit["$limit"]]][:length]
+
+def store_km_north(n, km):
+    lat = CENTRE[0] + km / server.KM_PER_DEGREE
+    return {"id": f"s{n}", "name": f"Store {n}", "location": server.geo_point(lat, CENTRE[1])}
+
+@pytest.fixture
+def stores(fake_db, monkeypatch):
+    stores = GeoNearStores(fake_db._db)
+    monkeypatch.setattr(fake_db, "stores", stores, raising=False)
+    return stores
+
+class TestNearbyStores:
+    """Test get_nearby_stores"""
+
+    def test_pipeline(self, stores):
+        asyncio.run(server.get_nearby_stores(*CENTRE, radius_km=3, limit=10))
+        geo_near = stores.pipelines[0][0]["$geoNear"]
+        assert geo_near["near"] == {"type": "Point", "coordinates": [CENTRE[1], CENTRE[0]]}
+        assert (geo_near["key"], geo_near["spherical"]) == ("location", True)
+        assert geo_near["maxDistance"] == 3000
+        assert stores.pipelines[0][1:] == [{"$limit": 10}, {"$project": {"_id": 0, "location": 0}}]
+
+    def test_nearest_first_within_radius_in_km(self, fake_db, stores):
+        fake_db.seed("stores", [store_km_north(1, 2.5), store_km_north(2, 0.4), store_km_north(3, 6)])
+        nearby = asyncio.run(server.get_nearby_stores(*CENTRE, radius_km=5))
+        assert [s["id"] for s in nearby] == ["s2", "s1"]
+        assert [s["distance_km"] for s in nearby] == [pytest.approx(0.4, abs=0.01), pytest.approx(2.5, abs=0.01)]
+        assert all(s["distance_km"] == round(s["distance_km"], 2) and "location" not in s for s in nearby)
+
+    def test_radius_and_limit_are_capped(self, stores):
+        asyncio.run(server.get_nearby_stores(*CENTRE, radius_km=10_000, limit=10_000))
+        asyncio.run(server.get_nearby_stores(*CENTRE, radius_km=-1, limit=0))
+        (wide, wide_limit, _), (empty, one, _) = stores.pipelines
+        assert wide["$geoNear"]["maxDistance"] == server.MAX_NEARBY_RADIUS_KM * 1000
+        assert wide_limit == {"$limit": server.MAX_PAGE_SIZE}
+        assert (empty["$geoNear"]["maxDistance"], one) == (0, {"$limit": 1})
+
+    @pytest.mark.parametrize("lat,lng", [(91, 0), (-90.5, 0), (0, 180.1), (0, -181)])
+    def test_rejects_invalid_coordinates(self, stores, lat, lng):
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(server.get_nearby_stores(lat, lng))
+        assert exc.value.status_code == 400
+        assert stores.pipelines == []
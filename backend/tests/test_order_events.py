@@ -0,0 +1,119 @@
+"""Test order status events pushed to open screens instead of polling"""
+import asyncio
+import time
+from functools import partial
+import pytest
+from fastapi import BackgroundTasks
+from fastapi.testclient import TestClient
+import server
+from conftest import MERCHANT, agent, seed_cart, seed_orders, drain
+
+CUSTOMER = {"id": "u1", "name": "Customer", "roles": ["customer"], "active_role": "customer"}
+
+def follow(hub, *channels):
+    queue = asyncio.Queue()
+    for channel in channels:
+        hub.subscribe(channel, queue)
+    return queue
+
+class FakeChangeStream:
+    """Async context manager yielding canned change events, then stopping the loop"""
+    def __init__(self, changes):
+        self.changes = changes
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.changes:
+            raise asyncio.CancelledError
+        return self.changes.pop(0)
+
+class TestOrderEvents:
+    """Test every transition publishes its changes to the order's watchers"""
+
+    def test_transitions_reach_each_party(self, fake_db, hub):
+        seed_orders(fake_db, 1, status="placed", user_id="u1", merchant_id="m1")
+        customer, merchant, agent1 = follow(hub, "user:u1"), follow(hub, "merchant:m1"), follow(hub, "agent:a1")
+        order = follow(hub, "order:o000")
+        asyncio.run(server.merchant_accept_order("o000", user=MERCHANT))
+        asyncio.run(server.agent_accept_order("o000", user=agent(1)))
+        statuses = [e["order"]["status"] for e in drain(order)]
+        assert statuses == ["accepted", "assigned"]
+        assert [e["order"]["status"] for e in drain(customer)] == statuses
+        assert [e["order"]["status"] for e in drain(merchant)] == statuses
+        # The agent channel only follows orders once they are the agent's
+        assigned, = drain(agent1)
+        assert assigned["order"]["agent_id"] == "a1"
+        assert set(assigned["order"]) == {"id", "status", "updated_at", "agent_id", "agent_name"}
+
+    def test_watchers_cost_no_reads(self, fake_db, hub):
+        seed_orders(fake_db, 1, status="placed", user_id="u1", merchant_id="m1")
+        watcher = follow(hub, "order:o000")
+        asyncio.run(server.merchant_accept_order("o000", user=MERCHANT))
+        assert fake_db.queries == 1
+        assert len(drain(watcher)) == 1
+
+    def test_lease_claims_stay_off_order_channels(self, fake_db, hub):
+        seed_orders(fake_db, 1, user_id="u1", merchant_id="m1")
+        watcher = follow(hub, "order:o000")
+        asyncio.run(server.claim_next_order(server.DispatchClaim(order_by="oldest"), user=agent(1)))
+        assert drain(watcher) == []
+
+    def test_checkout_publishes_the_new_order(self, fake_db, hub):
+        seed_cart(fake_db, 2)
+        merchant = follow(hub, "merchant:m1")
+        placed = asyncio.run(server.create_order(
+            server.CheckoutRequest(delivery_address="Home", lat=12.9716, lng=77.5946), BackgroundTasks(), user=CUSTOMER))
+        event, = drain(merchant)
+        assert placed["otp"] and "otp" not in event["order"]
+        assert event["order"] == {k: v for k, v in placed.items() if k != "otp"}
+
+    def test_changestream_mode_leaves_publishing_to_mongo(self, fake_db, hub, monkeypatch):
+        monkeypatch.setattr(server, "ORDER_EVENTS", "changestream")
+        seed_orders(fake_db, 1, status="placed", user_id="u1", merchant_id="m1")
+        watcher, pool = follow(hub, "order:o000"), follow(hub, "dispatch")
+        asyncio.run(server.merchant_accept_order("o000", user=MERCHANT))
+        assert drain(watcher) == []
+        after = asyncio.run(fake_db._db.orders.find_one({"id": "o000"}))
+        changes = {"status": "accepted", "updated_at": after["updated_at"]}
+        stream = FakeChangeStream([{"_id": "t1", "operationType": "update", "fullDocument": after,
+                                    "updateDescription": {"updatedFields": changes}}])
+        monkeypatch.setattr(fake_db, "orders", type("Orders", (), {"watch": lambda self, *a, **k: stream})(),
+                            raising=False)
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(server.order_change_stream())
+        assert drain(watcher) == [{"type": "order", "order": {"id": "o000", **changes}}]
+        assert drain(pool)[0]["type"] == "order_available"
+
+class TestOrderSockets:
+    """Test who may follow which orders"""
+
+    @pytest.mark.parametrize("user,order_id,channels", [
+        (CUSTOMER, "", ["user:u1"]),
+        (MERCHANT, "", ["merchant:m1"]),
+        (agent(1), "", ["agent:a1"]),
+        (CUSTOMER, "o000", ["order:o000"]),
+        (agent(1), "o000", None),
+        ({**agent(2), "active_role": "admin"}, "o000", ["order:o000"]),
+    ])
+    def test_subscription_rules(self, fake_db, user, order_id, channels):
+        seed_orders(fake_db, 1, user_id="u1", merchant_id="m1")
+        assert asyncio.run(server.order_subscription(user, order_id)) == channels
+
+    def test_socket_pushes_transitions(self, fake_db, hub):
+        seed_orders(fake_db, 1, status="placed", user_id="u1", merchant_id="m1")
+        fake_db.seed("users", [CUSTOMER])
+        client = TestClient(server.app)
+        with client.websocket_connect(f"/api/orders/ws?order_id=o000&token={server.create_token('u1')}") as ws:
+            while not hub.stats()["subscribers"]:
+                time.sleep(0.01)
+            ws.portal.call(partial(server.merchant_accept_order, "o000", user=MERCHANT))
+            event = ws.receive_json()
+            assert (event["order"]["id"], event["order"]["status"]) == ("o000", "accepted")
@@ -31,7 +31,7 @@ class TestOrderFlow:
     def test_place_order(self, api_client, customer_token):
         """Test placing an order (checkout)"""
         # Add items to cart
-        products = api_client.get(f"{BASE_URL}/api/products").json()
+        products = api_client.get(f"{BASE_URL}/api/products?fields=name,store_id,variants").json()
         product = products[0]
         variant = product["variants"][0]
         
@@ -76,7 +76,7 @@ class TestOrderFlow:
     def test_merchant_accept_order(self, api_client, customer_token, merchant_token):
         """Test merchant accepting order"""
         # Place order first
-        products = api_client.get(f"{BASE_URL}/api/products").json()
+        products = api_client.get(f"{BASE_URL}/api/products?fields=name,store_id,variants").json()
         product = products[0]
         variant = product["variants"][0]
         
@@ -106,7 +106,7 @@ class TestOrderFlow:
     def test_get_available_orders_for_agent(self, api_client, customer_token, merchant_token, agent_token):
         """Test agent viewing available orders"""
         # Place and accept order
-        products = api_client.get(f"{BASE_URL}/api/products").json()
+        products = api_client.get(f"{BASE_URL}/api/products?fields=name,store_id,variants").json()
         product = products[0]
         variant = product["variants"][0]
         
@@ -137,7 +137,7 @@ class TestOrderFlow:
     def test_agent_assign_order(self, api_client, customer_token, merchant_token, agent_token):
         """Test agent assigning order to themselves"""
         # Place and accept order
-        products = api_client.get(f"{BASE_URL}/api/products").json()
+        products = api_client.get(f"{BASE_URL}/api/products?fields=name,store_id,variants").json()
         product = products[0]
         variant = product["variants"][0]
         
@@ -169,7 +169,7 @@ class TestOrderFlow:
     def test_order_status_transitions(self, api_client, customer_token, merchant_token, agent_token):
         """Test order status transitions: placed → accepted → preparing → ready_for_pickup"""
         # Place order
-        products = api_client.get(f"{BASE_URL}/api/products").json()
+        products = api_client.get(f"{BASE_URL}/api/products?fields=name,store_id,variants").json()
         product = products[0]
         variant = product["variants"][0]
         
@@ -211,7 +211,7 @@ class TestOrderFlow:
     def test_otp_verification(self, api_client, customer_token, merchant_token, agent_token):
         """Test OTP verification for delivery completion"""
         # Complete flow up to pickup
-        products = api_client.get(f"{BASE_URL}/api/products").json()
+        products = api_client.get(f"{BASE_URL}/api/products?fields=name,store_id,variants").json()
         product = products[0]
         variant = product["variants"][0]
         
@@ -0,0 +1,74 @@
+"""Test order numbers come from block-leased counters"""
+import asyncio
+import pytest
+from fastapi import BackgroundTasks, HTTPException
+import server
+from conftest import seed_cart
+
+def allocate(allocator, count):
+    async def run():
+        return [await allocator.next() for _ in range(count)]
+    return asyncio.run(run())
+
+class TestSequenceAllocator:
+    """Test SequenceAllocator"""
+
+    def test_one_round_trip_per_block(self, fake_db):
+        allocator = server.SequenceAllocator("seq", 10)
+        assert allocate(allocator, 25) == list(range(1, 26))
+        assert fake_db.queries == 3
+        assert asyncio.run(fake_db._db.counters.find_one({"name": "seq"}))["value"] == 30
+
+    def test_workers_get_disjoint_blocks(self, fake_db):
+        workers = [server.SequenceAllocator("seq", 5) for _ in range(3)]
+
+        async def run():
+            return await asyncio.gather(*[w.next() for w in workers for _ in range(12)])
+
+        numbers = asyncio.run(run())
+        assert len(set(numbers)) == len(numbers) == 36
+        for n, worker in enumerate(workers):
+            own = numbers[n * 12:(n + 1) * 12]
+            assert own == sorted(own)
+
+    def test_restart_continues_past_leased_blocks(self, fake_db):
+        assert allocate(server.SequenceAllocator("seq", 10), 3) == [1, 2, 3]
+        # The rest of the first block died with the worker and is skipped
+        assert allocate(server.SequenceAllocator("seq", 10), 2) == [11, 12]
+
+    def test_concurrent_callers_share_one_lease(self, fake_db):
+        allocator = server.SequenceAllocator("seq", 100)
+
+        async def run():
+            return await asyncio.gather(*[allocator.next() for _ in range(50)])
+
+        assert sorted(asyncio.run(run())) == list(range(1, 51))
+        assert allocator.leases == 1
+
+class TestCheckoutOrderNumbers:
+    """Test checkout numbers orders from the allocator"""
+
+    def test_concurrent_checkouts_get_unique_numbers(self, fake_db, monkeypatch):
+        monkeypatch.setattr(server, "order_numbers", server.SequenceAllocator("order_number", 4))
+        seed_cart(fake_db, 2)
+        cart = asyncio.run(fake_db._db.carts.find_one({"user_id": "u1"}, {"_id": 0}))
+        fake_db.seed("carts", [{**cart, "user_id": f"u{n}"} for n in range(2, 31)])
+
+        async def run():
+            return await asyncio.gather(*[
+                server.create_order(server.CheckoutRequest(delivery_address="Home", lat=12.9716, lng=77.5946),
+                                    BackgroundTasks(), user={"id": f"u{n}", "name": f"Customer {n}"})
+                for n in range(1, 31)])
+
+        orders = asyncio.run(run())
+        numbers = sorted(o["order_number"] for o in orders)
+        assert numbers == [f"ORD-{n:06d}" for n in range(1, 31)]
+
+    def test_rejected_empty_cart_takes_no_number(self, fake_db):
+        with pytest.raises(HTTPException):
+            asyncio.run(server.create_order(server.CheckoutRequest(delivery_address="Home", lat=1, lng=1),
+                                            BackgroundTasks(), user={"id": "nobody", "name": ""}))
+        seed_cart(fake_db, 1)
+        order = asyncio.run(server.create_order(server.CheckoutRequest(delivery_address="Home", lat=1, lng=1),
+                                                BackgroundTasks(), user={"id": "u1", "name": ""}))
+        assert order["order_number"] == "ORD-000001"
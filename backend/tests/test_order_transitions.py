@@ -0,0 +1,58 @@
+"""Test order state transitions are single conditional updates"""
+import asyncio
+import pytest
+from fastapi import HTTPException
+import server
+from conftest import MERCHANT, agent
+
+def seed_order(db, status="placed"):
+    db.seed("orders", [{"id": "o1", "status": status, "otp": "1234", "agent_id": "", "agent_name": ""}])
+
+class TestOrderTransitions:
+    """Test transition_order and the routes built on it"""
+
+    def test_transition_is_one_round_trip(self, fake_db):
+        seed_order(fake_db)
+        order = asyncio.run(server.merchant_accept_order("o1", user=MERCHANT))
+        assert fake_db.queries == 1
+        assert order["status"] == "accepted"
+        assert asyncio.run(fake_db.orders.find_one({"id": "o1"}))["status"] == "accepted"
+
+    def test_exactly_one_concurrent_agent_wins(self, fake_db):
+        seed_order(fake_db, "accepted")
+
+        async def race():
+            return await asyncio.gather(*[server.agent_accept_order("o1", user=agent(n)) for n in range(50)],
+                                        return_exceptions=True)
+
+        results = asyncio.run(race())
+        winners = [r for r in results if isinstance(r, dict)]
+        assert len(winners) == 1
+        assert all(isinstance(r, HTTPException) and r.status_code == 400 for r in results if r not in winners)
+        stored = asyncio.run(fake_db.orders.find_one({"id": "o1"}))
+        assert (stored["status"], stored["agent_id"]) == ("assigned", winners[0]["agent_id"])
+
+    @pytest.mark.parametrize("current,target,allowed", [
+        ("placed", "accepted", True), ("placed", "preparing", False), ("assigned", "preparing", True),
+        ("picked_up", "delivered", True), ("delivered", "cancelled", False),
+    ])
+    def test_transition_table(self, fake_db, current, target, allowed):
+        seed_order(fake_db, current)
+        update = server.update_order_status("o1", server.OrderStatusUpdate(status=target), user=MERCHANT)
+        if allowed:
+            assert asyncio.run(update)["status"] == target
+        else:
+            with pytest.raises(HTTPException) as exc:
+                asyncio.run(update)
+            assert exc.value.detail == f"Cannot transition from {current} to {target}"
+
+    def test_missing_order_and_wrong_otp(self, fake_db):
+        seed_order(fake_db, "picked_up")
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(server.merchant_accept_order("nope", user=MERCHANT))
+        assert exc.value.status_code == 404
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(server.verify_delivery_otp("o1", server.OTPVerify(otp="0000"), user=MERCHANT))
+        assert exc.value.detail == "Invalid OTP"
+        asyncio.run(server.verify_delivery_otp("o1", server.OTPVerify(otp="1234"), user=MERCHANT))
+        assert asyncio.run(fake_db.orders.find_one({"id": "o1"}))["status"] == "delivered"
@@ -0,0 +1,52 @@
+"""Test keyset pagination on list endpoints"""
+import asyncio
+import pytest
+import server
+from fastapi import HTTPException, Response
+from conftest import make_request
+
+ADMIN = {"id": "a1", "name": "Admin", "roles": ["admin"], "active_role": "admin"}
+
+class TestPagination:
+    """Test (created_at, id) cursors"""
+
+    def test_walk_settlements_newest_first(self, fake_db):
+        # Duplicate timestamps force the id tiebreaker
+        fake_db.seed("settlements", [
+            {"id": f"st{i:02d}", "user_id": "u1", "created_at": f"2024-01-01T00:00:{i // 3:02d}"}
+            for i in range(25)
+        ])
+        seen, cursor = [], ""
+        while True:
+            response = Response()
+            page = asyncio.run(server.get_settlements(response, limit=10, cursor=cursor, user=ADMIN))
+            seen += [s["id"] for s in page]
+            cursor = response.headers.get("x-next-cursor", "")
+            if not cursor:
+                break
+        expected = sorted((f"2024-01-01T00:00:{i // 3:02d}", f"st{i:02d}") for i in range(25))
+        assert seen == [doc_id for _, doc_id in reversed(expected)]
+
+    def test_products_oldest_first_with_limit(self, fake_db):
+        fake_db.seed("products", [
+            {"id": f"p{i}", "store_id": "s1", "name": f"P{i}", "created_at": f"2024-01-0{i + 1}"}
+            for i in range(5)
+        ])
+        response = Response()
+        page = asyncio.run(server.get_products(make_request(), response, store_id="s1", limit=2))
+        assert [p["id"] for p in page] == ["p0", "p1"]
+        cursor = response.headers["x-next-cursor"]
+        page = asyncio.run(server.get_products(make_request(), Response(), store_id="s1", limit=2, cursor=cursor))
+        assert [p["id"] for p in page] == ["p2", "p3"]
+
+    def test_last_page_has_no_cursor(self, fake_db):
+        fake_db.seed("stores", [{"id": "s1", "name": "Only", "created_at": "2024-01-01"}])
+        response = Response()
+        stores = asyncio.run(server.get_stores(make_request(), response))
+        assert len(stores) == 1
+        assert "x-next-cursor" not in response.headers
+
+    def test_invalid_cursor(self, fake_db):
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(server.get_settlements(Response(), cursor="not-a-cursor", user=ADMIN))
+        assert exc.value.status_code == 400
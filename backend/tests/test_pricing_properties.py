@@ -0,0 +1,75 @@
+"""Property tests pinning fee, gift and pricing invariants across the quote grid"""
+import asyncio
+import random
+import numpy as np
+import server
+
+# Every ₹0.50 up to ₹2500 x every 50m up to 12km, plus the exact thresholds
+SUBTOTALS = np.unique(np.concatenate((np.arange(0, 2500.5, 0.5), [498.99, 499.01, 998.99, 999.01, 999.99, 1000.01])))
+DISTANCES = np.unique(np.concatenate((np.arange(0, 12.05, 0.05).round(2), [2.999, 3.001, 4.999, 5.001])))
+
+def grid():
+    subtotals, distances = np.meshgrid(SUBTOTALS, DISTANCES, indexing="ij")
+    return subtotals, distances, server.calculate_promotions_bulk(subtotals.ravel(), distances.ravel())
+
+class TestPromotionProperties:
+    """Test the seeded promotion rules over the whole subtotal x distance grid"""
+
+    def test_free_delivery_rule(self):
+        subtotals, distances, quotes = grid()
+        expected = ((subtotals > 499) & (distances < 3)) | ((subtotals > 999) & (distances < 5))
+        assert np.array_equal(quotes["free_delivery_applied"].reshape(subtotals.shape), expected)
+
+    def test_fee_is_zero_exactly_when_free(self):
+        _, distances, quotes = grid()
+        fees, applied = quotes["delivery_fee"], quotes["free_delivery_applied"]
+        assert np.all(fees[applied] == 0)
+        charged = server.BASE_DELIVERY_FEE + np.maximum(0, (distances.ravel()[~applied] - 2) * 10)
+        assert np.array_equal(fees[~applied], charged)
+        assert np.all(fees[~applied] >= server.BASE_DELIVERY_FEE)
+
+    def test_fee_never_rises_with_subtotal_nor_falls_with_distance(self):
+        subtotals, _, quotes = grid()
+        fees = quotes["delivery_fee"].reshape(subtotals.shape)
+        assert np.all(np.diff(fees, axis=0) <= 0)
+        assert np.all(np.diff(fees, axis=1) >= 0)
+
+    def test_gift_and_upsell_are_exclusive(self):
+        subtotals, _, quotes = grid()
+        assert np.array_equal(quotes["gift_eligible"].reshape(subtotals.shape), subtotals > 1000)
+        for subtotal in SUBTOTALS[::37]:
+            quote = server.calculate_promotions(float(subtotal), 4.0)
+            assert quote["gift_eligible"] == bool(quote["gift_message"])
+            assert bool(quote["upsell_message"]) == (0 < subtotal <= 1000)
+
+    def test_scalar_and_vectorized_agree(self):
+        subtotals, distances, quotes = grid()
+        for n in range(0, subtotals.size, 97):
+            scalar = server.calculate_promotions(float(subtotals.flat[n]), float(distances.flat[n]))
+            assert scalar["delivery_fee"] == quotes["delivery_fee"][n]
+            assert scalar["free_delivery_applied"] == quotes["free_delivery_applied"][n]
+
+class TestCartPricingProperties:
+    """Test price_cart over random carts served from the product cache"""
+
+    def test_random_carts(self, fake_db):
+        rng = random.Random(17)
+        for p in range(200):
+            sizes = [{"id": f"p{p}-s{n}", "variant_id": f"p{p}-v0", "name": f"S{n}", "price_modifier": rng.randint(0, 60)}
+                     for n in range(3)]
+            server.product_cache.set(f"p{p}", {"id": f"p{p}", "name": f"P{p}", "variants": [
+                {"id": f"p{p}-v0", "product_id": f"p{p}", "name": "V", "price": rng.randint(10, 900), "sizes": sizes}]})
+        for _ in range(50):
+            items = [{"item_id": str(n), "product_id": f"p{p}", "variant_id": f"p{p}-v0",
+                      "size_id": rng.choice(["", f"p{p}-s{rng.randint(0, 2)}"]), "quantity": rng.randint(1, 9)}
+                     for n, p in enumerate(rng.sample(range(200), rng.randint(1, 200)))]
+            lines, subtotal = asyncio.run(server.price_cart(items))
+            assert [l["item_id"] for l in lines] == [i["item_id"] for i in items]
+            for line in lines:
+                product = server.product_cache.get(line["product_id"])
+                variant = product["variants"][0]
+                modifier = next((s["price_modifier"] for s in variant["sizes"] if s["id"] == line["size_id"]), 0)
+                assert line["price"] == variant["price"] + modifier
+                assert line["item_total"] == line["price"] * line["quantity"]
+            assert subtotal == sum(l["item_total"] for l in lines)
+        assert fake_db.queries == 0
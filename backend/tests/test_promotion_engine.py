@@ -0,0 +1,135 @@
+"""Test the compiled promotion rule engine against the original hardcoded rules"""
+import asyncio
+import pytest
+from fastapi import HTTPException
+import server
+
+ADMIN = {"id": "a1", "name": "Admin", "roles": ["admin"], "active_role": "admin"}
+
+def legacy_calculate_promotions(subtotal: float, distance_km: float):
+    """calculate_promotions as it was before rules were loaded from db.promotions"""
+    promotions = {
+        "gift_eligible": False,
+        "gift_message": "",
+        "upsell_message": "",
+        "free_delivery_applied": False,
+        "free_delivery_message": "",
+        "delivery_fee": server.BASE_DELIVERY_FEE
+    }
+    # Gift with Purchase: IF Cart_Value > 1000 THEN auto add gift
+    if subtotal > 1000:
+        promotions["gift_eligible"] = True
+        promotions["gift_message"] = "You've earned a FREE gift with your purchase!"
+    # Upsell Nudge: IF Cart_Value < 1000 THEN show message
+    elif subtotal > 0:
+        remaining = 1000 - subtotal
+        promotions["upsell_message"] = f"Add ₹{remaining:.0f} more to get a FREE gift!"
+    # Dynamic Free Delivery Logic
+    # Logic A: IF Cart > 499 AND Distance < 3km THEN Delivery_Fee = 0
+    if subtotal > 499 and distance_km < 3:
+        promotions["free_delivery_applied"] = True
+        promotions["delivery_fee"] = 0
+        promotions["free_delivery_message"] = "Free Delivery Applied!"
+    # Logic B: IF Cart > 999 AND Distance < 5km THEN Delivery_Fee = 0
+    elif subtotal > 999 and distance_km < 5:
+        promotions["free_delivery_applied"] = True
+        promotions["delivery_fee"] = 0
+        promotions["free_delivery_message"] = "Free Delivery Applied!"
+    else:
+        # Calculate delivery fee based on distance
+        promotions["delivery_fee"] = server.BASE_DELIVERY_FEE + max(0, (distance_km - 2) * 10)
+        if subtotal > 499:
+            remaining = 0
+            if distance_km < 3:
+                promotions["free_delivery_message"] = "Free Delivery Applied!"
+                promotions["free_delivery_applied"] = True
+                promotions["delivery_fee"] = 0
+            else:
+                needed = 1000 - subtotal if subtotal < 1000 else 0
+                if needed > 0:
+                    promotions["free_delivery_message"] = f"Add ₹{needed:.0f} for free delivery (within 5km)"
+                elif distance_km >= 5:
+                    promotions["free_delivery_message"] = "Free delivery not available for this distance"
+        elif subtotal > 0:
+            needed_499 = 499 - subtotal + 1
+            promotions["free_delivery_message"] = f"Add ₹{needed_499:.0f} to get free delivery!"
+
+    return promotions
+
+SUBTOTALS = [0, 1, 250, 498, 499, 499.5, 500, 750, 998, 999, 999.5, 1000, 1000.5, 1500, 5000]
+DISTANCES = [0, 0.5, 2, 2.99, 3, 3.5, 4.99, 5, 7.25, 20]
+
+class TestPromotionEngine:
+    """Test the seeded rules reproduce calculate_promotions exactly"""
+
+    def test_matches_legacy_engine_on_grid(self):
+        engine = server.PromotionEngine(server.DEFAULT_PROMOTIONS)
+        for subtotal in SUBTOTALS:
+            for distance in DISTANCES:
+                assert engine.quote(subtotal, distance) == legacy_calculate_promotions(subtotal, distance), \
+                    (subtotal, distance)
+
+    def test_rule_order_does_not_matter(self):
+        engine = server.PromotionEngine(list(reversed(server.DEFAULT_PROMOTIONS)))
+        for subtotal in SUBTOTALS:
+            for distance in DISTANCES:
+                assert engine.quote(subtotal, distance) == legacy_calculate_promotions(subtotal, distance)
+
+    def test_no_rules_charges_distance_fee(self):
+        quote = server.PromotionEngine([]).quote(2000, 1)
+        assert not quote["free_delivery_applied"] and not quote["gift_eligible"]
+        assert quote["delivery_fee"] == server.BASE_DELIVERY_FEE
+
+    def test_new_promotion_is_hot_reloaded(self, fake_db):
+        fake_db.seed("promotions", [{"id": str(i), **p, "is_active": True}
+                                    for i, p in enumerate(server.DEFAULT_PROMOTIONS)])
+        asyncio.run(server.refresh_promotion_engine())
+        assert server.calculate_promotions(300, 1)["delivery_fee"] == server.BASE_DELIVERY_FEE
+        data = server.PromotionCreate(name="Free Delivery - Small", promo_type="free_delivery",
+                                      config={"min_cart_value": 199, "max_distance_km": 1.5})
+        asyncio.run(server.create_promotion(data, user=ADMIN))
+        fake_db.queries = 0
+        asyncio.run(server.refresh_promotion_engine())
+        assert fake_db.queries == 1
+        assert server.calculate_promotions(300, 1)["free_delivery_applied"]
+        assert server.calculate_promotions(300, 2)["free_delivery_message"] == "Add ₹700 for free delivery (within 5km)"
+        fake_db.queries = 0
+        asyncio.run(server.refresh_promotion_engine())
+        assert fake_db.queries == 0
+
+    @pytest.mark.parametrize("promo_type,config", [
+        ("free_delivery", {}),
+        ("free_delivery", {"min_cart_value": "499"}),
+        ("free_delivery", {"min_cart_value": 499, "max_distance_km": -1}),
+        ("gift", {"min_cart_value": True}),
+        ("cashback", {"min_cart_value": 499}),
+    ])
+    def test_malformed_promotion_is_rejected(self, fake_db, promo_type, config):
+        data = server.PromotionCreate(name="Broken", promo_type=promo_type, config=config)
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(server.create_promotion(data, user=ADMIN))
+        assert exc.value.status_code == 400
+        assert asyncio.run(fake_db._db.promotions.count_documents({})) == 0
+
+    def test_malformed_rule_in_db_is_skipped(self, fake_db):
+        fake_db.seed("promotions", [{"id": str(i), **p, "is_active": True}
+                                    for i, p in enumerate(server.DEFAULT_PROMOTIONS)])
+        fake_db.seed("promotions", [{"id": "bad", "promo_type": "free_delivery", "config": {}, "is_active": True}])
+        asyncio.run(server.content_versions.bump("promotions"))
+        asyncio.run(server.refresh_promotion_engine())
+        assert server.calculate_promotions(600, 1) == legacy_calculate_promotions(600, 1)
+
+    def test_failed_compile_keeps_last_good_rules(self, fake_db, monkeypatch):
+        good = server.promotion_engine
+        asyncio.run(server.content_versions.bump("promotions"))
+
+        def broken(*args):
+            raise ValueError("bad rules")
+
+        monkeypatch.setattr(server, "PromotionEngine", broken)
+        asyncio.run(server.refresh_promotion_engine())
+        assert server.promotion_engine is good
+        fake_db.queries = 0
+        asyncio.run(server.refresh_promotion_engine())
+        assert fake_db.queries == 0
+        assert server.calculate_promotions(600, 1)["free_delivery_applied"]
@@ -0,0 +1,129 @@
+"""Test the in-memory ranked search engine"""
+import asyncio
+import pytest
+import server
+
+WORKER_STATE = ("store_search", "product_search", "suggest_index", "content_versions")
+
+def new_worker():
+    """Search state of a freshly started worker"""
+    return {"store_search": server.SearchIndex(server.store_search.fields),
+            "product_search": server.SearchIndex(server.product_search.fields),
+            "suggest_index": server.SuggestIndex(),
+            "content_versions": server.ContentVersions(server.CONTENT_VERSION_TTL_SECONDS)}
+
+def switch_to(monkeypatch, worker):
+    """Make `worker`'s search state the one server calls see"""
+    for name in WORKER_STATE:
+        monkeypatch.setattr(server, name, worker[name])
+
+def current_worker():
+    return {name: getattr(server, name) for name in WORKER_STATE}
+
+class TestSearchIndex:
+    """Test tokenizing, ranking and incremental updates"""
+
+    def build(self):
+        index = server.SearchIndex({"name": 3, "description": 1})
+        index.add({"id": "burger", "name": "Classic Burger", "description": "Juicy beef patty with cheese"})
+        index.add({"id": "pizza", "name": "Margherita Pizza", "description": "Mozzarella, basil & cheese"})
+        index.add({"id": "salad", "name": "Caesar Salad", "description": "Romaine with parmesan cheese"})
+        return index
+
+    def test_name_match_outranks_description_match(self):
+        index = self.build()
+        index.add({"id": "wrap", "name": "Chicken Wrap", "description": "Like a burger, but wrapped"})
+        ids, total = index.search("burger")
+        assert ids == ["burger", "wrap"]
+        assert total == 2
+
+    def test_all_terms_must_match_and_last_is_prefix(self):
+        index = self.build()
+        assert index.search("cheese marg")[0] == ["pizza"]
+        assert index.search("chee")[1] == 3
+        assert index.search("cheese sushi") == ([], 0)
+
+    def test_user_input_is_not_a_regex(self):
+        index = self.build()
+        assert index.search(".*") == ([], 0)
+        assert index.search("(burger")[0] == ["burger"]
+
+    def test_pagination(self):
+        index = self.build()
+        first, total = index.search("cheese", limit=2)
+        second, _ = index.search("cheese", limit=2, offset=2)
+        assert total == 3
+        assert len(first) == 2 and len(second) == 1
+        assert set(first + second) == {"burger", "pizza", "salad"}
+
+    def test_replace_and_remove(self):
+        index = self.build()
+        index.add({"id": "burger", "name": "Veggie Burger", "description": ""})
+        assert index.search("beef") == ([], 0)
+        assert index.search("veggie")[0] == ["burger"]
+        index.remove("burger")
+        assert index.search("burger") == ([], 0)
+        assert "veggie" not in index.vocabulary
+
+    def test_large_queries_stop_at_the_page(self, monkeypatch):
+        index = server.SearchIndex({"name": 3, "description": 1})
+        for n in range(400):
+            index.add({"id": f"p{n:03d}", "name": "spicy ramen" if n % 2 else "ramen",
+                       "description": "spicy" if n % 5 == 0 else ""})
+        monkeypatch.setattr(server, "SEARCH_FULL_SCAN_POSTINGS", 0)
+        monkeypatch.setattr(server, "SEARCH_TOTAL_SAMPLE", 400)
+        monkeypatch.setattr(index, "_scan", lambda *args: pytest.fail("scanned every posting"))
+        ids, total = index.search("spicy ramen", limit=10)
+        # Spicy in both name and description ranks first
+        assert len(ids) == 10 and all(int(doc_id[1:]) % 10 == 5 for doc_id in ids)
+        assert total == 240
+        assert index.search("spicy ramen", limit=10, offset=235) == (index.search("spicy ramen", 240)[0][235:], 240)
+
+class TestSearchRoute:
+    """Test /search serves ranked documents from the index"""
+
+    def test_search_all(self, fake_db):
+        fake_db.seed("stores", [{"id": "s1", "name": "Sushi Express"}, {"id": "s2", "name": "Fresh Foods"}])
+        fake_db.seed("products", [{"id": "p1", "name": "Salmon Sushi Platter", "description": "Premium salmon"}])
+        asyncio.run(server.refresh_search_indexes())
+        result = asyncio.run(server.search_all(q="sushi"))
+        assert [s["id"] for s in result["stores"]] == ["s1"]
+        assert [p["id"] for p in result["products"]] == ["p1"]
+        assert result["total_stores"] == 1
+
+    def test_rebuild_swaps_in_a_fresh_index(self, fake_db):
+        live = server.product_search
+        live.add({"id": "p0", "name": "Masala Dosa", "description": ""})
+        fake_db.seed("products", [{"id": "p1", "name": "Salmon Sushi Platter", "description": ""}])
+        asyncio.run(server.content_versions.bump("catalog"))
+        asyncio.run(server.refresh_search_indexes())
+        # Searches that held the old index kept seeing it whole during the reload
+        assert live.search("dosa")[0] == ["p0"]
+        assert server.product_search is not live
+        assert server.product_search.search("sushi")[0] == ["p1"]
+
+    def test_own_write_skips_the_reload(self, fake_db, monkeypatch):
+        asyncio.run(server.refresh_search_indexes())
+        asyncio.run(server.catalog_written({"id": "p1", "name": "Paneer Tikka", "description": "", "store_id": "s1"}))
+        monkeypatch.setattr(server, "rebuild_search_index", lambda *args: pytest.fail("reloaded a search index"))
+        monkeypatch.setattr(server, "rebuild_suggest_index", lambda: pytest.fail("reloaded the suggest index"))
+        asyncio.run(server.refresh_search_indexes())
+        assert server.product_search.search("paneer")[0] == ["p1"]
+
+    def test_peer_write_between_bumps_is_not_lost(self, fake_db, monkeypatch):
+        a, b = current_worker(), new_worker()
+        for worker in (a, b):
+            switch_to(monkeypatch, worker)
+            asyncio.run(server.refresh_search_indexes())
+            worker.update(current_worker())
+        peer = {"id": "p1", "name": "Paneer Tikka", "description": "", "store_id": "s1"}
+        fake_db.seed("products", [peer])
+        asyncio.run(server.catalog_written(peer))
+        switch_to(monkeypatch, a)
+        own = {"id": "p2", "name": "Spicy Ramen", "description": "", "store_id": "s1"}
+        fake_db.seed("products", [own])
+        asyncio.run(server.catalog_written(own))
+        asyncio.run(server.refresh_search_indexes())
+        assert server.product_search.search("paneer")[0] == ["p1"]
+        assert server.product_search.search("ramen")[0] == ["p2"]
+        assert [s["id"] for s in asyncio.run(server.search_suggest(prefix="pan"))["suggestions"]] == ["p1"]
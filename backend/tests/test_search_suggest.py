@@ -0,0 +1,102 @@
+"""Test typeahead suggestions from the in-memory prefix index"""
+import asyncio
+import pytest
+from fastapi import Response
+import server
+from conftest import make_request
+
+class TestSuggestIndex:
+    """Test prefix matching, popularity ranking and incremental updates"""
+
+    def build(self):
+        index = server.SuggestIndex()
+        index.load(
+            [{"id": "s1", "name": "Sushi Express", "total_orders": 234},
+             {"id": "s2", "name": "Fresh Foods Kitchen", "total_orders": 156}],
+            [{"id": "p1", "name": "Salmon Sushi Platter", "store_id": "s1"},
+             {"id": "p2", "name": "Classic Burger", "store_id": "s2"},
+             {"id": "p3", "name": "Fresh Salad", "store_id": "s2"}],
+        )
+        return index
+
+    def test_matches_any_word_start(self):
+        index = self.build()
+        assert {s["id"] for s in index.suggest("sus")} == {"s1", "p1"}
+        assert [s["id"] for s in index.suggest("salmon su")] == ["p1"]
+        assert index.suggest("ushi") == []
+
+    def test_ranked_by_store_popularity(self):
+        index = self.build()
+        # Name-start matches of the most popular store come first, stores before their products
+        assert [s["id"] for s in index.suggest("s")][:2] == ["s1", "p1"]
+        assert [s["id"] for s in index.suggest("fresh")] == ["s2", "p3"]
+
+    def test_incremental_updates(self):
+        index = self.build()
+        index.add_store({"id": "s2", "name": "Fresh Foods Kitchen", "total_orders": 999})
+        assert [s["id"] for s in index.suggest("s")][0] == "p3"
+        index.add_product({"id": "p2", "name": "Veggie Burger", "store_id": "s2"})
+        assert index.suggest("classic") == []
+        assert [s["id"] for s in index.suggest("veg")] == ["p2"]
+
+    def test_unchanged_product_is_not_reindexed(self, monkeypatch):
+        index = self.build()
+        monkeypatch.setattr(index, "_put", lambda *args: pytest.fail("re-indexed an unchanged product"))
+        index.add_product({"id": "p1", "name": "Salmon Sushi Platter", "store_id": "s1", "image": "new.jpg"})
+
+    def test_top_k_refill_scan_is_bounded(self, monkeypatch):
+        index = server.SuggestIndex()
+        stores = [{"id": f"s{n}", "name": f"Store {n}", "total_orders": n} for n in range(50)]
+        index.load(stores, [{"id": f"p{n}", "name": f"Soup {n}", "store_id": f"s{n % 50}"}
+                            for n in range(5 * server.SUGGEST_SCAN_LIMIT)])
+        top = [s["id"] for s in index.suggest("s", server.SUGGEST_MAX_RESULTS)]
+        limits = []
+        scan = index._scan
+        monkeypatch.setattr(index, "_scan", lambda prefix, limit=None: limits.append(limit) or scan(prefix, limit))
+        moved = next(doc_id for doc_id in top if doc_id.startswith("p"))
+        index.add_product({"id": moved, "name": "Dosa", "store_id": "s49"})
+        assert limits and all(limit == server.SUGGEST_SCAN_LIMIT for limit in limits)
+        assert [s["id"] for s in index.suggest("s", server.SUGGEST_MAX_RESULTS)][:-1] == [i for i in top if i != moved]
+
+    def test_prefix_is_normalized(self):
+        index = self.build()
+        assert [s["id"] for s in index.suggest("  SUSHI   ex")] == ["s1"]
+        assert index.suggest("*") == []
+
+class TestSuggestRoute:
+    """Test /search/suggest stays in sync with catalog writes"""
+
+    def test_new_store_is_suggested(self, fake_db):
+        merchant = {"id": "m1", "name": "Merchant", "roles": ["merchant"], "active_role": "merchant"}
+        asyncio.run(server.create_store(server.StoreCreate(name="Dosa Corner"), user=merchant))
+        result = asyncio.run(server.search_suggest(prefix="dos"))
+        assert [s["text"] for s in result["suggestions"]] == ["Dosa Corner"]
+
+    def test_orders_resync_popularity_without_a_reload(self, fake_db, monkeypatch):
+        fake_db.seed("stores", [{"id": "s1", "name": "Sushi Express", "total_orders": 5},
+                                {"id": "s2", "name": "Soup Studio", "total_orders": 9}])
+        asyncio.run(server.refresh_search_indexes())
+        stores_version = asyncio.run(server.content_versions.get("stores"))
+        asyncio.run(server.store_popularity_changed({"id": "s1", "name": "Sushi Express", "total_orders": 6}))
+        assert asyncio.run(server.content_versions.get("stores")) == stores_version
+        # Another worker's order; this worker only re-reads store totals
+        asyncio.run(fake_db._db.stores.update_one({"id": "s1"}, {"$set": {"total_orders": 50}}))
+        asyncio.run(server.content_versions.bump("popularity"))
+        monkeypatch.setattr(server, "rebuild_suggest_index", lambda: pytest.fail("reloaded the suggest index"))
+        monkeypatch.setattr(server, "rebuild_search_index", lambda *args: pytest.fail("reloaded a search index"))
+        asyncio.run(server.refresh_search_indexes())
+        result = asyncio.run(server.search_suggest(prefix="s"))
+        assert [s["id"] for s in result["suggestions"]] == ["s1", "s2"]
+
+    def test_store_etag_follows_order_counts_only_when_shown(self, fake_db):
+        fake_db.seed("stores", [{"id": "s1", "name": "Sushi Express", "total_orders": 5}])
+
+        def etag(fields=""):
+            response = Response()
+            asyncio.run(server.get_stores(make_request("/api/stores", query=f"fields={fields}"), response, fields=fields))
+            return response.headers["etag"]
+
+        summary, counts = etag(), etag("name,total_orders")
+        asyncio.run(server.store_popularity_changed({"id": "s1", "name": "Sushi Express", "total_orders": 6}))
+        assert etag() == summary
+        assert etag("name,total_orders") != counts
@@ -0,0 +1,118 @@
+"""Test list endpoints return summaries and honour ?fields= projections"""
+import asyncio
+import json
+import pytest
+from fastapi import HTTPException, Response
+import server
+from conftest import make_request, seed_menu
+
+CUSTOMER = {"id": "u1", "name": "Customer", "roles": ["customer"], "active_role": "customer"}
+STORE = {"id": "s1", "name": "Store", "merchant_id": "m1", "location": server.geo_point(12.97, 77.59)}
+
+def seed_full_orders(db, count, item_count=5, **fields):
+    """Orders shaped exactly as checkout stores them"""
+    lines = [{"product_id": f"p{n}", "variant_id": f"v{n}", "size_id": f"z{n}", "quantity": 2, "price": 120.0,
+              "product_name": f"Product {n}", "variant_name": "Regular", "size_name": "Medium"}
+             for n in range(item_count)]
+    checkout = server.CheckoutRequest(delivery_address="Flat 4B, 12th Main Road, Indiranagar, Bengaluru",
+                                      lat=12.9716, lng=77.5946)
+    orders = []
+    for n in range(count):
+        order = server.assemble_order(CUSTOMER, checkout, STORE, lines, 1200.0, 3.2, n + 1)
+        orders.append({**order, "id": f"o{n:03d}", "created_at": f"2024-01-01T00:00:{n:02d}", **fields})
+    db.seed("orders", orders)
+    return orders
+
+class TestSparseFields:
+    """Test sparse_fields"""
+
+    def test_summary_by_default_with_page_keys(self):
+        names = server.sparse_fields("", server.ORDER_SUMMARY_FIELDS, server.ORDER_EXTRA_FIELDS)
+        assert set(names) == {"id", "created_at", *server.ORDER_SUMMARY_FIELDS}
+
+    def test_overlapping_paths_collapse(self):
+        assert server.sparse_fields("items.quantity, items,total", (), ("items", "total")) == [
+            "created_at", "id", "items", "total"]
+        assert server.sparse_fields("items.quantity,items.product_name", (), ("items",)) == [
+            "created_at", "id", "items.product_name", "items.quantity"]
+
+    @pytest.mark.parametrize("fields", ["_id", "items.$", "total;drop", "a..b", ",".join(f"f{n}" for n in range(31))])
+    def test_rejects_bad_names(self, fields):
+        with pytest.raises(HTTPException) as exc:
+            server.sparse_fields(fields, (), ())
+        assert exc.value.status_code == 400
+
+    @pytest.mark.parametrize("fields", ["otp", "status,otp", "claimed_by", "otp.code"])
+    def test_rejects_fields_outside_the_allowlist(self, fields):
+        with pytest.raises(HTTPException) as exc:
+            server.sparse_fields(fields, server.ORDER_SUMMARY_FIELDS, server.ORDER_EXTRA_FIELDS)
+        assert exc.value.status_code == 400
+
+class TestOrderLists:
+    """Test order list summaries"""
+
+    def test_summary_is_an_order_of_magnitude_smaller(self, fake_db):
+        full = seed_full_orders(fake_db, 20)
+        orders = asyncio.run(server.get_orders(Response(), user=CUSTOMER))
+        assert set(orders[0]) == {"id", "created_at", *server.ORDER_SUMMARY_FIELDS}
+        assert len(json.dumps(full)) / len(json.dumps(orders)) > 10
+        detail = asyncio.run(server.get_order(orders[0]["id"], user=CUSTOMER))
+        assert detail["otp"] and len(detail["items"]) == 5
+
+    def test_fields_project_nested_paths(self, fake_db):
+        seed_full_orders(fake_db, 1, item_count=2)
+        order, = asyncio.run(server.get_orders(Response(), fields="total,items.quantity", user=CUSTOMER))
+        assert order == {"id": "o000", "created_at": "2024-01-01T00:00:00", "total": order["total"],
+                         "items": [{"quantity": 2}, {"quantity": 2}]}
+
+    def test_cursor_survives_projection(self, fake_db):
+        seed_full_orders(fake_db, 5)
+        response, seen = Response(), []
+        seen += [o["id"] for o in asyncio.run(server.get_orders(response, limit=3, fields="status", user=CUSTOMER))]
+        cursor = response.headers["x-next-cursor"]
+        seen += [o["id"] for o in asyncio.run(server.get_orders(Response(), limit=3, cursor=cursor,
+                                                                fields="status", user=CUSTOMER))]
+        assert seen == ["o004", "o003", "o002", "o001", "o000"]
+
+    def test_available_orders_are_summaries(self, fake_db):
+        seed_full_orders(fake_db, 2, status="accepted")
+        agent = {"id": "a1", "roles": ["agent"], "active_role": "agent"}
+        orders = asyncio.run(server.get_available_orders(Response(), user=agent))
+        assert [o["id"] for o in orders] == ["o001", "o000"]
+        assert "otp" not in orders[0] and "items" not in orders[0]
+        orders = asyncio.run(server.get_available_orders(Response(), fields="delivery_address,distance_km", user=agent))
+        assert set(orders[0]) == {"id", "created_at", "delivery_address", "distance_km"}
+
+    def test_pool_never_returns_the_otp(self, fake_db):
+        seed_full_orders(fake_db, 2, status="accepted")
+        agent = {"id": "a1", "roles": ["agent"], "active_role": "agent"}
+        for fields in ("otp", "delivery_address,otp"):
+            with pytest.raises(HTTPException) as exc:
+                asyncio.run(server.get_available_orders(Response(), fields=fields, user=agent))
+            assert exc.value.status_code == 400 and "otp" in exc.value.detail
+        with pytest.raises(HTTPException):
+            asyncio.run(server.get_orders(Response(), fields="otp", user=CUSTOMER))
+        # The customer's own order still shows it
+        assert asyncio.run(server.get_order("o000", user=CUSTOMER))["otp"]
+
+class TestCatalogLists:
+    """Test product and store list summaries"""
+
+    def test_product_summary_skips_hydration(self, fake_db):
+        seed_menu(fake_db, "s1", 5)
+        products = asyncio.run(server.get_products(make_request(), Response(), store_id="s1"))
+        assert len(products) == 5 and "variants" not in products[0]
+        assert fake_db.queries == 2  # content versions, products
+
+    def test_trimmed_products_leave_the_cache_whole(self, fake_db):
+        seed_menu(fake_db, "s1", 2)
+        products = asyncio.run(server.get_products(make_request(), Response(), store_id="s1", fields="variants"))
+        assert set(products[0]) == {"id", "variants"}
+        assert asyncio.run(server.get_product("s1-p0"))["name"] == "Product 0"
+
+    def test_store_summary(self, fake_db):
+        fake_db.seed("stores", [{**STORE, "address": "MG Road", "working_hours": "9-21", "created_at": "2024"}])
+        store, = asyncio.run(server.get_stores(make_request(), Response()))
+        assert "location" not in store and "working_hours" not in store
+        store, = asyncio.run(server.get_stores(make_request(), Response(), fields="location"))
+        assert store["location"] == STORE["location"]
@@ -0,0 +1,47 @@
+"""Test per-store menu snapshots and their incremental maintenance"""
+import asyncio
+import server
+from conftest import MERCHANT, seed_menu
+
+class TestStoreMenus:
+    """Test store_menus snapshot reads and writes"""
+
+    def setup_store(self, fake_db, product_count=3):
+        fake_db.seed("stores", [{"id": "s1", "name": "Store", "is_open": True, "total_orders": 0}])
+        seed_menu(fake_db, "s1", product_count, variants_per_product=1, sizes_per_variant=1)
+        return asyncio.run(server.get_store("s1"))
+
+    def test_store_page_is_one_snapshot_read(self, fake_db):
+        first = self.setup_store(fake_db)
+        assert first["menu_version"] == 1
+        server.store_cache.clear()
+        fake_db.queries = 0
+        store = asyncio.run(server.get_store("s1"))
+        assert fake_db.queries == 1
+        assert store == first
+
+    def test_create_size_patches_only_that_product(self, fake_db):
+        self.setup_store(fake_db)
+        data = server.SizeCreate(variant_id="s1-p1-v0", name="Jumbo", price_modifier=50)
+        asyncio.run(server.create_size(data, user=MERCHANT))
+        store = asyncio.run(server.get_store("s1"))
+        assert store["menu_version"] == 2
+        assert [p["id"] for p in store["products"]] == ["s1-p0", "s1-p1", "s1-p2"]
+        assert [s["name"] for s in store["products"][1]["variants"][0]["sizes"]] == ["Size 0", "Jumbo"]
+
+    def test_new_product_is_appended(self, fake_db):
+        self.setup_store(fake_db)
+        data = server.ProductCreate(name="New Dish", store_id="s1")
+        created = asyncio.run(server.create_product(data, user=MERCHANT))
+        store = asyncio.run(server.get_store("s1"))
+        assert store["menu_version"] == 2
+        assert store["products"][-1]["id"] == created["id"]
+        assert store["products"][-1]["variants"] == []
+
+    def test_store_update_patches_snapshot(self, fake_db):
+        self.setup_store(fake_db)
+        asyncio.run(server.update_store("s1", server.StoreUpdate(is_open=False), user=MERCHANT))
+        store = asyncio.run(server.get_store("s1"))
+        assert store["is_open"] is False
+        assert store["menu_version"] == 2
+        assert len(store["products"]) == 3
@@ -39,7 +39,7 @@ class TestStoresAndProducts:
 
     def test_get_products(self, api_client):
         """Test fetching all products with variants and sizes"""
-        response = api_client.get(f"{BASE_URL}/api/products")
+        response = api_client.get(f"{BASE_URL}/api/products?fields=name,store_id,variants")
         assert response.status_code == 200
         data = response.json()
         assert isinstance(data, list)
@@ -65,7 +65,7 @@ class TestStoresAndProducts:
     def test_get_product_by_id(self, api_client):
         """Test fetching product by ID"""
         # First get a product ID
-        products = api_client.get(f"{BASE_URL}/api/products").json()
+        products = api_client.get(f"{BASE_URL}/api/products?fields=name,store_id,variants").json()
         product_id = products[0]["id"]
         
         response = api_client.get(f"{BASE_URL}/api/products/{product_id}")
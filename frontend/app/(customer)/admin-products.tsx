@@ -8,7 +8,7 @@ export default function AdminProducts() {
   const [products, setProducts] = useState<any[]>([]);
   const [loading, setLoading] = useState(true);
   useEffect(() => { load(); }, []);
-  const load = async () => { try { setProducts(await api.getProducts()); } catch (e) { console.log(e); } finally { setLoading(false); } };
+  const load = async () => { try { setProducts(await api.getProducts('fields=name,description,image,base_type,variants')); } catch (e) { console.log(e); } finally { setLoading(false); } };
   if (loading) return <SafeAreaView style={s.safe}><View style={s.center}><ActivityIndicator size="large" color={Colors.roles.admin} /></View></SafeAreaView>;
   return (
     <SafeAreaView style={s.safe}>
@@ -2,9 +2,11 @@ import React, { useState, useEffect, useCallback } from 'react';
 import { View, Text, StyleSheet, FlatList, TouchableOpacity, RefreshControl, ActivityIndicator, Alert, TextInput } from 'react-native';
 import { SafeAreaView } from 'react-native-safe-area-context';
 import { Ionicons } from '@expo/vector-icons';
-import { api } from '../../utils/api';
+import { api, subscribe } from '../../utils/api';
 import { Colors, Spacing, Radius, FontSizes, Shadows } from '../../constants/Colors';
 
+const ORDER_FIELDS = 'order_number,store_name,status,total,agent_id,delivery_address,distance_km';
+
 export default function AgentDeliveries() {
   const [orders, setOrders] = useState<any[]>([]);
   const [available, setAvailable] = useState<any[]>([]);
@@ -14,7 +16,7 @@ export default function AgentDeliveries() {
 
   const load = useCallback(async () => {
     try {
-      const [avail, my] = await Promise.all([api.getAvailableOrders(), api.getOrders()]);
+      const [avail, my] = await Promise.all([api.getAvailableOrders(ORDER_FIELDS), api.getOrders('', ORDER_FIELDS)]);
       setAvailable(avail);
       setOrders(my);
     } catch (e) { console.log(e); }
@@ -23,6 +25,42 @@ export default function AgentDeliveries() {
 
   useEffect(() => { load(); }, [load]);
 
+  // The dispatch socket pushes pool changes, so the list stays current without polling
+  useEffect(() => {
+    let close: (() => void) | undefined;
+    let cancelled = false;
+    subscribe('/dispatch/ws', (event) => {
+      if (event.type === 'order_available') {
+        setAvailable(prev => prev.some(o => o.id === event.order.id) ? prev : [...prev, { ...event.order, status: 'accepted' }]);
+      } else if (event.type === 'order_taken') {
+        setAvailable(prev => prev.filter(o => o.id !== event.order_id));
+      }
+    }).then(fn => { if (cancelled) fn(); else close = fn; });
+    return () => { cancelled = true; close?.(); };
+  }, []);
+
+  // My orders: assignments and status changes made elsewhere (merchant marking ready, etc.)
+  useEffect(() => {
+    let close: (() => void) | undefined;
+    let cancelled = false;
+    subscribe('/orders/ws', (event) => {
+      if (event.type !== 'order') return;
+      if (event.order.agent_id) { load(); return; }  // newly assigned to me: fetch the full order
+      setOrders(prev => prev.map(o => o.id === event.order.id ? { ...o, ...event.order } : o));
+    }).then(fn => { if (cancelled) fn(); else close = fn; });
+    return () => { cancelled = true; close?.(); };
+  }, [load]);
+
+  const handleTakeNext = async () => {
+    try {
+      const { order } = await api.claimNextOrder({ order_by: 'oldest' });
+      if (!order) { Alert.alert('No orders', 'Nothing is waiting for pickup'); return; }
+      await api.assignOrder(order.id);
+      load();
+      Alert.alert('Assigned!', `${order.order_number} from ${order.store_name}`);
+    } catch (e: any) { Alert.alert('Error', e.message); }
+  };
+
   const handleAssign = async (orderId: string) => {
     try { await api.assignOrder(orderId); load(); Alert.alert('Assigned!', 'Order assigned to you'); }
     catch (e: any) { Alert.alert('Error', e.message); }
@@ -54,6 +92,11 @@ export default function AgentDeliveries() {
           </TouchableOpacity>
         ))}
       </View>
+      {tab === 'available' && (
+        <TouchableOpacity testID="take-next-order" style={[s.actionBtn, s.takeNext]} onPress={handleTakeNext}>
+          <Text style={s.actionText}>Take Next Order</Text>
+        </TouchableOpacity>
+      )}
       <FlatList data={data} keyExtractor={i => i.id} contentContainerStyle={s.list}
         refreshControl={<RefreshControl refreshing={false} onRefresh={load} />}
         ListEmptyComponent={<View style={s.center}><Ionicons name="bicycle-outline" size={48} color={Colors.dark.border} /><Text style={s.emptyText}>No orders</Text></View>}
@@ -110,6 +153,7 @@ const s = StyleSheet.create({
   address: { fontSize: FontSizes.xs, color: Colors.dark.textSecondary, marginTop: 2 },
   total: { fontSize: FontSizes.base, fontWeight: '700', color: Colors.roles.agent, marginTop: 8 },
   actionBtn: { backgroundColor: Colors.roles.agent, paddingVertical: 12, borderRadius: Radius.md, alignItems: 'center', marginTop: 12 },
+  takeNext: { marginHorizontal: Spacing.xl },
   actionText: { fontSize: FontSizes.sm, fontWeight: '700', color: '#000' },
   otpRow: { flexDirection: 'row', gap: 8, marginTop: 12 },
   otpInput: { flex: 1, backgroundColor: Colors.dark.background, borderRadius: Radius.md, padding: 12, color: Colors.dark.textPrimary, fontSize: FontSizes.lg, textAlign: 'center', letterSpacing: 4, borderWidth: 1, borderColor: Colors.dark.border },
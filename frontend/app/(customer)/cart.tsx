@@ -8,6 +8,7 @@ import { useRouter } from 'expo-router';
 import { Ionicons } from '@expo/vector-icons';
 import { api } from '../../utils/api';
 import { Colors, Spacing, Radius, FontSizes, Shadows } from '../../constants/Colors';
+import { DELIVERY_LOCATION } from '../../constants/Location';
 
 export default function CartScreen() {
   const [cart, setCart] = useState<any>(null);
@@ -18,7 +19,7 @@ export default function CartScreen() {
 
   const loadCart = useCallback(async () => {
     try {
-      const data = await api.getCart();
+      const data = await api.getCart(DELIVERY_LOCATION);
       setCart(data);
     } catch (e) {
       console.log('Cart error:', e);
@@ -44,9 +45,7 @@ export default function CartScreen() {
     try {
       const order = await api.checkout({
         delivery_address: address,
-        lat: 12.9716,
-        lng: 77.5946,
-        distance_km: cart.distance_km || 2.0,
+        ...DELIVERY_LOCATION,
       });
       Alert.alert('Order Placed!', `Order #${order.order_number}\nOTP: ${order.otp}`, [
         { text: 'View Order', onPress: () => router.push(`/order/${order.id}`) },
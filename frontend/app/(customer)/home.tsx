@@ -9,6 +9,7 @@ import { Ionicons } from '@expo/vector-icons';
 import { useAuth } from '../../context/AuthContext';
 import { api } from '../../utils/api';
 import { Colors, Spacing, Radius, FontSizes, Shadows } from '../../constants/Colors';
+import { DELIVERY_LOCATION } from '../../constants/Location';
 
 const { width } = Dimensions.get('window');
 
@@ -19,10 +20,15 @@ function CustomerHome() {
   const [banners, setBanners] = useState<any[]>([]);
   const [stores, setStores] = useState<any[]>([]);
   const [products, setProducts] = useState<any[]>([]);
+  const [fees, setFees] = useState<Record<string, number>>({});
   const [loading, setLoading] = useState(true);
   const [refreshing, setRefreshing] = useState(false);
   const loadData = useCallback(async () => {
-    try { const [b, s, p] = await Promise.all([api.getBanners(), api.getStores(), api.getProducts()]); setBanners(b); setStores(s); setProducts(p); }
+    try {
+      const [b, s, p] = await Promise.all([api.getBanners(), api.getStores(), api.getProducts('fields=name,image,variants')]); setBanners(b); setStores(s); setProducts(p);
+      const { quotes } = await api.quoteBulk({ ...DELIVERY_LOCATION, items: s.map((store: any) => ({ store_id: store.id })) });
+      setFees(Object.fromEntries(quotes.map((q: any) => [q.store_id, q.delivery_fee])));
+    }
     catch (e) { console.log('Error:', e); }
     finally { setLoading(false); setRefreshing(false); }
   }, []);
@@ -43,7 +49,8 @@ function CustomerHome() {
         <View style={s.section}><Text style={s.sectionTitle}>Shop by Store</Text><ScrollView horizontal showsHorizontalScrollIndicator={false}>
           {stores.map(store => <TouchableOpacity key={store.id} testID={`store-card-${store.id}`} style={s.storeCard} onPress={() => router.push(`/store/${store.id}`)}>
             <Image source={{ uri: store.image }} style={s.storeImage} /><View style={s.storeInfo}><Text style={s.storeName} numberOfLines={1}>{store.name}</Text>
-            <View style={s.storeMetaRow}><Ionicons name="star" size={12} color="#FFB800" /><Text style={s.storeMeta}>{store.rating || '4.5'}</Text><Text style={s.storeDot}>·</Text><Text style={s.storeMeta}>{store.is_open ? 'Open' : 'Closed'}</Text></View></View>
+            <View style={s.storeMetaRow}><Ionicons name="star" size={12} color="#FFB800" /><Text style={s.storeMeta}>{store.rating || '4.5'}</Text><Text style={s.storeDot}>·</Text><Text style={s.storeMeta}>{store.is_open ? 'Open' : 'Closed'}</Text></View>
+            {fees[store.id] !== undefined && <Text style={s.storeMeta}>₹{fees[store.id].toFixed(0)} delivery</Text>}</View>
           </TouchableOpacity>)}
         </ScrollView></View>
         <View style={s.section}><Text style={s.sectionTitle}>Popular Items</Text><View style={s.itemGrid}>
@@ -3,9 +3,11 @@ import { View, Text, StyleSheet, FlatList, TouchableOpacity, RefreshControl, Act
 import { SafeAreaView } from 'react-native-safe-area-context';
 import { useRouter } from 'expo-router';
 import { Ionicons } from '@expo/vector-icons';
-import { api } from '../../utils/api';
+import { api, subscribe } from '../../utils/api';
 import { Colors, Spacing, Radius, FontSizes, Shadows } from '../../constants/Colors';
 
+const ORDER_FIELDS = 'order_number,user_name,status,total,items.product_name,items.quantity';
+
 const statusColors: Record<string, string> = { placed: '#3B82F6', accepted: '#8B5CF6', preparing: '#F59E0B', ready_for_pickup: '#06B6D4', assigned: '#6366F1', picked_up: '#F97316', delivered: '#10B981', cancelled: '#EF4444' };
 
 export default function MerchantOrders() {
@@ -15,13 +17,26 @@ export default function MerchantOrders() {
   const router = useRouter();
 
   const loadOrders = useCallback(async () => {
-    try { const data = await api.getOrders(); setOrders(data); }
+    try { const data = await api.getOrders('', ORDER_FIELDS); setOrders(data); }
     catch (e) { console.log('Orders error:', e); }
     finally { setLoading(false); setRefreshing(false); }
   }, []);
 
   useEffect(() => { loadOrders(); }, [loadOrders]);
 
+  // New orders and status changes arrive over the socket instead of by refetching the board
+  useEffect(() => {
+    let close: (() => void) | undefined;
+    let cancelled = false;
+    subscribe('/orders/ws', (event) => {
+      if (event.type !== 'order') return;
+      setOrders(prev => prev.some(o => o.id === event.order.id)
+        ? prev.map(o => o.id === event.order.id ? { ...o, ...event.order } : o)
+        : [event.order, ...prev]);
+    }).then(fn => { if (cancelled) fn(); else close = fn; });
+    return () => { cancelled = true; close?.(); };
+  }, []);
+
   const handleAccept = async (orderId: string) => {
     try { await api.acceptOrder(orderId); loadOrders(); Alert.alert('Success', 'Order accepted!'); }
     catch (e: any) { Alert.alert('Error', e.message); }
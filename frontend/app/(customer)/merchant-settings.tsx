@@ -16,7 +16,7 @@ export default function MerchantSettings() {
   }, []);
 
   const loadStores = async () => {
-    try { const data = await api.getStores(); setStores(data.filter((s: any) => s.merchant_id === user?.id)); }
+    try { const data = await api.getStores(undefined, 'name,address,is_open,working_hours,rating,total_orders,merchant_id'); setStores(data.filter((s: any) => s.merchant_id === user?.id)); }
     catch (e) { console.log(e); }
     finally { setLoading(false); }
   };
@@ -6,6 +6,8 @@ import { Ionicons } from '@expo/vector-icons';
 import { api } from '../../utils/api';
 import { Colors, Spacing, Radius, FontSizes, Shadows } from '../../constants/Colors';
 
+const ORDER_FIELDS = 'order_number,store_name,status,total,items.quantity';
+
 const statusColors: Record<string, string> = {
   placed: '#3B82F6', accepted: '#8B5CF6', preparing: '#F59E0B',
   ready_for_pickup: '#06B6D4', assigned: '#6366F1', picked_up: '#F97316',
@@ -26,7 +28,7 @@ export default function OrdersScreen() {
 
   const loadOrders = useCallback(async () => {
     try {
-      const data = await api.getOrders();
+      const data = await api.getOrders('', ORDER_FIELDS);
       setOrders(data);
     } catch (e) {
       console.log('Orders error:', e);
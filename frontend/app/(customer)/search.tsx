@@ -9,16 +9,29 @@ import { Colors, Spacing, Radius, FontSizes, Shadows } from '../../constants/Col
 export default function SearchScreen() {
   const [query, setQuery] = useState('');
   const [results, setResults] = useState<{ stores: any[]; products: any[] }>({ stores: [], products: [] });
+  const [suggestions, setSuggestions] = useState<any[]>([]);
   const [loading, setLoading] = useState(false);
   const [searched, setSearched] = useState(false);
   const router = useRouter();
 
-  const handleSearch = async (text: string) => {
+  const handleChange = async (text: string) => {
     setQuery(text);
-    if (text.length < 2) { setResults({ stores: [], products: [] }); setSearched(false); return; }
+    setSearched(false);
+    if (!text.trim()) { setSuggestions([]); return; }
+    try {
+      const data = await api.suggest(text);
+      setSuggestions(data.suggestions);
+    } catch (e) {
+      console.log('Suggest error:', e);
+    }
+  };
+
+  const handleSearch = async () => {
+    if (query.trim().length < 2) return;
+    setSuggestions([]);
     setLoading(true);
     try {
-      const data = await api.search(text);
+      const data = await api.search(query);
       setResults(data);
       setSearched(true);
     } catch (e) {
@@ -38,11 +51,13 @@ export default function SearchScreen() {
           placeholder="Search stores & items..."
           placeholderTextColor={Colors.light.textSecondary}
           value={query}
-          onChangeText={handleSearch}
+          onChangeText={handleChange}
+          onSubmitEditing={handleSearch}
+          returnKeyType="search"
           autoFocus
         />
         {query ? (
-          <TouchableOpacity testID="search-clear-btn" onPress={() => { setQuery(''); setResults({ stores: [], products: [] }); setSearched(false); }}>
+          <TouchableOpacity testID="search-clear-btn" onPress={() => { setQuery(''); setResults({ stores: [], products: [] }); setSuggestions([]); setSearched(false); }}>
             <Ionicons name="close-circle" size={20} color={Colors.light.textSecondary} />
           </TouchableOpacity>
         ) : null}
@@ -50,6 +65,25 @@ export default function SearchScreen() {
 
       {loading && <ActivityIndicator style={{ marginTop: 32 }} color={Colors.light.primary} />}
 
+      {!searched && !loading && suggestions.length > 0 && (
+        <FlatList
+          data={suggestions}
+          keyExtractor={(item) => `${item.type}-${item.id}`}
+          contentContainerStyle={styles.list}
+          keyboardShouldPersistTaps="handled"
+          renderItem={({ item }) => (
+            <TouchableOpacity
+              testID={`search-suggestion-${item.id}`}
+              style={styles.suggestionRow}
+              onPress={() => router.push(item.type === 'store' ? `/store/${item.id}` : `/product/${item.id}`)}
+            >
+              <Ionicons name={item.type === 'store' ? 'storefront-outline' : 'fast-food-outline'} size={18} color={Colors.light.textSecondary} />
+              <Text style={styles.suggestionText}>{item.text}</Text>
+            </TouchableOpacity>
+          )}
+        />
+      )}
+
       {searched && !loading && (
         <FlatList
           data={[
@@ -103,6 +137,11 @@ const styles = StyleSheet.create({
   resultType: { fontSize: 10, fontWeight: '700', color: Colors.light.primary, letterSpacing: 1 },
   resultName: { fontSize: FontSizes.base, fontWeight: '600', color: Colors.light.textPrimary, marginTop: 2 },
   resultDesc: { fontSize: FontSizes.xs, color: Colors.light.textSecondary, marginTop: 2 },
+  suggestionRow: {
+    flexDirection: 'row', alignItems: 'center', gap: 12, paddingVertical: 12,
+    borderBottomWidth: 1, borderBottomColor: Colors.light.border,
+  },
+  suggestionText: { flex: 1, fontSize: FontSizes.base, color: Colors.light.textPrimary },
   emptyContainer: { alignItems: 'center', marginTop: 60 },
   emptyText: { fontSize: FontSizes.base, color: Colors.light.textSecondary, marginTop: 12 },
 });
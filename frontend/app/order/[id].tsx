@@ -4,7 +4,7 @@ import { SafeAreaView } from 'react-native-safe-area-context';
 import { useLocalSearchParams, useRouter } from 'expo-router';
 import { TouchableOpacity } from 'react-native';
 import { Ionicons } from '@expo/vector-icons';
-import { api } from '../../utils/api';
+import { api, subscribe } from '../../utils/api';
 import { Colors, Spacing, Radius, FontSizes, Shadows } from '../../constants/Colors';
 
 const statusSteps = ['placed', 'accepted', 'preparing', 'ready_for_pickup', 'picked_up', 'delivered'];
@@ -20,6 +20,17 @@ export default function OrderDetail() {
     if (id) loadOrder();
   }, [id]);
 
+  // Status changes are pushed; the screen reads the order once and then only merges them
+  useEffect(() => {
+    if (!id) return;
+    let close: (() => void) | undefined;
+    let cancelled = false;
+    subscribe(`/orders/ws?order_id=${id}`, (event) => {
+      if (event.type === 'order') setOrder((prev: any) => prev ? { ...prev, ...event.order } : prev);
+    }).then(fn => { if (cancelled) fn(); else close = fn; });
+    return () => { cancelled = true; close?.(); };
+  }, [id]);
+
   const loadOrder = () => {
     api.getOrder(id!).then(setOrder).catch(console.log).finally(() => setLoading(false));
   };
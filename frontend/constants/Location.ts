@@ -0,0 +1,2 @@
+// Delivery coordinates; the server derives distances and fees from these
+export const DELIVERY_LOCATION = { lat: 12.9716, lng: 77.5946 };
@@ -6,6 +6,9 @@ async function getToken(): Promise<string | null> {
   return await AsyncStorage.getItem('auth_token');
 }
 
+// Last ETag and body per GET url, replayed when the server answers 304
+const etagCache = new Map<string, { etag: string; body: any }>();
+
 async function request(endpoint: string, options: RequestInit = {}): Promise<any> {
   const token = await getToken();
   const headers: Record<string, string> = {
@@ -16,12 +19,37 @@ async function request(endpoint: string, options: RequestInit = {}): Promise<any
     headers['Authorization'] = `Bearer ${token}`;
   }
   const url = `${API_BASE}/api${endpoint}`;
+  const isGet = !options.method || options.method === 'GET';
+  const cached = isGet ? etagCache.get(url) : undefined;
+  if (cached) {
+    headers['If-None-Match'] = cached.etag;
+  }
   const response = await fetch(url, { ...options, headers });
+  if (response.status === 304 && cached) {
+    return cached.body;
+  }
   if (!response.ok) {
     const error = await response.json().catch(() => ({ detail: 'Request failed' }));
     throw new Error(error.detail || `HTTP ${response.status}`);
   }
-  return response.json();
+  const body = await response.json();
+  const etag = response.headers.get('ETag');
+  if (isGet && etag) {
+    etagCache.set(url, { etag, body });
+  }
+  return body;
+}
+
+// Open an authenticated event socket; returns a function that closes it
+export async function subscribe(endpoint: string, onEvent: (event: any) => void): Promise<() => void> {
+  const token = await getToken();
+  const separator = endpoint.includes('?') ? '&' : '?';
+  const url = `${API_BASE.replace(/^http/, 'ws')}/api${endpoint}${separator}token=${encodeURIComponent(token || '')}`;
+  const socket = new WebSocket(url);
+  socket.onmessage = (message) => {
+    try { onEvent(JSON.parse(message.data)); } catch (e) { console.log(e); }
+  };
+  return () => socket.close();
 }
 
 export const api = {
@@ -38,25 +66,38 @@ export const api = {
   getProduct: (id: string) => request(`/products/${id}`),
 
   // Stores
-  getStores: (search?: string) => request(`/stores${search ? `?search=${search}` : ''}`),
+  getStores: (search?: string, fields?: string) =>
+    request(`/stores?${new URLSearchParams({ ...(search && { search }), ...(fields && { fields }) })}`),
   getStore: (id: string) => request(`/stores/${id}`),
   updateStore: (id: string, data: any) => request(`/stores/${id}`, { method: 'PUT', body: JSON.stringify(data) }),
 
   // Cart
-  getCart: () => request('/cart'),
+  getCart: (location?: { lat: number; lng: number }) =>
+    request(`/cart${location ? `?lat=${location.lat}&lng=${location.lng}` : ''}`),
   addToCart: (data: any) => request('/cart/add', { method: 'POST', body: JSON.stringify(data) }),
   updateCartItem: (data: any) => request('/cart/update', { method: 'PUT', body: JSON.stringify(data) }),
   clearCart: () => request('/cart/clear', { method: 'DELETE' }),
+  quoteBulk: (data: any) => request('/quotes/bulk', { method: 'POST', body: JSON.stringify(data) }),
 
   // Orders
   checkout: (data: any) => request('/orders', { method: 'POST', body: JSON.stringify(data) }),
-  getOrders: (status?: string) => request(`/orders${status ? `?status=${status}` : ''}`),
-  getAvailableOrders: () => request('/orders/available'),
+  getOrders: (status?: string, fields?: string) =>
+    request(`/orders?${new URLSearchParams({ ...(status && { status }), ...(fields && { fields }) })}`),
+  getAvailableOrders: (fields?: string) => request(`/orders/available${fields ? `?fields=${fields}` : ''}`),
   getOrder: (id: string) => request(`/orders/${id}`),
   updateOrderStatus: (id: string, status: string) =>
     request(`/orders/${id}/status`, { method: 'PUT', body: JSON.stringify({ status }) }),
   acceptOrder: (id: string) => request(`/orders/${id}/accept`, { method: 'PUT' }),
   assignOrder: (id: string) => request(`/orders/${id}/assign`, { method: 'PUT' }),
+  claimNextOrder: (data?: { order_by?: string; lat?: number; lng?: number }) =>
+    request('/dispatch/claim', { method: 'POST', body: JSON.stringify(data || {}) }),
+  releaseOrder: (id: string) => request(`/dispatch/${id}/release`, { method: 'POST' }),
+
+  // Agent location
+  reportLocation: (lat: number, lng: number) =>
+    request('/agents/location', { method: 'POST', body: JSON.stringify({ lat, lng }) }),
+  reportLocations: (points: { lat: number; lng: number; at?: number }[]) =>
+    request('/agents/location/batch', { method: 'POST', body: JSON.stringify({ points }) }),
   verifyOTP: (id: string, otp: string) =>
     request(`/orders/${id}/verify-otp`, { method: 'PUT', body: JSON.stringify({ otp }) }),
 
@@ -74,6 +115,7 @@ export const api = {
 
   // Search
   search: (q: string) => request(`/search?q=${encodeURIComponent(q)}`),
+  suggest: (prefix: string) => request(`/search/suggest?prefix=${encodeURIComponent(prefix)}`),
 
   // CMS
   getCms: () => request('/cms'),